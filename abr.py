@@ -0,0 +1,133 @@
+import array
+import fcntl
+import termios
+
+# SIOCOUTQ 与 TIOCOUTQ 是同一个 ioctl：socket 发送队列里还没被对端确认的字节数
+SIOCOUTQ = termios.TIOCOUTQ
+
+# 画质按步长量化，不同客户端落在同几个档位上，编码缓存才能共用
+QUALITY_STEP = 5
+# 连续这么多帧都没有积压才往上探一档
+UPGRADE_HOLD_FRAMES = 10
+# 队列里积压超过这么多帧认为拥塞
+CONGESTED_BACKLOG = 1.0
+# 积压低于这么多帧认为链路空闲
+IDLE_BACKLOG = 0.25
+_EWMA = 0.3
+
+
+def socket_unsent_bytes(sock):
+    """内核发送队列里尚未发出/确认的字节数，取不到时返回 0"""
+    buf = array.array('i', [0])
+    try:
+        fcntl.ioctl(sock.fileno(), SIOCOUTQ, buf)
+    except (OSError, ValueError, AttributeError):
+        return 0
+    return buf[0]
+
+
+class ClientRateController:
+    """
+    单个连接的自适应码率控制：根据内核发送队列积压 (SIOCOUTQ) 和实测吞吐选择画质、分辨率档位与帧率。
+    拥塞时先降画质，画质到底降分辨率，分辨率到底再降帧率；
+    恢复时先升帧率，再升画质，画质到顶后升一档分辨率 (画质从最低重新开始)。
+    level 0 是全分辨率，数字越大越小；finest_level 是客户端 ?res= 要求的档位，不会超过它。
+    每个客户端独立收敛到自己链路能承受的码率，不会互相拖累：
+    降下来的帧率由 send_delay() 给出等待时间，发送方睡到点再发，不占事件循环。
+    """
+    def __init__(self, min_quality=5, max_quality=30, min_fps=5, max_fps=30,
+                 initial_quality=20, quality_step=QUALITY_STEP, finest_level=0, coarsest_level=0):
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.quality_step = quality_step
+        self.quality = self._quantize(initial_quality)
+        self.fps = float(max_fps)
+        self.finest_level = finest_level
+        self.coarsest_level = max(coarsest_level, finest_level)
+        self.level = finest_level
+
+        self.throughput = 0.0      # 实测送达速率 (bytes/s, EWMA)
+        self.frame_bytes = 0.0     # 平均帧大小 (EWMA)
+        self.backlog_frames = 0.0  # 最近一次的积压帧数
+        self._sent_total = 0
+        self._last_delivered = 0
+        self._last_time = None
+        self._last_send = None
+        self._drain_frames = 0.0   # 上一帧 drain 阻塞的时长折合成帧数
+        self._clean_frames = 0
+
+    def _quantize(self, quality):
+        if quality >= self.max_quality:
+            return self.max_quality
+        q = int(quality) // self.quality_step * self.quality_step
+        return max(self.min_quality, min(q, self.max_quality))
+
+    @property
+    def frame_interval(self):
+        return 1.0 / self.fps
+
+    def send_delay(self, now):
+        """按当前帧率距离下一次允许发送还要等多久 (秒)，<= 0 表示现在就可以发"""
+        if self._last_send is None:
+            return 0.0
+        return self._last_send + self.frame_interval - now
+
+    def on_sent(self, nbytes, now):
+        """一帧交给 socket 后调用，now 是这一帧的发送时间"""
+        self._last_send = now
+        self._sent_total += nbytes
+        if self.frame_bytes:
+            self.frame_bytes += _EWMA * (nbytes - self.frame_bytes)
+        else:
+            self.frame_bytes = float(nbytes)
+
+    def on_drained(self, now):
+        """
+        writer.drain() 返回后调用。帧比内核发送缓冲大时，积压的部分挡在 drain 里而不在 SIOCOUTQ 里，
+        所以把 drain 阻塞的时长按当前帧率折合成帧数，一起算进积压。
+        """
+        if self._last_send is not None:
+            self._drain_frames = (now - self._last_send) / self.frame_interval
+
+    def update(self, unsent_bytes, now):
+        """发送下一帧之前调用：unsent_bytes 是内核 + 用户态缓冲里还没发出去的字节"""
+        delivered = self._sent_total - unsent_bytes
+        if self._last_time is not None:
+            dt = now - self._last_time
+            if dt > 0:
+                rate = (delivered - self._last_delivered) / dt
+                self.throughput += _EWMA * (rate - self.throughput)
+        self._last_delivered = delivered
+        self._last_time = now
+
+        if not self.frame_bytes:
+            return
+        self.backlog_frames = unsent_bytes / self.frame_bytes + self._drain_frames
+
+        if self.backlog_frames > CONGESTED_BACKLOG:
+            # 拥塞：先降画质，画质到底了降分辨率，最后按实测吞吐降帧率
+            self._clean_frames = 0
+            if self.quality > self.min_quality:
+                self.quality = self._quantize(self.quality - self.quality_step)
+            elif self.level < self.coarsest_level:
+                self.level += 1
+            else:
+                sustainable = self.throughput / self.frame_bytes if self.throughput > 0 else self.min_fps
+                self.fps = max(self.min_fps, min(self.fps * 0.7, sustainable))
+        elif self.backlog_frames < IDLE_BACKLOG:
+            # 链路空闲：连续若干帧没有积压才往上探，先恢复帧率，再恢复画质，最后升分辨率
+            self._clean_frames += 1
+            if self._clean_frames >= UPGRADE_HOLD_FRAMES:
+                self._clean_frames = 0
+                if self.fps < self.max_fps:
+                    self.fps = min(self.max_fps, self.fps * 1.25)
+                elif self.quality < self.max_quality:
+                    self.quality = self._quantize(self.quality + self.quality_step)
+                elif self.level > self.finest_level:
+                    # 像素变成 4 倍，画质从最低开始，帧大小大致连续
+                    self.level -= 1
+                    self.quality = self.min_quality
+        else:
+            self._clean_frames = 0
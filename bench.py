@@ -0,0 +1,536 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import gpio
+import pwm
+from histogram import Histogram
+
+# 控制与视频热路径的基准测试，结果写成 JSON，两次结果可以对比找回退：
+#   python3 bench.py --json before.json
+#   (改代码)
+#   python3 bench.py --json after.json --compare before.json
+#   python3 bench.py --compare before.json after.json      # 只对比两个已有文件
+# --only sbus,map,tracer,actuators,encode,video 只跑其中几组；缺少 cv2 / TurboJPEG 的组自动跳过
+#
+# 微基准每轮连续执行 n 次，取 BENCH_ROUNDS 轮里最快一轮的单次耗时 (受调度干扰最小，适合比回退)
+
+BENCH_ROUNDS = 7
+BENCH_MICRO_OPS = 20000      # SBUS / 映射 / 舵机电机：每轮操作次数
+BENCH_ENCODE_FRAMES = 50     # 编码：每轮帧数
+BENCH_VIDEO_SECONDS = 5.0    # 视频流：每种客户端数量的测量时长
+BENCH_VIDEO_WARMUP = 1.0
+BENCH_REGRESSION = 0.10      # 对比时变差超过 10% 标记为回退
+BENCH_SBUS_SEED = 1          # 随机 SBUS 流 (随机通道、随机切块、随机垃圾字节) 的种子，结果可复现
+BENCH_SBUS_GARBAGE = 40      # 垃圾字节一段最长这么多字节
+BENCH_SBUS_GARBAGE_RATE = 0.125   # 每帧前面插入一段垃圾的概率
+
+BENCH_GROUPS = ("sbus", "map", "tracer", "actuators", "encode", "video")
+
+
+def result(value, unit, better="lower", **extra):
+    """一条结果：value 是用来对比的主指标，better 表示越小越好还是越大越好"""
+    entry = {"value": round(value, 3), "unit": unit, "better": better}
+    entry.update(extra)
+    return entry
+
+
+def time_per_op(run, n, rounds=BENCH_ROUNDS):
+    """run(n) 连续执行 n 次操作；返回 (最快一轮的 ns/op, 各轮中位数 ns/op)"""
+    run(min(n, 1000))  # 预热
+    per_op = []
+    for _ in range(rounds):
+        t0 = time.perf_counter_ns()
+        run(n)
+        per_op.append((time.perf_counter_ns() - t0) / n)
+    per_op.sort()
+    return per_op[0], per_op[len(per_op) // 2]
+
+
+def micro(results, name, run, n=BENCH_MICRO_OPS):
+    best, median = time_per_op(run, n)
+    results[name] = result(best, "ns/op", median=round(median, 3))
+
+
+# ---------------- SBUS ----------------
+
+class _ByteStream:
+    """假串口：每次 update 之间"到达" chunk 字节，循环回放同一段合成字节流"""
+    def __init__(self, data, chunk):
+        self.data = data * 2  # 环绕时直接切片
+        self.size = len(data)
+        self.chunk = chunk
+        self.pos = 0
+
+    @property
+    def in_waiting(self):
+        return self.chunk
+
+    def read(self, n):
+        pos = self.pos
+        self.pos = (pos + n) % self.size
+        return self.data[pos:pos + n]
+
+
+class _ChunkStream:
+    """假串口：每次 update 之间到达 chunks 里的下一块，循环回放"""
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.index = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[self.index])
+
+    def read(self, n):
+        chunk = self.chunks[self.index]
+        self.index = (self.index + 1) % len(self.chunks)
+        return chunk
+
+
+def _sbus_frames(count=64):
+    from hil_sim import encode_frame
+    frames = []
+    for k in range(count):
+        channels = [(172 + (k * 37 + i * 101) % 1640) for i in range(16)]
+        frames.append(encode_frame(channels, flags=k & 0x0C))
+    return frames
+
+
+def _random_sbus_stream(rng, count, garbage_rate):
+    """
+    随机通道的帧，每帧前面按 garbage_rate 的概率插入一段垃圾字节 (不含帧头 0x0F)，
+    按 1~25 字节随机切块。返回 (块列表, 每帧的通道元组, 必须解出的帧下标)。
+    紧跟在上一帧之后的帧一定能解出；流开头或垃圾之后的第一帧要等下一帧帧头确认，
+    后面是垃圾 (或同一次读到了更新的帧) 时可能被丢掉。
+    """
+    from hil_sim import encode_frame
+    from sbus_receiver import SBUS_HEADER, SBUS_FRAME_LEN
+    noise = bytes(b for b in range(256) if b != SBUS_HEADER)
+    parts, sent, required = [], [], set()
+    for k in range(count):
+        if rng.random() < garbage_rate:
+            parts.append(bytes(rng.choice(noise) for _ in range(rng.randint(1, BENCH_SBUS_GARBAGE))))
+        elif k:
+            required.add(k)
+        channels = tuple(rng.randint(0, 0x07FF) for _ in range(16))
+        parts.append(encode_frame(channels, flags=rng.choice((0, 0x04, 0x08))))
+        sent.append(channels)
+    stream = b"".join(parts)
+    chunks, pos = [], 0
+    while pos < len(stream):
+        n = rng.randint(1, SBUS_FRAME_LEN)
+        chunks.append(stream[pos:pos + n])
+        pos += n
+    return chunks, sent, required
+
+
+def _check_sbus_decode(rx, chunks, sent, required, name):
+    """
+    把 chunks 逐块喂给 update()：解出的每一帧都必须是发出去的某一帧，顺序不能倒退，
+    required 里的帧都必须解出。返回解出的帧数。
+    """
+    index = {channels: k for k, channels in enumerate(sent)}
+    decoded = []
+    rx.ser = _ChunkStream(chunks)
+    rx.clear_buffer()
+    rx.on_frame = lambda frame: decoded.append(index.get(tuple(frame.channels), -1))
+    try:
+        for _ in chunks:
+            rx.update()
+    finally:
+        rx.on_frame = None
+    if -1 in decoded:
+        raise AssertionError(f"sbus {name}: decoded channels that were never sent")
+    if any(b <= a for a, b in zip(decoded, decoded[1:])):
+        raise AssertionError(f"sbus {name}: frames decoded out of order")
+    missing = required.difference(decoded)
+    if missing:
+        raise AssertionError(f"sbus {name}: {len(missing)} frames lost, first #{min(missing)}")
+    return len(decoded)
+
+
+def bench_sbus(args, results):
+    from sbus_receiver import SBUSReceiver, SBUS_FRAME_LEN
+    frames = _sbus_frames()
+    payloads = [memoryview(f)[1:SBUS_FRAME_LEN - 1] for f in frames]
+    with contextlib.redirect_stdout(io.StringIO()):
+        rx = SBUSReceiver(None)
+
+    parse = rx._parse_frame
+
+    def run_parse(n):
+        for i in range(n):
+            parse(payloads[i & 63])
+    micro(results, "sbus_parse_frame", run_parse)
+
+    # update()：轮询模式，每次调用之间到达 1 帧 / 3 帧 (只解析最新一帧) / 半帧
+    stream = b"".join(frames)
+    for name, chunk in (("1frame", SBUS_FRAME_LEN), ("3frames", 3 * SBUS_FRAME_LEN),
+                        ("split", (SBUS_FRAME_LEN + 1) // 2)):
+        rx.ser = _ByteStream(stream, chunk)
+        rx.clear_buffer()
+        update = rx.update
+
+        def run_update(n):
+            for _ in range(n):
+                update()
+        micro(results, f"sbus_update_{name}", run_update)
+
+    # 随机切块 / 帧间夹垃圾：先逐帧核对解出的通道，再计时
+    rng = random.Random(BENCH_SBUS_SEED)
+    for name, garbage_rate in (("random_split", 0.0), ("garbage", BENCH_SBUS_GARBAGE_RATE)):
+        chunks, sent, required = _random_sbus_stream(rng, 256, garbage_rate)
+        decoded = _check_sbus_decode(rx, chunks, sent, required, name)
+        rx.ser = _ChunkStream(chunks)
+        rx.clear_buffer()
+        update = rx.update
+
+        def run_update(n):
+            for _ in range(n):
+                update()
+        best, median = time_per_op(run_update, BENCH_MICRO_OPS)
+        results[f"sbus_update_{name}"] = result(best, "ns/op", median=round(median, 3),
+                                                decoded=f"{decoded}/{len(sent)}")
+    rx.ser = None
+
+
+# ---------------- 通道映射 ----------------
+
+def bench_map(args, results):
+    from main import map_sbus_to_pwm
+    values = [172 + (k * 1640) // 255 for k in range(256)]
+
+    def run(n):
+        m = map_sbus_to_pwm
+        for i in range(n):
+            m(values[i & 255])
+    micro(results, "map_sbus_to_pwm", run)
+
+
+# ---------------- 延迟统计 ----------------
+
+def bench_tracer(args, results):
+    """控制循环每轮的打点开销：Histogram.record 单次，LatencyTracer.lap 单次 (含一次 perf_counter_ns)"""
+    from latency import LatencyTracer, TRACE_BIN_NS, TRACE_NUM_BINS
+    # 0 ~ 20ms 之间散开的耗时，包括超出直方图范围计入最后一格的
+    values = [(k * 7919) % 20000 * 1000 for k in range(256)]
+    hist = Histogram(TRACE_BIN_NS, TRACE_NUM_BINS)
+
+    def run_record(n):
+        r = hist.record
+        for i in range(n):
+            r(values[i & 255])
+    micro(results, "histogram_record", run_record)
+
+    tracer = LatencyTracer(("stage",))
+
+    def run_lap(n):
+        lap = tracer.lap
+        t = time.perf_counter_ns()
+        for _ in range(n):
+            t = lap(0, t)
+    micro(results, "tracer_lap", run_lap)
+
+
+# ---------------- 舵机 / 电机 ----------------
+
+def bench_actuators(args, results):
+    """
+    Servo.set_angle / Motor.set_speed 在各 HAL 后端上的单次耗时。
+    fd / sysfs 写的是 tmpfs 上的假 sysfs (普通文件)，只能比较用户态 + VFS 开销，真实驱动要在板子上跑。
+    sweep 每次都换值 (每次都写)，hold 值不变 (被变化抑制跳过)。
+    """
+    import main
+    from motor import Motor, MOTOR_A_PWM_CHIP, MOTOR_A_PWM_ID
+    from servo import Servo, SERVO_PWM_CHIP, SERVO_PWM_ID, DEFAULT_STEERING_MID, DEFAULT_STEERING_RANGE
+    from hil_sim import build_fake_sysfs
+
+    shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    workdir = tempfile.mkdtemp(prefix="bench_sysfs_", dir=shm)
+    saved = (pwm.PWM_SYSFS_ROOT, gpio.GPIO_SYSFS_ROOT)
+    try:
+        pwm.PWM_SYSFS_ROOT, gpio.GPIO_SYSFS_ROOT = build_fake_sysfs(workdir)
+        angles = [k / 32.0 - 1.0 for k in range(64)]
+        for backend in sorted(pwm.PWM_BACKENDS):
+            servo = Servo(chip=SERVO_PWM_CHIP, channel=SERVO_PWM_ID,
+                          min_us=DEFAULT_STEERING_MID - DEFAULT_STEERING_RANGE,
+                          max_us=DEFAULT_STEERING_MID + DEFAULT_STEERING_RANGE,
+                          mid_us=DEFAULT_STEERING_MID, backend=backend)
+            motor = Motor(MOTOR_A_PWM_CHIP, MOTOR_A_PWM_ID, main.PIN_IN2, main.PIN_IN1, backend=backend)
+
+            def servo_sweep(n):
+                s = servo.set_angle
+                for i in range(n):
+                    s(angles[i & 63])
+
+            def servo_hold(n):
+                s = servo.set_angle
+                for _ in range(n):
+                    s(0.25)
+
+            def motor_sweep(n):
+                s = motor.set_speed
+                for i in range(n):
+                    s(angles[i & 63])
+
+            def motor_hold(n):
+                s = motor.set_speed
+                for _ in range(n):
+                    s(0.5)
+
+            micro(results, f"servo_set_angle_sweep[{backend}]", servo_sweep)
+            micro(results, f"servo_set_angle_hold[{backend}]", servo_hold)
+            micro(results, f"motor_set_speed_sweep[{backend}]", motor_sweep)
+            micro(results, f"motor_set_speed_hold[{backend}]", motor_hold)
+            servo.stop()
+            motor.stop()
+            motor.gpio.close()
+    finally:
+        pwm.PWM_SYSFS_ROOT, gpio.GPIO_SYSFS_ROOT = saved
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# ---------------- JPEG 编码 ----------------
+
+def bench_encode(args, results):
+    """TurboJPEG 与 cv2.imencode 在 camera_stream 用到的几个画质上的单帧编码耗时"""
+    import cv2
+    import camera_stream
+    frame = camera_stream.SyntheticCapture(args.width, args.height).read()[1]
+    qualities = sorted({camera_stream.MIN_QUALITY, camera_stream.INITIAL_QUALITY, camera_stream.MAX_QUALITY})
+
+    encoders = [("cv2", lambda q: cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), q])[1])]
+    if camera_stream.USE_TURBOJPEG:
+        encoders.append(("turbojpeg", lambda q: camera_stream.jpeg.encode(frame, quality=q)))
+    else:
+        print("TurboJPEG not available, only cv2.imencode is measured")
+
+    for name, encode in encoders:
+        for q in qualities:
+            def run(n):
+                for _ in range(n):
+                    encode(q)
+            best, median = time_per_op(run, BENCH_ENCODE_FRAMES)
+            results[f"encode_{name}_q{q}"] = result(
+                best, "ns/op", median=round(median, 3), bytes=len(encode(q)),
+                size=f"{args.width}x{args.height}")
+
+
+# ---------------- /video_feed 多客户端 ----------------
+
+class _FeedClient(threading.Thread):
+    """原始 socket 读 MJPEG 流，只数帧分隔符和字节数"""
+    def __init__(self, port, stop):
+        super().__init__(daemon=True)
+        self.port = port
+        self.stop_event = stop
+        self.frames = 0
+        self.bytes = 0
+        self.counting = False
+
+    def run(self):
+        boundary = b"--frame\r\n"
+        with socket.create_connection(("127.0.0.1", self.port)) as sock:
+            sock.settimeout(0.5)
+            sock.sendall(b"GET /video_feed HTTP/1.1\r\nHost: bench\r\n\r\n")
+            tail = b""
+            while not self.stop_event.is_set():
+                try:
+                    data = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                if not data:
+                    return
+                chunk = tail + data
+                if self.counting:
+                    self.frames += chunk.count(boundary)
+                    self.bytes += len(data)
+                tail = chunk[-(len(boundary) - 1):]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_video(args, results):
+    """
+    合成帧源 + 真实 StreamServer，N 个本机客户端同时拉 /video_feed：
+    每客户端帧率、总吞吐、每秒实际编码次数 (应与客户端数量无关) 和本进程 CPU 占用。
+    关掉静止画面抑制，测的是编码和发送的满帧率开销。
+    """
+    import camera_stream
+    port = _free_port()
+    with contextlib.redirect_stdout(io.StringIO()):
+        cam = camera_stream.CameraStream(port=port, device="synthetic", width=args.width, height=args.height,
+                                         passthrough=False, blackbox=False, suppress_static=False)
+        cam.start()
+    if not cam.server:
+        print("video: stream server did not start")
+        return
+    try:
+        for count in args.clients:
+            stop = threading.Event()
+            clients = [_FeedClient(port, stop) for _ in range(count)]
+            for c in clients:
+                c.start()
+            time.sleep(BENCH_VIDEO_WARMUP)
+
+            encodes0 = camera_stream.encode_count
+            cpu0 = time.process_time()
+            t0 = time.perf_counter()
+            for c in clients:
+                c.counting = True
+            time.sleep(BENCH_VIDEO_SECONDS)
+            for c in clients:
+                c.counting = False
+            elapsed = time.perf_counter() - t0
+            cpu = time.process_time() - cpu0
+            encodes = camera_stream.encode_count - encodes0
+            stop.set()
+            for c in clients:
+                c.join(timeout=2.0)
+
+            fps = [c.frames / elapsed for c in clients]
+            results[f"video_feed_clients{count}"] = result(
+                sum(fps) / count, "fps/client", better="higher",
+                min_fps=round(min(fps), 2),
+                total_mbps=round(sum(c.bytes for c in clients) * 8 / elapsed / 1e6, 3),
+                encodes_per_s=round(encodes / elapsed, 2),
+                cpu_percent=round(cpu / elapsed * 100, 1),
+                size=f"{args.width}x{args.height}")
+    finally:
+        with contextlib.redirect_stdout(io.StringIO()):
+            cam.stop()
+
+
+BENCHMARKS = {
+    "sbus": bench_sbus,
+    "map": bench_map,
+    "tracer": bench_tracer,
+    "actuators": bench_actuators,
+    "encode": bench_encode,
+    "video": bench_video,
+}
+
+
+# ---------------- 输出与对比 ----------------
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _format_value(entry):
+    value = entry["value"]
+    if entry["unit"] == "ns/op" and value >= 10000:
+        return f"{value / 1000:.1f} us/op"
+    return f"{value:.1f} {entry['unit']}"
+
+
+def print_results(report):
+    print(f"commit {report['meta']['commit']}  python {report['meta']['python']}  {report['meta']['machine']}")
+    for name, entry in report["results"].items():
+        extra = "  ".join(f"{k}={v}" for k, v in entry.items() if k not in ("value", "unit", "better"))
+        print(f"  {name:<36} {_format_value(entry):>16}  {extra}")
+
+
+def compare(old, new, threshold=BENCH_REGRESSION):
+    """逐项对比，返回回退的项数；只有一边有的项只列出不判断"""
+    print(f"\n{'benchmark':<36} {'old':>16} {'new':>16} {'change':>8}")
+    print(f"  ({old['meta']['commit']} -> {new['meta']['commit']})")
+    regressions = 0
+    for name in sorted(set(old["results"]) | set(new["results"])):
+        a = old["results"].get(name)
+        b = new["results"].get(name)
+        if a is None or b is None:
+            print(f"{name:<36} {_format_value(a) if a else '-':>16} {_format_value(b) if b else '-':>16}")
+            continue
+        if not a["value"]:
+            continue
+        change = (b["value"] - a["value"]) / a["value"]
+        worse = change if b.get("better", "lower") == "lower" else -change
+        mark = ""
+        if worse > threshold:
+            mark = "  REGRESSION"
+            regressions += 1
+        elif worse < -threshold:
+            mark = "  improved"
+        print(f"{name:<36} {_format_value(a):>16} {_format_value(b):>16} {change:>+7.1%}{mark}")
+    print(f"\n{regressions} regression(s) beyond {threshold:.0%}")
+    return regressions
+
+
+def run(args):
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": f"{platform.machine()} {platform.node()}",
+        },
+        "results": {},
+    }
+    for group in args.only:
+        try:
+            BENCHMARKS[group](args, report["results"])
+        except ImportError as e:
+            print(f"skip {group}: {e}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control and video hot path benchmarks")
+    parser.add_argument("--only", default=",".join(BENCH_GROUPS), help="逗号分隔：" + ",".join(BENCH_GROUPS))
+    parser.add_argument("--json", help="结果写到这个文件")
+    parser.add_argument("--compare", nargs="+", metavar="JSON",
+                        help="一个文件：本次结果与它对比；两个文件：只对比这两个文件")
+    parser.add_argument("--threshold", type=float, default=BENCH_REGRESSION, help="回退判定阈值 (比例)")
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=240)
+    parser.add_argument("--clients", default="1,4,16", help="视频流并发客户端数量，逗号分隔")
+    args = parser.parse_args()
+    args.only = [g for g in args.only.split(",") if g]
+    args.clients = [int(c) for c in args.clients.split(",") if c]
+    unknown = [g for g in args.only if g not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown group(s): {', '.join(unknown)}")
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        sys.exit(1 if compare(old, new, args.threshold) else 0)
+
+    report = run(args)
+    print_results(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved {args.json}")
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        sys.exit(1 if compare(old, report, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
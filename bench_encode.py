@@ -0,0 +1,114 @@
+import argparse
+import time
+import cv2
+import numpy as np
+import camera_stream
+import yuv
+from camera_stream import SyntheticCapture, encode_jpeg, encode_yuv
+from histogram import Histogram
+
+# 对比两条编码路径在同一摄像头上的每帧耗时：
+#   bgr: 摄像头 YUV -> OpenCV 转 BGR (retrieve 内部) -> jpeg.encode (内部再转回 YCbCr)
+#   yuv: 摄像头 YUV 原始数据 -> 拆成平面 (只搬字节) -> jpeg.encode_from_yuv
+# 用法：python3 bench_encode.py --device /dev/video0 --fourcc YUYV --frames 300
+
+BENCH_BIN_NS = 10000   # 10us 一格
+BENCH_NUM_BINS = 10000  # 覆盖 100ms
+
+
+def open_capture(device, fourcc, width, height, convert_rgb):
+    if device == 'synthetic':
+        cap = SyntheticCapture(width, height, fps=1000)
+    else:
+        cap = cv2.VideoCapture(device, cv2.CAP_V4L2)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    cap.set(cv2.CAP_PROP_CONVERT_RGB, 1 if convert_rgb else 0)
+    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    return cap, w, h
+
+
+def bench_bgr(args):
+    cap, w, h = open_capture(args.device, args.fourcc, args.width, args.height, True)
+    buf = np.empty((h, w, 3), dtype=np.uint8)
+    convert = Histogram(BENCH_BIN_NS, BENCH_NUM_BINS)
+    encode = Histogram(BENCH_BIN_NS, BENCH_NUM_BINS)
+    size = 0
+    for _ in range(args.frames):
+        if not cap.grab():
+            continue
+        t0 = time.perf_counter_ns()
+        ret, frame = cap.retrieve(image=buf)
+        t1 = time.perf_counter_ns()
+        if not ret:
+            continue
+        data = encode_jpeg(frame, args.quality)
+        t2 = time.perf_counter_ns()
+        convert.record(t1 - t0)
+        encode.record(t2 - t1)
+        size += len(data)
+    cap.release()
+    return convert, encode, size
+
+
+def bench_yuv(args):
+    cap, w, h = open_capture(args.device, args.fourcc, args.width, args.height, False)
+    subsample = "420" if args.fourcc == "NV12" else args.subsample
+    to_planar = yuv.TO_PLANAR[args.fourcc]
+    planar = np.empty(yuv.planar_shape(w, h, subsample), dtype=np.uint8)
+    raw = None
+    convert = Histogram(BENCH_BIN_NS, BENCH_NUM_BINS)
+    encode = Histogram(BENCH_BIN_NS, BENCH_NUM_BINS)
+    size = 0
+    for _ in range(args.frames):
+        if not cap.grab():
+            continue
+        t0 = time.perf_counter_ns()
+        ret, raw = cap.retrieve(image=raw)
+        if not ret or raw.size != yuv.raw_size(args.fourcc, w, h):
+            print(f"Camera does not deliver raw {args.fourcc}")
+            break
+        to_planar(raw, planar, w, h, subsample)
+        t1 = time.perf_counter_ns()
+        data = encode_yuv(planar, args.quality, w, h, subsample)
+        t2 = time.perf_counter_ns()
+        convert.record(t1 - t0)
+        encode.record(t2 - t1)
+        size += len(data)
+    cap.release()
+    return convert, encode, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BGR vs YUV encode path benchmark")
+    parser.add_argument("--device", default="/dev/video0", help="摄像头设备，或 synthetic")
+    parser.add_argument("--fourcc", default="YUYV", choices=sorted(yuv.RAW_BYTES_PER_PIXEL))
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=240)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--quality", type=int, default=camera_stream.INITIAL_QUALITY)
+    parser.add_argument("--subsample", default=camera_stream.YUV_SUBSAMPLE, choices=yuv.SUBSAMPLES)
+    args = parser.parse_args()
+
+    paths = [("bgr", bench_bgr)]
+    if camera_stream.USE_YUV_ENCODE:
+        paths.append(("yuv", bench_yuv))
+    else:
+        print("TurboJPEG encode_from_yuv not available, only the BGR path is measured")
+
+    print(f"{args.device} {args.fourcc} {args.width}x{args.height} q={args.quality}, {args.frames} frames")
+    for name, bench in paths:
+        convert, encode, size = bench(args)
+        if not encode.count:
+            continue
+        total = (convert.total_ns + encode.total_ns) / encode.count / 1e6
+        print(f"[{name}] total {total:.2f} ms/frame, {size / encode.count / 1024:.1f} KB/frame")
+        print("  " + convert.format("convert"))
+        print("  " + encode.format("encode"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import struct
+import threading
+import time
+from array import array
+
+# 视频黑匣子：内存里保留最近一段时间已经编码好的 JPEG，出事时再落盘，平时不写 SD 卡
+BLACKBOX_BYTES = 8 * 1024 * 1024   # 字节环大小，内存占用的硬上限
+BLACKBOX_SECONDS = 20              # 只保留最近这么多秒
+BLACKBOX_MAX_FRAMES = 1024         # 帧索引个数 (预分配)
+
+
+class BlackBox:
+    """
+    预分配的字节环 + 帧索引环。append() 只做一次 memcpy 和几次数组赋值，不分配内存。
+    帧在字节环里连续存放，尾部放不下时从头开始 (尾部空间跳过)，覆盖到的旧帧直接淘汰。
+    """
+    def __init__(self, capacity=BLACKBOX_BYTES, seconds=BLACKBOX_SECONDS, max_frames=BLACKBOX_MAX_FRAMES):
+        self.capacity = capacity
+        self.seconds = seconds
+        self.max_frames = max_frames
+        self.buf = bytearray(capacity)
+        self._view = memoryview(self.buf)
+        self.offsets = array('Q', bytes(8 * max_frames))
+        self.lengths = array('Q', bytes(8 * max_frames))
+        self.timestamps = array('Q', bytes(8 * max_frames))
+        self.head = 0    # 下一帧的写入位置 (字节)
+        self.first = 0   # 最旧一帧的索引槽位
+        self.count = 0
+        self.dropped = 0  # 比整个环还大、存不下的帧
+        self.lock = threading.Lock()
+
+    def append(self, data, timestamp_ns=None):
+        n = len(data)
+        if n > self.capacity:
+            self.dropped += 1
+            return False
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        with self.lock:
+            start = self.head
+            # 尾部放不下：[head, capacity) 这段也算被覆盖，从 0 开始写
+            wrap_from = self.capacity
+            if start + n > self.capacity:
+                wrap_from = start
+                start = 0
+            end = start + n
+            # 按从旧到新的顺序淘汰：与写入区域重叠的帧、被跳过的尾部里的帧，索引环满时再淘汰最旧一帧
+            while self.count:
+                i = self.first
+                off = self.offsets[i]
+                overlaps = off < end and off + self.lengths[i] > start
+                skipped = off >= wrap_from
+                if not (overlaps or skipped or self.count == self.max_frames):
+                    break
+                self.first = (i + 1) % self.max_frames
+                self.count -= 1
+            self._view[start:end] = data
+            slot = (self.first + self.count) % self.max_frames
+            self.offsets[slot] = start
+            self.lengths[slot] = n
+            self.timestamps[slot] = timestamp_ns
+            self.count += 1
+            self.head = end
+        return True
+
+    def frames(self, seconds=None):
+        """复制出最近 seconds 秒 (默认 self.seconds) 的 [(timestamp_ns, jpeg_bytes), ...]，从旧到新"""
+        window_ns = int((seconds or self.seconds) * 1e9)
+        with self.lock:
+            if not self.count:
+                return []
+            newest = self.timestamps[(self.first + self.count - 1) % self.max_frames]
+            result = []
+            for k in range(self.count):
+                i = (self.first + k) % self.max_frames
+                ts = self.timestamps[i]
+                if newest - ts <= window_ns:
+                    off = self.offsets[i]
+                    result.append((ts, bytes(self._view[off:off + self.lengths[i]])))
+            return result
+
+    def dump(self, path, width, height, seconds=None):
+        """把最近一段写成 MJPEG AVI (扩展名 .mjpeg 则直接拼接 JPEG)，返回帧数"""
+        frames = self.frames(seconds)
+        if not frames:
+            return 0
+        if path.endswith('.mjpeg'):
+            with open(path, 'wb') as f:
+                for _, data in frames:
+                    f.write(data)
+        else:
+            duration = (frames[-1][0] - frames[0][0]) / 1e9
+            fps = (len(frames) - 1) / duration if duration > 0 else 1.0
+            write_avi(path, [data for _, data in frames], width, height, fps)
+        return len(frames)
+
+
+def _chunk(fourcc, payload):
+    data = fourcc + struct.pack('<I', len(payload)) + payload
+    return data + b'\0' if len(payload) & 1 else data
+
+
+def write_avi(path, jpegs, width, height, fps):
+    """最小的 MJPEG AVI (RIFF)：单视频流，带 idx1 索引；帧率取平均值"""
+    n = len(jpegs)
+    scale, rate = 1000, max(1, int(round(fps * 1000)))
+    max_size = max(len(j) for j in jpegs)
+    avih = struct.pack('<14I', int(1e6 / fps), int(max_size * fps), 0, 0x10, n, 0, 1,
+                       max_size, width, height, 0, 0, 0, 0)
+    strh = struct.pack('<4s4sIHHIIIIIIII4h', b'vids', b'MJPG', 0, 0, 0, 0, scale, rate, 0, n,
+                       max_size, 0xFFFFFFFF, 0, 0, 0, width, height)
+    strf = struct.pack('<IiiHH4sIiiII', 40, width, height, 1, 24, b'MJPG', width * height * 3, 0, 0, 0, 0)
+    strl = b'LIST' + struct.pack('<I', 4 + 8 + len(strh) + 8 + len(strf)) + b'strl' + \
+        _chunk(b'strh', strh) + _chunk(b'strf', strf)
+    hdrl_body = b'hdrl' + _chunk(b'avih', avih) + strl
+    hdrl = b'LIST' + struct.pack('<I', len(hdrl_body)) + hdrl_body
+
+    movi_size = 4 + sum(8 + len(j) + (len(j) & 1) for j in jpegs)
+    idx = bytearray()
+    offset = 4  # idx1 的偏移相对 'movi' 四字符码
+    for j in jpegs:
+        idx += struct.pack('<4sIII', b'00dc', 0x10, offset, len(j))
+        offset += 8 + len(j) + (len(j) & 1)
+    riff_size = 4 + len(hdrl) + 8 + movi_size + 8 + len(idx)
+
+    with open(path, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', riff_size) + b'AVI ')
+        f.write(hdrl)
+        f.write(b'LIST' + struct.pack('<I', movi_size) + b'movi')
+        for j in jpegs:
+            f.write(_chunk(b'00dc', j))
+        f.write(_chunk(b'idx1', bytes(idx)))
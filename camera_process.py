@@ -0,0 +1,175 @@
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from frame_ring import FrameRing
+
+# 帧环默认 4 槽。槽大小按分辨率算：放得下同尺寸的 BGR 帧 (平面 YUV 和 MJPEG 都比它小)，
+# 最少 RING_MIN_SLOT_SIZE，给高画质的 MJPEG 留余量
+RING_SLOTS = 4
+RING_MIN_SLOT_SIZE = 512 * 1024
+
+# 子进程心跳超过这么久没更新就认为卡死，杀掉重启
+STALL_TIMEOUT = 5.0
+# 重启间隔：连续失败时从 1 秒开始翻倍，最长 30 秒
+RESTART_BACKOFF_MIN = 1.0
+RESTART_BACKOFF_MAX = 30.0
+SUPERVISE_INTERVAL = 0.5
+# 连续这么多次启动都没有进入正常采集 (心跳一次都没更新) 就放弃，不再重启
+MAX_FAILED_STARTS = 5
+# 子进程退出码：摄像头设备打不开 (没接或被占用)，重启也没用
+EXIT_CAMERA_ABSENT = 3
+
+
+def ring_slot_size_for(width, height):
+    """width x height 下帧环每槽的字节数"""
+    return max(RING_MIN_SLOT_SIZE, width * height * 3)
+
+
+def _camera_main(ring_name, options, stop_event, dump_event):
+    """子进程入口：在独立进程里跑完整的 CameraStream (采集 + 编码 + HTTP)"""
+    # Ctrl+C 由控制进程处理，子进程只听 stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        os.nice(5)  # 让出 CPU 给控制进程
+    except OSError:
+        pass
+    from camera_stream import CameraStream  # cv2 只在子进程里导入
+    camera = CameraStream(ring_name=ring_name, **options)
+    camera.start()
+    if not camera.running:
+        sys.exit(EXIT_CAMERA_ABSENT)
+    while not stop_event.wait(0.2):
+        if dump_event.is_set():
+            dump_event.clear()
+            camera.save_blackbox()
+    camera.stop()
+
+
+class CameraProcess:
+    """
+    把 CameraStream 放到独立进程里运行，控制进程只负责监督和重启。
+    OpenCV / JPEG 编码 / HTTP 都不再和 SBUS→PWM 控制循环抢 GIL。
+
+    帧通过共享内存帧环 (frame_ring.FrameRing) 发布：控制进程创建并持有，
+    子进程重启后继续写同一个环，其他进程可以 FrameRing.attach(ring_name) 零拷贝读取。
+    接口与 CameraStream 相同 (start / stop)，main.py 里可以直接替换。
+    """
+    def __init__(self, stall_timeout=STALL_TIMEOUT, ring_slots=RING_SLOTS,
+                 ring_slot_size=None, **options):
+        self.options = options
+        self.stall_timeout = stall_timeout
+        if ring_slot_size is None:
+            # 没传分辨率时按 CameraStream 的默认值 320x240
+            ring_slot_size = ring_slot_size_for(options.get("width", 320), options.get("height", 240))
+        self.ring = FrameRing.create(slots=ring_slots, slot_size=ring_slot_size)
+        # spawn：子进程不继承控制进程的线程、串口和 PWM 句柄
+        self._ctx = multiprocessing.get_context("spawn")
+        self._stop_event = self._ctx.Event()
+        self._dump_event = self._ctx.Event()
+        self.process = None
+        self._spawn_heartbeat = 0
+        self.restarts = 0
+        self.running = False
+        self._supervisor = None
+        self._wake = threading.Event()
+
+    @property
+    def ring_name(self):
+        return self.ring.name
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._spawn()
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+
+    def _spawn(self):
+        self._stop_event.clear()
+        self.ring.heartbeat()  # 给子进程启动留出 stall_timeout 的时间
+        self._spawn_heartbeat = self.ring.heartbeat_ns()
+        self.process = self._ctx.Process(target=_camera_main, name="camera",
+                                         args=(self.ring.name, self.options, self._stop_event,
+                                               self._dump_event),
+                                         daemon=True)
+        self.process.start()
+        print(f"Camera process started (pid {self.process.pid}, ring {self.ring.name})")
+
+    def _kill(self):
+        proc = self.process
+        if proc is None:
+            return
+        self._stop_event.set()
+        proc.join(timeout=2.0)
+        if proc.is_alive():
+            proc.terminate()
+            proc.join(timeout=1.0)
+        if proc.is_alive():
+            proc.kill()
+            proc.join()
+
+    def _supervise(self):
+        backoff = RESTART_BACKOFF_MIN
+        failed_starts = 0
+        while self.running:
+            self._wake.wait(SUPERVISE_INTERVAL)
+            if not self.running:
+                break
+            proc = self.process
+            heartbeat = self.ring.heartbeat_ns()
+            if proc.is_alive() and (time.monotonic_ns() - heartbeat) / 1e9 <= self.stall_timeout:
+                if heartbeat != self._spawn_heartbeat:
+                    backoff = RESTART_BACKOFF_MIN  # 子进程已经在正常采集
+                    failed_starts = 0
+                continue
+            if not proc.is_alive() and proc.exitcode == EXIT_CAMERA_ABSENT:
+                print("Camera device not available, camera process stopped")
+                self._give_up()
+                break
+            if heartbeat == self._spawn_heartbeat:
+                failed_starts += 1
+                if failed_starts >= MAX_FAILED_STARTS:
+                    print(f"Camera process failed to start {failed_starts} times in a row, giving up")
+                    self._give_up()
+                    break
+            if proc.is_alive():
+                print("Camera process stalled, restarting...")
+            else:
+                print(f"Camera process exited (code {proc.exitcode}), restarting in {backoff:.1f}s...")
+            self._kill()
+            self._wake.wait(backoff)
+            if not self.running:
+                break
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+            self.restarts += 1
+            self._spawn()
+
+    def _give_up(self):
+        """不再重启：停掉子进程，running 置 False (帧环留到 stop() 时释放)"""
+        self.running = False
+        self._kill()
+
+    def dump_blackbox(self, delay=0.0):
+        """非阻塞：delay 秒后通知摄像头进程保存视频黑匣子"""
+        timer = threading.Timer(delay, self._dump_event.set)
+        timer.daemon = True
+        timer.start()
+
+    def latest_frame_id(self):
+        """子进程最近发布到帧环的帧序号，还没有帧时为 0"""
+        return self.ring.latest_seq()
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+        if self._supervisor:
+            self._supervisor.join(timeout=1.0)
+        self._kill()
+        self.ring.close()
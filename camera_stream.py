@@ -1,172 +1,402 @@
 import cv2
+import numpy as np
+import os
 import threading
 import time
-import socket
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from socketserver import ThreadingMixIn
+from stream_server import StreamServer
+from frame_ring import FrameRing, FORMAT_JPEG, FORMAT_BGR, FORMAT_YUV420P, FORMAT_YUV422P
+from frame_pool import FramePool
+from change_detector import ChangeDetector, KEEPALIVE_FPS
+from blackbox import BlackBox
+import yuv
 try:
-    from turbojpeg import TurboJPEG
+    from turbojpeg import TurboJPEG, TJSAMP_420, TJSAMP_422, TJPF_GRAY
     # 尝试初始化 TurboJPEG，失败则回退到 OpenCV
     jpeg = TurboJPEG()
     USE_TURBOJPEG = True
+    # 平面 YUV 直接编码 (PyTurboJPEG >= 1.7)，省掉两次颜色空间转换
+    USE_YUV_ENCODE = hasattr(jpeg, 'encode_from_yuv')
+    TJSAMP = {"420": TJSAMP_420, "422": TJSAMP_422}
 except:
     USE_TURBOJPEG = False
+    USE_YUV_ENCODE = False
 
 # 全局帧缓冲与同步条件变量
 output_frame = None
+output_format = "bgr"  # "bgr": OpenCV 解码后的 BGR 数组；"jpeg": 摄像头原生 MJPEG 数据 (bytes)
+                       # "yuv": 平面 YUV 数组 (见 yuv.py)，尺寸和采样方式在 yuv_params
+yuv_params = None  # (width, height, subsample)
 frame_condition = threading.Condition()
 frame_id = 0  # 帧计数器，用于丢帧检测
+# BGR / YUV 模式下 output_frame 来自这个预分配缓冲池，编码前后要 retain/release
+frame_pool = None
+
+# 编码缓存：每个 (分辨率档位, 画质) 只为当前帧编码一次，所有客户端共用同一个不可变 bytes
+# (level, quality) -> (frame_id, jpeg_bytes)
+encoded_frames = {}
+# 各档位的缩小帧缓存：level -> (frame_id, frame)，格式与 output_format 相同 (直通模式下为 BGR)
+scaled_frames = {}
+encode_lock = threading.Lock()
+encode_count = 0  # 实际编码次数，用于验证编码开销与客户端数量无关
+decode_count = 0  # 直通模式下为了降画质而解码的次数
+# 直通模式下解码出的 BGR 帧缓存：(frame_id, bgr)
+decoded_frame = (0, None)
 
 # ============ 极致低延迟模式配置 (ABR 自适应版) ============
-# 初始配置
+# 默认值，可通过 CameraStream 参数覆盖；每个客户端的 ABR 在上下限之间独立调整
 MIN_QUALITY = 5              # 最低画质（马赛克级，但也能看）
 MAX_QUALITY = 30             # 最高画质
-CURRENT_QUALITY = 20         # 当前动态画质
-TARGET_FPS = 30              
+INITIAL_QUALITY = 20         # 初始画质，之后由 ABR 动态调整
+TARGET_FPS = 30              # 采集帧率，也是每个客户端的最高帧率
+MIN_FPS = 5                  # 网络很差时每个客户端最低帧率
+# 限速按间隔的 90% 判断：摄像头出帧有几毫秒抖动，刚好到点的帧不会因为早到一点被丢掉
+FRAME_INTERVAL_SLACK = 0.9
+# 分辨率阶梯：(名称, 缩小倍数)，/video_feed?res=half 选择，ABR 拥塞时也会自动往下降档
+RESOLUTION_LEVELS = (("full", 1), ("half", 2), ("quarter", 4))
+IDLE_FPS = 1                 # 没有观看者时的保活帧率，0 为完全暂停
+IDLE_KEEP_DEVICE_OPEN = True # 空闲时不关闭摄像头，恢复时省掉重新打开的延迟
+# 采集格式："MJPG" (直通或解码成 BGR)，"YUYV" / "NV12" (保持 YUV，TurboJPEG 直接从 YUV 编码)
+# 不同摄像头哪种更快用 bench_encode.py 实测
+CAPTURE_FORMAT = "MJPG"
+YUV_SUBSAMPLE = "420"        # YUV 编码的色度采样："420" 码流更小，"422" 色彩更细 (NV12 只能 420)
+# 静止画面抑制：画面没有明显变化的帧不发布 (不编码、不发送)，最少每秒发 STATIC_KEEPALIVE_FPS 帧
+STATIC_SUPPRESSION = True
+STATIC_KEEPALIVE_FPS = KEEPALIVE_FPS
+# 视频黑匣子：内存里保留最近一段编码好的 JPEG (大小见 blackbox.py)，
+# 出事时 (SBUS 失控保护 / POST /blackbox/dump) 才写成 AVI 存到 BLACKBOX_DIR
+BLACKBOX_ENABLED = True
+BLACKBOX_FPS = 15
+BLACKBOX_QUALITY = INITIAL_QUALITY   # 非直通模式下录制用的画质 (有观看者时直接记录他们已经编好的 JPEG，这个画质只在没人看时用)
+BLACKBOX_DIR = "blackbox"            # 相对本文件所在目录
+BLACKBOX_COOLDOWN = 10.0             # 两次保存之间至少间隔这么多秒，期间的请求直接忽略
+BLACKBOX_MAX_FILES = 20              # BLACKBOX_DIR 里最多保留这么多个 AVI，多了删最旧的
+BLACKBOX_MAX_DIR_BYTES = 200 * 1024 * 1024   # BLACKBOX_DIR 里 AVI 总大小上限
+FRAME_POOL_SIZE = 4          # BGR/YUV 帧缓冲个数：当前帧 + 编码中 + 采集中，再留一个余量
 FRAME_SKIP_THRESHOLD = 5     # 恢复为5，避免过于频繁的跳帧导致画面不连贯     
 
-# 简单的全屏 HTML 模板
-# 将视频流作为背景全屏显示，padding:0, margin:0 
-PAGE = """
-<html>
-<head>
-<title>LubanCat FPV</title>
-<style>
-body { 
-    margin: 0; 
-    padding: 0; 
-    background-color: #000; 
-    display: flex; 
-    justify-content: center; 
-    align-items: center; 
-    height: 100vh; 
-    overflow: hidden;
-}
-img {
-    height: 100%;
-    width: auto;
-    object-fit: contain;
-}
-</style>
-</head>
-<body>
-<img src="/video_feed">
-</body>
-</html>
-"""
-
-class MJPEGStreamHandler(BaseHTTPRequestHandler):
-    """处理 MJPEG 流的 HTTP 请求"""
-    def log_message(self, format, *args):
-        pass  # 禁用日志输出，减少CPU开销
-    
-    def do_GET(self):
-        global output_frame, frame_id, CURRENT_QUALITY
-        
-        # 1. 如果访问根路径 /，返回 HTML 网页（大屏幕模式）
-        if self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(PAGE.encode('utf-8'))
-            
-        # 2. 如果访问 /video_feed，返回视频流
-        elif self.path == '/video_feed':
-            # 优化 Socket 发送缓冲区，防止网络卡顿时数据堆积产生延迟
-            try:
-                # 设置发送缓冲区为 16KB（更小以避免堆积）
-                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16 * 1024)
-                # 设置 TCP_NODELAY 减少延迟
-                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            except:
-                pass
+def encode_jpeg(frame, quality):
+    """BGR 帧编码为 JPEG bytes，失败返回 None"""
+    if USE_TURBOJPEG:
+        # pixel_format=TJPF_BGR 是默认的 OpenCV 格式
+        return jpeg.encode(frame, quality=quality)
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    (flag, encodedImage) = cv2.imencode(".jpg", frame, encode_param)
+    if not flag:
+        return None
+    return encodedImage.tobytes()
 
-            self.send_response(200)
-            self.send_header('Content-type', 'multipart/x-mixed-replace; boundary=frame')
-            self.end_headers()
-            
-            # 初始化为当前帧，确保连接建立后立刻开始传输（避免初始丢帧判断逻辑导致的跳过）
-            last_sent_frame_id = frame_id - 1
-            last_send_time = 0
-            min_frame_interval = 1.0 / TARGET_FPS  # 限制帧率
-            
-            try:
-                while True:
-                    with frame_condition:
-                        # 等待新帧，但设置超时避免死锁
-                        frame_condition.wait(timeout=0.5)
-                        if output_frame is None:
-                            continue
-                        
-                        current_frame_id = frame_id
-                        frame = output_frame
-                    
-                    # 如果没有新帧（超时唤醒），跳过
-                    if current_frame_id <= last_sent_frame_id:
-                        continue
-
-                    # 丢帧检测：如果落后太多帧，只需要更新状态，不需要丢弃当前的最新帧
-                    # 原来的逻辑是 continue，会导致当前已经获取到的好帧也被丢弃，可能导致“卡死”
-                    # if current_frame_id - last_sent_frame_id > FRAME_SKIP_THRESHOLD:
-                    #     pass 
-                    
-                    # 帧率限制
-                    now = time.perf_counter()
-                    if now - last_send_time < min_frame_interval:
-                        continue
-                    
-                    # 3. 压缩 JPEG（使用 PyTurboJPEG 如果可用，速度快3倍）
-                    if USE_TURBOJPEG:
-                        # pixel_format=TJPF_BGR 是默认的 OpenCV 格式
-                        encodedImage = jpeg.encode(frame, quality=int(CURRENT_QUALITY))
-                    else:
-                        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), int(CURRENT_QUALITY)]
-                        (flag, encodedImage) = cv2.imencode(".jpg", frame, encode_param)
-                        if not flag:
-                            continue
-                    
-                    try:
-                        # 记录发送开始时间
-                        t_start_send = time.perf_counter()
-
-                        self.wfile.write(b'--frame\r\n')
-                        self.wfile.write(b'Content-Type: image/jpeg\r\n\r\n')
-                        if USE_TURBOJPEG:
-                            self.wfile.write(encodedImage)
-                        else:
-                            self.wfile.write(bytearray(encodedImage))
-                        self.wfile.write(b'\r\n')
-                        self.wfile.flush()
-                        
-                        # 计算发送耗时
-                        t_send_duration = time.perf_counter() - t_start_send
-
-                        # === ABR 自适应码率算法 ===
-                        # 如果发送耗时超过 50ms（说明网络开始拥堵），迅速降低画质
-                        if t_send_duration > 0.05:
-                            CURRENT_QUALITY = max(MIN_QUALITY, CURRENT_QUALITY - 5)
-                        # 如果发送很快（<20ms），缓慢恢复画质
-                        elif t_send_duration < 0.02 and CURRENT_QUALITY < MAX_QUALITY:
-                            CURRENT_QUALITY += 1
-                        
-                        last_sent_frame_id = current_frame_id
-                        last_send_time = now
-                    except (BrokenPipeError, ConnectionResetError):
-                        break  # 客户端断开，退出循环
-                    
-            except Exception:
-                pass
+def encode_yuv(frame, quality, width, height, subsample):
+    """平面 YUV 直接编码为 JPEG bytes，不经过 BGR"""
+    return jpeg.encode_from_yuv(frame, height, width, quality=quality, jpeg_subsample=TJSAMP[subsample])
+
+def decode_jpeg(data):
+    if USE_TURBOJPEG:
+        return jpeg.decode(data)
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def is_jpeg_buffer(frame):
+    """关闭 CONVERT_RGB 后 OpenCV 返回的是 1xN 的原始 MJPEG 数据，以 FFD8 开头"""
+    return (frame is not None and frame.dtype == np.uint8 and frame.size > 2
+            and (frame.ndim == 1 or frame.shape[0] == 1)
+            and frame.flat[0] == 0xFF and frame.flat[1] == 0xD8)
+
+def luma_thumbnail(frame, fmt, height):
+    """变化检测用的亮度缩略图，边长约为原图的 1/8"""
+    if fmt == "jpeg":
+        # 只解 DC 系数的 1/8 灰度解码，比完整解码便宜一个数量级
+        if USE_TURBOJPEG:
+            return jpeg.decode(frame, pixel_format=TJPF_GRAY, scaling_factor=(1, 8))
+        return cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if fmt == "yuv":
+        return frame[:height:8, ::8]  # Y 平面本身就是亮度
+    return frame[::8, ::8, 1]  # BGR 用绿色通道近似亮度
+
+def latest_frame_id():
+    return frame_id
+
+def level_size(level, width, height):
+    """第 level 档的分辨率"""
+    factor = RESOLUTION_LEVELS[level][1]
+    return width // factor, height // factor
+
+def peek_encoded_frame(quality, level=0, passthrough_quality=MAX_QUALITY):
+    """
+    不编码，只查缓存：有现成的 JPEG 返回 (frame_id, jpeg_bytes)，
+    还没有帧返回 (frame_id, None)，需要编码时返回 None。
+    """
+    with frame_condition:
+        current_id = frame_id
+        frame = output_frame
+        fmt = output_format
+    if frame is None:
+        return current_id, None
+    if fmt == "jpeg" and level == 0 and quality >= passthrough_quality:
+        return current_id, frame
+    cached = encoded_frames.get((level, quality))
+    if cached is not None and cached[0] == current_id:
+        return cached
+    return None
+
+def peek_snapshot():
+    """
+    /snapshot.jpg 用：不编码，返回当前帧已有的任意一个 JPEG (优先全分辨率、高画质)。
+    还没有帧返回 (frame_id, None)，当前帧还没被编码过返回 None。
+    """
+    with frame_condition:
+        current_id = frame_id
+        frame = output_frame
+        fmt = output_format
+    if frame is None:
+        return current_id, None
+    if fmt == "jpeg":
+        return current_id, frame
+    best = None
+    for (level, quality), (fid, data) in list(encoded_frames.items()):
+        if fid == current_id and (best is None or (level, -quality) < best[0]):
+            best = ((level, -quality), data)
+    if best is None:
+        return None
+    return current_id, best[1]
+
+def peek_recent_jpeg(after_id):
+    """
+    黑匣子用：不编码，返回 frame_id 比 after_id 新的帧里最新的一个全分辨率 JPEG (任意画质)，
+    同一帧有几种画质时取最高的。返回 (frame_id, jpeg_bytes)，没有返回 None。
+    """
+    best = None
+    for (level, quality), (fid, data) in list(encoded_frames.items()):
+        if level == 0 and fid > after_id and (best is None or (fid, quality) > best[0]):
+            best = ((fid, quality), data)
+    if best is None:
+        return None
+    return best[0][0], best[1]
+
+def get_encoded_frame(quality, level=0, passthrough_quality=MAX_QUALITY):
+    """
+    返回当前帧在指定分辨率档位和画质下的 (frame_id, jpeg_bytes)。
+    同一帧同一 (档位, 画质) 只编码一次，后来的客户端直接拿缓存。
+    直通模式下全分辨率且画质在上限时直接返回摄像头原生 JPEG，其余情况才解码重编码。
+    """
+    with frame_condition:
+        current_id = frame_id
+        frame = output_frame
+        fmt = output_format
+        pool = frame_pool
+        if frame is None:
+            return current_id, None
+        if fmt == "jpeg" and level == 0 and quality >= passthrough_quality:
+            return current_id, frame
+        cached = encoded_frames.get((level, quality))
+        if cached is not None and cached[0] == current_id:
+            return cached
+        # 编码期间占住这个缓冲，采集线程不会往里写下一帧
+        if pool:
+            pool.retain(frame)
+    try:
+        return _encode_frame(current_id, frame, fmt, quality, level)
+    finally:
+        if pool:
+            pool.release(frame)
+
+def _scaled_frame(current_id, frame, fmt, level):
+    """
+    第 level 档的缩小帧 (调用方持有 encode_lock)。
+    每帧每档只缩放一次，且从上一档再缩一半，而不是每档都从原图缩。
+    缩放结果写回上一帧同档位的数组，不重新分配。
+    """
+    cached = scaled_frames.get(level)
+    if cached is not None and cached[0] == current_id:
+        return cached[1]
+    src = frame if level == 1 else _scaled_frame(current_id, frame, fmt, level - 1)
+    ratio = RESOLUTION_LEVELS[level][1] // RESOLUTION_LEVELS[level - 1][1]
+    dst = cached[1] if cached is not None else None
+    if fmt == "yuv":
+        width, height, subsample = yuv_params
+        src_w, src_h = level_size(level - 1, width, height)
+        scaled = yuv.downscale_planar(src, src_w, src_h, subsample, ratio, dst)
+    else:
+        size = (src.shape[1] // ratio, src.shape[0] // ratio)
+        if dst is not None and dst.shape[1::-1] != size:
+            dst = None
+        scaled = cv2.resize(src, size, dst=dst, interpolation=cv2.INTER_AREA)
+    scaled_frames[level] = (current_id, scaled)
+    return scaled
+
+def _encode_frame(current_id, frame, fmt, quality, level):
+    global encode_count, decode_count, decoded_frame
+    key = (level, quality)
+    with encode_lock:
+        # 等锁期间可能已经有别的客户端编好了
+        cached = encoded_frames.get(key)
+        if cached is not None and cached[0] == current_id:
+            return cached
+        if fmt == "jpeg":
+            # 同一帧只解码一次，不同档位/画质共用
+            if decoded_frame[0] != current_id:
+                decoded_frame = (current_id, decode_jpeg(frame))
+                decode_count += 1
+            frame = decoded_frame[1]
+            fmt = "bgr"
+            if frame is None:
+                return current_id, None
+        if level:
+            frame = _scaled_frame(current_id, frame, fmt, level)
+        if fmt == "yuv":
+            width, height, subsample = yuv_params
+            data = encode_yuv(frame, quality, *level_size(level, width, height), subsample)
         else:
-            self.send_error(404)
+            data = encode_jpeg(frame, quality)
+        if data is None:
+            return current_id, None
+        encode_count += 1
+        cached = (current_id, data)
+        encoded_frames[key] = cached
+        return cached
+
+def prune_blackbox_dir(directory, keep=None, max_files=BLACKBOX_MAX_FILES, max_bytes=BLACKBOX_MAX_DIR_BYTES):
+    """按修改时间从旧到新删 directory 里的 AVI，直到数量和总大小都不超限 (keep 不删)"""
+    files = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".avi") and entry.is_file():
+            st = entry.stat()
+            files.append((st.st_mtime, st.st_size, entry.path))
+    files.sort()
+    count = len(files)
+    total = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if count <= max_files and total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        count -= 1
+        total -= size
+
+class SyntheticCapture:
+    """
+    合成帧源，接口与 cv2.VideoCapture 相同 (read/grab/retrieve/set/get/release)。
+    device='synthetic' 时使用，方便在没有摄像头的机器上做多客户端压测；
+    'synthetic-static' 输出静止画面。
+    """
+    def __init__(self, width=320, height=240, fps=30, moving=True):
+        self.width = width
+        self.moving = moving  # False 时画面静止，用于测试静止画面抑制
+        self.height = height
+        self.fps = fps
+        self._opened = True
+        self._convert_rgb = True
+        self._fourcc = "MJPG"
+        self._jpeg_frames = {}  # 直通模式用：平移量 -> 预编码的 JPEG
+        self._count = 0
+        self._next_time = time.perf_counter()
+        # 预先生成一张带渐变的底图，每帧平移一下，保证画面在变
+        x = np.arange(width, dtype=np.uint16)
+        y = np.arange(height, dtype=np.uint16)[:, None]
+        base = np.empty((height, width, 3), dtype=np.uint8)
+        base[..., 0] = (x + y) & 0xFF
+        base[..., 1] = (x * 2) & 0xFF
+        base[..., 2] = (y * 2) & 0xFF
+        self._base = base
 
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    """多线程 HTTP 服务器"""
-    pass
+    def isOpened(self):
+        return self._opened
+
+    def grab(self):
+        # 按设定帧率节拍出帧，模拟摄像头阻塞等待
+        delay = self._next_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_time = max(self._next_time + 1.0 / self.fps, time.perf_counter())
+        self._count += 1
+        return self._opened
+
+    def retrieve(self, image=None):
+        shift = self._count % self.width if self.moving else 0
+        frame = np.roll(self._base, shift, axis=1)
+        if not self._convert_rgb and self._fourcc in yuv.RAW_BYTES_PER_PIXEL:
+            data = self._raw_yuv(frame).reshape(1, -1)
+            if image is not None and image.size == data.size:
+                image.reshape(1, -1)[...] = data
+                return True, image
+            return True, data
+        if not self._convert_rgb:
+            # 模拟摄像头硬件输出的 MJPEG：每个平移量只编码一次
+            data = self._jpeg_frames.get(shift)
+            if data is None:
+                data = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])[1].reshape(1, -1)
+                self._jpeg_frames[shift] = data
+            return True, data
+        if image is not None and image.shape == frame.shape:
+            image[...] = frame
+            return True, image
+        return True, frame
+
+    def _raw_yuv(self, frame):
+        """模拟摄像头输出的 YUYV / NV12 原始数据"""
+        h, w = self.height, self.width
+        i420 = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420).reshape(-1)
+        n = w * h // 4
+        y = i420[:w * h].reshape(h, w)
+        u = i420[w * h:w * h + n].reshape(h // 2, w // 2)
+        v = i420[w * h + n:].reshape(h // 2, w // 2)
+        if self._fourcc == "NV12":
+            return np.concatenate((y.reshape(-1), np.dstack((u, v)).reshape(-1)))
+        packed = np.empty((h, w * 2), dtype=np.uint8)
+        packed[:, 0::2] = y
+        packed[:, 1::4] = np.repeat(u, 2, axis=0)
+        packed[:, 3::4] = np.repeat(v, 2, axis=0)
+        return packed
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_CONVERT_RGB:
+            self._convert_rgb = bool(value)
+            return True
+        if prop == cv2.CAP_PROP_FOURCC:
+            self._fourcc = "".join(chr((int(value) >> 8 * i) & 0xFF) for i in range(4))
+            return True
+        return False
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        return 0.0
+
+    def release(self):
+        self._opened = False
 
 class CameraStream:
     # 极致性能模式配置：分辨率降至 320x240
-    def __init__(self, port=8080, device='/dev/video0', width=320, height=240):
+    def __init__(self, port=8080, device='/dev/video0', width=320, height=240, passthrough=True,
+                 min_quality=MIN_QUALITY, max_quality=MAX_QUALITY, initial_quality=INITIAL_QUALITY,
+                 min_fps=MIN_FPS, max_fps=TARGET_FPS, ring_name=None,
+                 idle_fps=IDLE_FPS, keep_device_open=IDLE_KEEP_DEVICE_OPEN,
+                 capture_format=CAPTURE_FORMAT, yuv_subsample=YUV_SUBSAMPLE,
+                 suppress_static=STATIC_SUPPRESSION, static_keepalive_fps=STATIC_KEEPALIVE_FPS,
+                 blackbox=BLACKBOX_ENABLED, blackbox_fps=BLACKBOX_FPS, blackbox_quality=BLACKBOX_QUALITY):
         self.port = port
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.initial_quality = initial_quality
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        # 直通模式：直接转发摄像头输出的 MJPEG，省掉解码 + 重编码两次编解码
+        self.passthrough = passthrough
+        # YUYV / NV12 采集：保持 YUV，TurboJPEG 直接从平面 YUV 编码，省掉 YUV->BGR->YCbCr
+        self.capture_format = capture_format
+        self.yuv_subsample = yuv_subsample
+        self._to_planar = None
+        self._raw = None  # YUV 模式复用的原始帧缓冲
+        self._ring_format = FORMAT_BGR
         self.device = device
         self.width = width
         self.height = height
@@ -174,15 +404,95 @@ class CameraStream:
         self.thread = None
         self.server = None
         self.cap = None
+        # 独立进程模式：每帧同时写入控制进程创建的共享内存帧环
+        self.ring_name = ring_name
+        self.ring = None
+        self._ring_oversize_logged = False
+        # 按需采集：有 /video_feed 观看者时全速，没有时降到 idle_fps 保活 (0 为暂停)
+        # keep_device_open=False 时空闲直接关闭设备，彻底不占 USB 带宽，代价是恢复时要重新打开
+        self.idle_fps = idle_fps
+        self.keep_device_open = keep_device_open
+        self.viewers = 0
+        self.idle = False
+        self._demand = threading.Event()
+        # 静止画面抑制：detector.emitted / detector.suppressed 可以看到省下了多少帧
+        self.detector = ChangeDetector(keepalive_fps=static_keepalive_fps) if suppress_static else None
+        # 视频黑匣子：稳态每帧只有一次 memcpy
+        self.blackbox = BlackBox() if blackbox else None
+        self.blackbox_interval = 1.0 / blackbox_fps
+        self.blackbox_quality = blackbox_quality
+        self._last_record_time = 0
+        self._last_record_id = 0
+        self._blackbox_lock = threading.Lock()
+        self._last_blackbox_save = None
+        if self.blackbox:
+            # 黑匣子本身就是需求：没有观看者时也按 blackbox_fps 采集，不进入空闲
+            self._demand.set()
 
     def start(self):
         """启动摄像头采集和 HTTP 服务器"""
-        global frame_id
         if self.running:
             return
 
+        if not self._open_device():
+            # 这里我们即便摄像头失败，也返回，不启动 Server，否则用户会以为是网络问题
+            return
+
+        if self.ring_name:
+            try:
+                self.ring = FrameRing.attach(self.ring_name)
+            except (FileNotFoundError, ValueError) as e:
+                print(f"Warning: frame ring unavailable: {e}")
+
+        self.running = True
+        
+        self.capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.capture_thread.start()
+
+        try:
+            self.server = StreamServer(self, port=self.port,
+                                       min_quality=self.min_quality, max_quality=self.max_quality,
+                                       initial_quality=self.initial_quality,
+                                       min_fps=self.min_fps, max_fps=self.max_fps,
+                                       levels=[name for name, _ in RESOLUTION_LEVELS])
+            self.server.start()
+            print(f"Camera Stream started at http://<IP>:{self.port}/ (Full Screen)")
+        except OSError as e:
+            print(f"Error starting HTTP server: {e}")
+            self.server = None
+
+    # StreamServer 通过这几个方法取帧
+    def set_viewers(self, count):
+        """视频流观看者数量变化时由 StreamServer 调用 (事件循环线程)"""
+        if count and not self.viewers and self.detector:
+            self.detector.reset()  # 新观看者马上拿到一帧 (黑匣子开着时采集不会进入空闲)
+        self.viewers = count
+        if count or self.blackbox:
+            self._demand.set()
+        else:
+            self._demand.clear()
+
+    def latest_frame_id(self):
+        return latest_frame_id()
+
+    def peek_encoded_frame(self, quality, level=0):
+        return peek_encoded_frame(quality, level, self.max_quality)
+
+    def get_encoded_frame(self, quality, level=0):
+        return get_encoded_frame(quality, level, self.max_quality)
+
+    def peek_snapshot(self):
+        return peek_snapshot()
+
+    def _open_device(self):
+        """打开摄像头并设置格式，失败返回 False；空闲关闭设备后重新打开也走这里"""
+        global frame_pool, output_format
         print(f"Opening Camera {self.device} ({self.width}x{self.height}) [Low Bandwidth Mode]...")
-        self.cap = cv2.VideoCapture(self.device, cv2.CAP_V4L2)
+        if self.device.startswith('synthetic'):
+            self.cap = SyntheticCapture(self.width, self.height, self.max_fps,
+                                        moving=self.device != 'synthetic-static')
+        else:
+            self.cap = cv2.VideoCapture(self.device, cv2.CAP_V4L2)
 
         if not self.cap.isOpened():
             print(f"Warning: Could not open {self.device}. Trying /dev/video1...")
@@ -190,53 +500,243 @@ class CameraStream:
             self.cap = cv2.VideoCapture(self.device, cv2.CAP_V4L2)
             if not self.cap.isOpened():
                 print(f"Error: Could not open camera {self.device} either. Please unplug/replug camera.")
-                # 这里我们即便摄像头失败，也返回，不启动 Server，否则用户会以为是网络问题
-                return
+                return False
 
         # 关键优化：设置缓冲区大小为1，只保留最新的一帧，丢弃陈旧帧，大幅降低延迟
         self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
-        # 设置 MJPG 格式和分辨率
-        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        # 设置采集格式 (默认 MJPG) 和分辨率
+        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.capture_format))
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
         
         real_w = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
         real_h = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
         print(f"Camera opened: {real_w}x{real_h}")
+        self.frame_size = (int(real_w), int(real_h))
 
-        self.running = True
-        
-        self.capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
-        self.capture_thread.start()
+        w, h = self.frame_size
+        if self.capture_format in yuv.RAW_BYTES_PER_PIXEL:
+            self._setup_yuv()
+        elif self.passthrough:
+            self._setup_passthrough()
+        else:
+            output_format = "bgr"
 
-        try:
-            self.server = ThreadedHTTPServer(('0.0.0.0', self.port), MJPEGStreamHandler)
-            self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
-            self.server_thread.start()
-            print(f"Camera Stream started at http://<IP>:{self.port}/ (Full Screen)")
-        except OSError as e:
-            print(f"Error starting HTTP server: {e}")
+        # BGR / YUV 模式：预分配帧缓冲，采集时直接写入，不再每帧分配
+        if output_format == "jpeg":
+            frame_pool = None
+            self._ring_format = FORMAT_JPEG
+        elif output_format == "yuv":
+            subsample = yuv_params[2]
+            frame_pool = FramePool(yuv.planar_shape(w, h, subsample), count=FRAME_POOL_SIZE)
+            self._ring_format = FORMAT_YUV422P if subsample == "422" else FORMAT_YUV420P
+        else:
+            frame_pool = FramePool((h, w, 3), count=FRAME_POOL_SIZE)
+            self._ring_format = FORMAT_BGR
+        return True
+
+    def _setup_passthrough(self):
+        """关闭 OpenCV 的解码，拿到原始 MJPEG；摄像头不支持时回退到 BGR 模式"""
+        global output_format
+        self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        ret, frame = self.cap.read()
+        if ret and is_jpeg_buffer(frame):
+            output_format = "jpeg"
+            print("Camera MJPEG passthrough enabled")
+            return
+        print("Camera does not deliver raw MJPEG, using decode/re-encode path")
+        self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+        self.passthrough = False
+        output_format = "bgr"
+
+    def _setup_yuv(self):
+        """关闭 OpenCV 的颜色转换，拿到原始 YUYV / NV12；不支持时回退到 BGR 模式"""
+        global output_format, yuv_params
+        w, h = self.frame_size
+        fourcc = self.capture_format
+        if USE_YUV_ENCODE:
+            self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+            ret, frame = self.cap.read()
+            if ret and frame is not None and frame.size == yuv.raw_size(fourcc, w, h):
+                subsample = "420" if fourcc == "NV12" else self.yuv_subsample
+                yuv_params = (w, h, subsample)
+                self._to_planar = yuv.TO_PLANAR[fourcc]
+                self._raw = frame
+                output_format = "yuv"
+                print(f"Camera {fourcc} capture enabled, encoding from YUV {subsample}")
+                return
+            print(f"Camera does not deliver raw {fourcc}, using BGR path")
+            self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+        else:
+            print("TurboJPEG encode_from_yuv not available, using BGR path")
+        output_format = "bgr"
 
     def _capture_loop(self):
         global output_frame, frame_id
-        frame_interval = 1.0 / TARGET_FPS
+        frame_interval = FRAME_INTERVAL_SLACK / self.max_fps
         last_capture_time = 0
         
-        while self.running and self.cap.isOpened():
-            ret, frame = self.cap.read()
-            if ret:
-                now = time.perf_counter()
-                # 限制采集帧率
-                if now - last_capture_time >= frame_interval:
-                    with frame_condition:
-                        output_frame = frame
-                        frame_id += 1
-                        frame_condition.notify_all()
-                    last_capture_time = now
-            else:
+        ring = self.ring
+
+        while self.running:
+            if not self._demand.is_set():
+                if not self._idle_wait(ring) or not self.running:
+                    continue
+                last_capture_time = 0  # 保活帧或刚恢复的第一帧不受限速
+            if not self.cap.isOpened() and self.running:
+                if not self._open_device():
+                    time.sleep(1.0)
+                    continue
+
+            # 先只 grab：限速要丢掉的帧不做 retrieve，省掉解码/拷贝
+            grabbed = self.cap.grab()
+            if ring:
+                ring.heartbeat()
+            if not grabbed:
                 time.sleep(0.01)
-        
+                continue
+            now = time.perf_counter()
+            # 限制采集帧率：没有观看者时只为黑匣子采集，按 blackbox_fps
+            interval = frame_interval if self.viewers else max(frame_interval,
+                                                               FRAME_INTERVAL_SLACK * self.blackbox_interval)
+            if now - last_capture_time < interval:
+                continue
+
+            pool = frame_pool
+            if pool:
+                buf = pool.acquire()
+                if buf is None:
+                    # 缓冲全被编码线程占着，这一帧反正也来不及编码
+                    continue
+                if output_format == "yuv":
+                    # 原始 YUYV/NV12 读进复用缓冲，再按平面布局搬进池里的缓冲
+                    ret, raw = self.cap.retrieve(image=self._raw)
+                    if ret:
+                        self._raw = raw
+                        w, h, subsample = yuv_params
+                        self._to_planar(raw, buf, w, h, subsample)
+                    frame = buf
+                else:
+                    ret, frame = self.cap.retrieve(image=buf)
+                if not ret or frame is not buf:
+                    # 尺寸不符时 OpenCV 会另外分配，这一帧照常使用，缓冲退回池里
+                    pool.release(buf)
+            else:
+                ret, frame = self.cap.retrieve()
+            if not ret:
+                continue
+
+            if output_format == "jpeg":
+                # 原生 JPEG 转成不可变 bytes，所有客户端直接共享
+                frame = frame.tobytes()
+
+            detector = self.detector
+            if detector and not detector.should_emit(
+                    luma_thumbnail(frame, output_format, self.frame_size[1]), now):
+                # 画面没变：不发布，后面的编码和发送全部省掉；黑匣子照常按 blackbox_fps 记录
+                if self.blackbox:
+                    self._record_blackbox(frame, now)
+                if pool:
+                    pool.release(frame)
+                last_capture_time = now
+                continue
+
+            with frame_condition:
+                previous = output_frame
+                output_frame = frame
+                frame_id += 1
+                frame_condition.notify_all()
+            if pool:
+                # 上一帧不再是当前帧，交还它的引用；还在编码的话等编码结束才会复用
+                pool.release(previous)
+            if self.server:
+                self.server.notify_frame()
+            if ring:
+                w, h = frame.shape[1::-1] if output_format == "bgr" else self.frame_size
+                if not ring.publish(frame, w, h, self._ring_format) and not self._ring_oversize_logged:
+                    # 帧比环的槽大：只提示一次，HTTP 流照常，帧环里没有这些帧
+                    self._ring_oversize_logged = True
+                    print(f"Warning: {w}x{h} frame does not fit a {ring.slot_size}-byte ring slot, "
+                          "not published to the frame ring")
+            if self.blackbox:
+                self._record_blackbox(frame, now)
+            last_capture_time = now
+
+    def _record_blackbox(self, frame, now):
+        """
+        按 blackbox_interval 记录一帧。frame 是这一轮采到的帧 (直通模式下就是 JPEG)。
+        非直通模式优先记录观看者已经编好的 JPEG (任意画质，编码在发布之后，所以通常是上一帧)；
+        上次记录之后没有新编码过的帧时才按 blackbox_quality 编码当前帧
+        (画面没变没有发布时当前帧已经编过，缓存命中)。
+        """
+        if now - self._last_record_time < FRAME_INTERVAL_SLACK * self.blackbox_interval:
+            return
+        self._last_record_time = now
+        if output_format == "jpeg":
+            data = frame
+        else:
+            cached = peek_recent_jpeg(self._last_record_id)
+            if cached is None:
+                cached = get_encoded_frame(self.blackbox_quality, 0, self.max_quality)
+            self._last_record_id, data = cached
+        if data is not None:
+            self.blackbox.append(data)
+
+    def save_blackbox(self, seconds=None):
+        """
+        把黑匣子里最近一段写成 AVI，返回 (路径, 帧数)；没有启用、没有帧或还在冷却期时路径为 None。
+        写完后按 BLACKBOX_MAX_FILES / BLACKBOX_MAX_DIR_BYTES 删掉最旧的文件。
+        """
+        if not self.blackbox or not self.blackbox.count:
+            return None, 0
+        with self._blackbox_lock:
+            now = time.monotonic()
+            if self._last_blackbox_save is not None and now - self._last_blackbox_save < BLACKBOX_COOLDOWN:
+                print("Black box dump skipped: cooldown")
+                return None, 0
+            self._last_blackbox_save = now
+            directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), BLACKBOX_DIR)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, time.strftime("%Y%m%d-%H%M%S") + ".avi")
+            count = self.blackbox.dump(path, *self.frame_size, seconds=seconds)
+            if not count:
+                return None, 0
+            print(f"Black box saved: {count} frames -> {path}")
+            prune_blackbox_dir(directory, keep=path)
+            return path, count
+
+    def dump_blackbox(self, delay=0.0):
+        """非阻塞：delay 秒后在后台线程保存黑匣子 (把触发之后的几秒也录进去)"""
+        if self.blackbox:
+            timer = threading.Timer(delay, self.save_blackbox)
+            timer.daemon = True
+            timer.start()
+
+    def _idle_wait(self, ring):
+        """
+        没有观看者时调用，最多阻塞一个保活间隔。
+        返回 True 表示现在该取一帧 (观看者到来或保活时间到)，False 表示继续等。
+        """
+        if not self.idle:
+            self.idle = True
+            print("No viewers, camera idle")
+            if not self.keep_device_open:
+                self.cap.release()
+        if ring:
+            ring.heartbeat()
+        keepalive = self.idle_fps > 0 and self.keep_device_open
+        woke = self._demand.wait(1.0 / self.idle_fps if keepalive else 1.0)
+        if woke:
+            self.idle = False
+            if self.detector:
+                self.detector.reset()  # 新观看者马上拿到一帧
+            print("Viewer connected, camera resumed")
+        if (woke or keepalive) and self.cap.isOpened():
+            # 丢掉空闲期间留在驱动队列里的旧帧
+            self.cap.grab()
+        return woke or keepalive
+
     def stop(self):
         """停止采集和服务"""
         self.running = False
@@ -248,14 +748,21 @@ class CameraStream:
             except:
                 pass
 
-        # 2. 尝试关闭 HTTP 服务器
+        # 2. 关闭 HTTP 服务器：停止监听、断开所有客户端并等待事件循环线程退出
         if self.server:
             try:
-                # 仅关闭 socket，不调用 shutdown() 以避免死锁等待
-                # 因为 server 线程是 daemon，主程序退出时会自动销毁
-                self.server.server_close()
+                self.server.stop()
             except:
                 pass
+
+        # 采集线程可能在空闲等待观看者
+        self._demand.set()
+
+        if self.ring:
+            # 等采集线程退出再解除映射，避免写到一半
+            self.capture_thread.join(timeout=1.0)
+            self.ring.close()
+            self.ring = None
         
         # 3. 唤醒可能卡在 wait() 的线程以便它们能响应退出
         try:
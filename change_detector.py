@@ -0,0 +1,68 @@
+import numpy as np
+
+# 静止画面检测：比较缩小后的亮度图，变化不明显的帧不编码、不发送
+# 单个像素亮度变化超过这个值才算"变了" (滤掉传感器噪声)
+PIXEL_DELTA = 12
+# 变了的像素占比超过这个值才算画面有变化
+CHANGED_FRACTION = 0.01
+# 静止时最少每秒发这么多帧，客户端不会以为断流
+KEEPALIVE_FPS = 2
+# 检测到变化后这么久之内每帧都发 (秒)：缓慢平移时相邻帧差很小，不能只发越过阈值的那几帧
+MOTION_HOLD = 1.0
+
+
+class ChangeDetector:
+    """
+    与"上一次检测到变化时的帧"比较，而不是与上一帧比较，缓慢变化累积起来也能被发现。
+    检测到变化后进入运动状态，MOTION_HOLD 秒内每帧都发布；画面一直在变就会不断续上，
+    停下来之后回到只发保活帧。保活帧和运动状态下补发的帧不更新参考帧。
+    输入是很小的亮度缩略图 (uint8 二维数组)，每帧开销在几十微秒量级。
+    """
+    def __init__(self, pixel_delta=PIXEL_DELTA, changed_fraction=CHANGED_FRACTION,
+                 keepalive_fps=KEEPALIVE_FPS, motion_hold=MOTION_HOLD):
+        self.pixel_delta = pixel_delta
+        self.changed_fraction = changed_fraction
+        self.keepalive_interval = 1.0 / keepalive_fps if keepalive_fps else float('inf')
+        self.motion_hold = motion_hold
+        self._reference = None
+        self._last_emit = 0.0
+        self._motion_until = 0.0
+        self._diff = None
+        self.emitted = 0
+        self.suppressed = 0
+
+    def should_emit(self, luma, now):
+        """luma 是当前帧的亮度缩略图；返回 True 表示这一帧需要发布"""
+        ref = self._reference
+        if ref is None or ref.shape != luma.shape:
+            self._set_reference(luma)
+            return self._emit(now)
+        if self._diff is None or self._diff.shape != luma.shape:
+            self._diff = np.empty(luma.shape, dtype=np.int16)
+        diff = self._diff
+        np.subtract(luma, ref, out=diff, dtype=np.int16)
+        np.abs(diff, out=diff)
+        changed = np.count_nonzero(diff > self.pixel_delta)
+        if changed > self.changed_fraction * diff.size:
+            self._set_reference(luma)
+            self._motion_until = now + self.motion_hold
+            return self._emit(now)
+        if now < self._motion_until or now - self._last_emit >= self.keepalive_interval:
+            return self._emit(now)
+        self.suppressed += 1
+        return False
+
+    def _set_reference(self, luma):
+        if self._reference is None or self._reference.shape != luma.shape:
+            self._reference = luma.copy()
+        else:
+            self._reference[...] = luma
+
+    def _emit(self, now):
+        self._last_emit = now
+        self.emitted += 1
+        return True
+
+    def reset(self):
+        """观看者重新连上时调用，下一帧一定发布"""
+        self._reference = None
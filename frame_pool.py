@@ -0,0 +1,49 @@
+import threading
+import numpy as np
+
+
+class FramePool:
+    """
+    预分配的帧缓冲池，采集循环用 cap.read(image=buf) / retrieve(image=buf) 直接写进去，
+    不再每帧分配新数组。
+
+    引用计数：acquire() 拿到的缓冲计数为 1 (归当前帧所有)，
+    编码线程读帧前 retain()、读完 release()，计数归零的缓冲才会被重新写入，
+    保证编码到一半的帧不会被采集线程覆盖。不属于本池的对象调用 retain/release 什么也不做。
+    """
+    def __init__(self, shape, dtype=np.uint8, count=4):
+        self.buffers = [np.empty(shape, dtype=dtype) for _ in range(count)]
+        self._refs = [0] * count
+        self._index = {id(buf): i for i, buf in enumerate(self.buffers)}
+        self._lock = threading.Lock()
+        self._next = 0
+        self.exhausted = 0  # 所有缓冲都被占用、只能丢帧的次数
+
+    def acquire(self):
+        """取一个空闲缓冲 (计数置 1)，全部占用时返回 None"""
+        count = len(self.buffers)
+        with self._lock:
+            for k in range(count):
+                i = (self._next + k) % count
+                if self._refs[i] == 0:
+                    self._refs[i] = 1
+                    self._next = i + 1
+                    return self.buffers[i]
+            self.exhausted += 1
+        return None
+
+    def retain(self, buf):
+        i = self._index.get(id(buf))
+        if i is not None:
+            with self._lock:
+                self._refs[i] += 1
+
+    def release(self, buf):
+        i = self._index.get(id(buf))
+        if i is not None:
+            with self._lock:
+                self._refs[i] -= 1
+
+    def in_use(self):
+        with self._lock:
+            return sum(1 for r in self._refs if r)
@@ -0,0 +1,138 @@
+import struct
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory, resource_tracker, parent_process
+
+# 共享内存帧环：摄像头进程单写，多个进程只读。
+#
+# 布局：
+#   [头部 64B][槽 0 头 32B][槽 0 数据 slot_size]...[槽 N-1 头][槽 N-1 数据]
+# 头部：magic, version, 槽数, 槽大小, 最新帧序号, 心跳时间
+# 槽头：帧序号, 时间戳, 数据长度, 宽, 高, 格式
+#
+# 写入顺序 (seqlock)：先把槽序号清 0 → 写数据和槽头 → 写槽序号 → 更新全局最新序号。
+# 读者按最新序号找到槽，直接拿共享内存的 memoryview (不拷贝)，
+# 用完后用 is_valid() 确认这段时间里槽没有被覆盖。
+
+MAGIC = b"FRNG"
+VERSION = 1
+
+FORMAT_JPEG = 0
+FORMAT_BGR = 1
+FORMAT_YUV420P = 2  # 平面 YUV，布局见 yuv.py
+FORMAT_YUV422P = 3
+
+_HEADER = struct.Struct("<4sIIIQQ")    # magic version slots slot_size latest_seq heartbeat_ns
+_HEADER_SIZE = 64
+_LATEST_OFFSET = 16
+_HEARTBEAT_OFFSET = 24
+_SLOT_HEADER = struct.Struct("<QQIHHB")  # seq timestamp_ns length width height format
+_SLOT_HEADER_SIZE = 32
+_U64 = struct.Struct("<Q")
+
+RingFrame = namedtuple("RingFrame", ["seq", "timestamp_ns", "width", "height", "format", "data"])
+
+
+class FrameRing:
+    def __init__(self, shm, slots, slot_size, owner):
+        self.shm = shm
+        self.buf = shm.buf
+        self.slots = slots
+        self.slot_size = slot_size
+        self.owner = owner
+        self._stride = _SLOT_HEADER_SIZE + slot_size
+        self._seq = _U64.unpack_from(self.buf, _LATEST_OFFSET)[0]
+
+    @classmethod
+    def create(cls, name=None, slots=4, slot_size=512 * 1024):
+        size = _HEADER_SIZE + slots * (_SLOT_HEADER_SIZE + slot_size)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, slots, slot_size, 0, 0)
+        return cls(shm, slots, slot_size, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        shm = shared_memory.SharedMemory(name=name)
+        # 只是挂载，不归本进程管理：无关进程有自己的 resource_tracker，
+        # 退出时会把共享内存删掉，这里取消登记。
+        # 由创建者派生的子进程和创建者共用一个 tracker，不能取消，否则创建者的登记也没了
+        if parent_process() is None:
+            try:
+                resource_tracker.unregister(shm._name, "shared_memory")
+            except Exception:
+                pass
+        magic, version, slots, slot_size, _, _ = _HEADER.unpack_from(shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            shm.close()
+            raise ValueError(f"{name} is not a frame ring")
+        return cls(shm, slots, slot_size, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _slot_offset(self, seq):
+        return _HEADER_SIZE + ((seq - 1) % self.slots) * self._stride
+
+    # ---------------- 写端 (单写者) ----------------
+    def publish(self, data, width=0, height=0, fmt=FORMAT_JPEG, timestamp_ns=None):
+        """写入一帧，返回帧序号；data 可以是 bytes 或连续的 numpy 数组"""
+        view = memoryview(data).cast('B')
+        length = view.nbytes
+        if length > self.slot_size:
+            return 0
+        seq = self._seq + 1
+        off = self._slot_offset(seq)
+        buf = self.buf
+        _U64.pack_into(buf, off, 0)  # 标记写入中
+        start = off + _SLOT_HEADER_SIZE
+        buf[start:start + length] = view
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        _SLOT_HEADER.pack_into(buf, off, seq, timestamp_ns, length, width, height, fmt)
+        _U64.pack_into(buf, _LATEST_OFFSET, seq)
+        self._seq = seq
+        return seq
+
+    def heartbeat(self):
+        """写端存活信号：采集循环每轮调用，空闲等待时也照常更新"""
+        _U64.pack_into(self.buf, _HEARTBEAT_OFFSET, time.monotonic_ns())
+
+    # ---------------- 读端 ----------------
+    def latest_seq(self):
+        return _U64.unpack_from(self.buf, _LATEST_OFFSET)[0]
+
+    def heartbeat_ns(self):
+        return _U64.unpack_from(self.buf, _HEARTBEAT_OFFSET)[0]
+
+    def read(self, seq=None):
+        """
+        取指定 (默认最新) 一帧，data 是指向共享内存的 memoryview。
+        读完后调用 is_valid(frame) 确认数据没有被写端覆盖；帧已被覆盖返回 None。
+        """
+        if seq is None:
+            seq = self.latest_seq()
+        if seq == 0:
+            return None
+        off = self._slot_offset(seq)
+        slot_seq, timestamp_ns, length, width, height, fmt = _SLOT_HEADER.unpack_from(self.buf, off)
+        if slot_seq != seq:
+            return None
+        start = off + _SLOT_HEADER_SIZE
+        return RingFrame(seq, timestamp_ns, width, height, fmt, self.buf[start:start + length])
+
+    def is_valid(self, frame):
+        return _U64.unpack_from(self.buf, self._slot_offset(frame.seq))[0] == frame.seq
+
+    def close(self):
+        self.buf = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # 还有读者持有 memoryview，等它们释放后由 GC 关闭
+            pass
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
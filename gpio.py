@@ -0,0 +1,220 @@
+import fcntl
+import os
+import struct
+import time
+from array import array
+
+GPIO_SYSFS_ROOT = "/sys/class/gpio"
+GPIO_DEV_DIR = "/dev"
+GPIO_CONSUMER = "faster_car"
+# memory 后端保留的最近写入次数
+GPIO_MEMORY_RECORDS = 65536
+
+# ---- Linux GPIO v2 字符设备 uapi (include/uapi/linux/gpio.h) ----
+GPIO_V2_LINES_MAX = 64
+GPIO_V2_LINE_NUM_ATTRS_MAX = 10
+GPIO_V2_LINE_FLAG_OUTPUT = 1 << 3
+GPIO_V2_LINE_ATTR_ID_OUTPUT_VALUES = 2
+
+# struct gpio_v2_line_request 各字段偏移，总长 592 字节
+_REQ_OFFSETS = 0            # __u32 offsets[64]
+_REQ_CONSUMER = 256         # char consumer[32]
+_REQ_CONFIG = 288           # struct gpio_v2_line_config (272 字节)
+_REQ_NUM_LINES = 560        # __u32 num_lines
+_REQ_FD = 588               # __s32 fd
+_REQ_SIZE = 592
+# struct gpio_v2_line_config 内部：flags(u64) num_attrs(u32) padding[5] attrs[10]
+_CFG_ATTRS = 32
+
+_LINE_VALUES = struct.Struct("<QQ")  # struct gpio_v2_line_values { bits, mask }
+
+def _iowr(nr, size):
+    return (3 << 30) | (size << 16) | (0xB4 << 8) | nr
+
+GPIO_V2_GET_LINE_IOCTL = _iowr(0x07, _REQ_SIZE)
+GPIO_V2_LINE_SET_VALUES_IOCTL = _iowr(0x0F, _LINE_VALUES.size)
+
+
+def resolve_line(pin, sysfs_root=None):
+    """
+    把 sysfs 全局 GPIO 编号换算成 (/dev/gpiochipN, 线偏移)。
+    优先根据 /sys/class/gpio/gpiochip*/base 查找，找不到时按 Rockchip 每 bank 32 线推算。
+    """
+    root = sysfs_root or GPIO_SYSFS_ROOT
+    try:
+        for name in os.listdir(root):
+            if not name.startswith("gpiochip"):
+                continue
+            with open(f"{root}/{name}/base") as f:
+                base = int(f.read())
+            with open(f"{root}/{name}/ngpio") as f:
+                ngpio = int(f.read())
+            if base <= pin < base + ngpio:
+                dev = os.path.basename(os.path.realpath(f"{root}/{name}/device"))
+                if not dev.startswith("gpiochip"):
+                    dev = f"gpiochip{pin // 32}"
+                return f"{GPIO_DEV_DIR}/{dev}", pin - base
+    except (OSError, ValueError):
+        pass
+    return f"{GPIO_DEV_DIR}/gpiochip{pin // 32}", pin % 32
+
+
+class SysfsGPIO:
+    """旧的 /sys/class/gpio 接口，每个引脚一次文件写入"""
+    def __init__(self, pins, sysfs_root=None):
+        self.root = sysfs_root or GPIO_SYSFS_ROOT
+        self.pins = list(pins)
+        for pin in self.pins:
+            self._setup_gpio(pin)
+
+    def _setup_gpio(self, pin):
+        path = f"{self.root}/gpio{pin}"
+        if not os.path.exists(path):
+            with open(f"{self.root}/export", 'w') as f:
+                f.write(str(pin))
+        with open(f"{path}/direction", 'w') as f:
+            f.write("out")
+
+    def _write_gpio(self, pin, value):
+        with open(f"{self.root}/gpio{pin}/value", 'w') as f:
+            f.write(str(value))
+
+    def set_values(self, values):
+        """values: ((pin, 0/1), ...)"""
+        for pin, value in values:
+            self._write_gpio(pin, value)
+
+    def close(self):
+        pass
+
+
+class ChardevGPIO:
+    """
+    GPIO v2 字符设备接口：初始化时一次性申请所有引脚，
+    同一个 gpiochip 上的引脚用一次 GPIO_V2_LINE_SET_VALUES 原子地同时更新。
+    """
+    def __init__(self, pins, consumer=GPIO_CONSUMER, sysfs_root=None):
+        self.pins = list(pins)
+        # chip 路径 -> [(pin, 线偏移), ...]
+        chips = {}
+        for pin in self.pins:
+            chip, offset = resolve_line(pin, sysfs_root)
+            chips.setdefault(chip, []).append((pin, offset))
+
+        self._line_fds = []
+        self._bufs = []
+        self._bits = {}   # pin -> (组序号, 位掩码)
+        try:
+            for index, (chip, lines) in enumerate(chips.items()):
+                fd = self._request_lines(chip, [offset for _, offset in lines], consumer)
+                self._line_fds.append(fd)
+                self._bufs.append(bytearray(_LINE_VALUES.size))
+                for bit, (pin, _) in enumerate(lines):
+                    self._bits[pin] = (index, 1 << bit)
+        except OSError:
+            self.close()
+            raise
+
+        # 每组的待写 bits/mask，set_values 复用避免分配
+        self._pending_bits = [0] * len(self._line_fds)
+        self._pending_mask = [0] * len(self._line_fds)
+
+    @staticmethod
+    def _request_lines(chip, offsets, consumer):
+        if len(offsets) > GPIO_V2_LINES_MAX:
+            raise ValueError("too many lines on one gpiochip")
+        req = bytearray(_REQ_SIZE)
+        struct.pack_into(f"<{len(offsets)}I", req, _REQ_OFFSETS, *offsets)
+        name = consumer.encode()[:31]
+        req[_REQ_CONSUMER:_REQ_CONSUMER + len(name)] = name
+        # config.flags = OUTPUT，附带一个 OUTPUT_VALUES 属性让所有线初始为 0
+        all_lines = (1 << len(offsets)) - 1
+        struct.pack_into("<QI", req, _REQ_CONFIG, GPIO_V2_LINE_FLAG_OUTPUT, 1)
+        struct.pack_into("<IIQQ", req, _REQ_CONFIG + _CFG_ATTRS,
+                         GPIO_V2_LINE_ATTR_ID_OUTPUT_VALUES, 0, 0, all_lines)
+        struct.pack_into("<I", req, _REQ_NUM_LINES, len(offsets))
+
+        chip_fd = os.open(chip, os.O_RDWR | os.O_CLOEXEC)
+        try:
+            fcntl.ioctl(chip_fd, GPIO_V2_GET_LINE_IOCTL, req)
+        finally:
+            os.close(chip_fd)
+        return struct.unpack_from("<i", req, _REQ_FD)[0]
+
+    def set_values(self, values):
+        """values: ((pin, 0/1), ...)，同一 chip 上的引脚一次 ioctl 完成"""
+        bits = self._pending_bits
+        mask = self._pending_mask
+        for pin, value in values:
+            index, bit = self._bits[pin]
+            mask[index] |= bit
+            if value:
+                bits[index] |= bit
+        for index, fd in enumerate(self._line_fds):
+            if mask[index]:
+                buf = self._bufs[index]
+                _LINE_VALUES.pack_into(buf, 0, bits[index], mask[index])
+                fcntl.ioctl(fd, GPIO_V2_LINE_SET_VALUES_IOCTL, buf)
+                bits[index] = 0
+                mask[index] = 0
+
+    def same_chip(self, pins):
+        """这些引脚是否在同一个 gpiochip 上 (同一次 ioctl 原子更新)"""
+        return len({self._bits[pin][0] for pin in pins}) == 1
+
+    def close(self):
+        for fd in self._line_fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._line_fds = []
+
+
+class MemoryGPIO:
+    """
+    不碰硬件：当前电平放在 values 里，每次写入的 (引脚, 电平, 时间) 记进预分配的数组
+    (环形，保留最近 capacity 次)。
+    """
+    def __init__(self, pins, capacity=GPIO_MEMORY_RECORDS):
+        self.pins = list(pins)
+        self.values = dict.fromkeys(self.pins, 0)
+        self.capacity = capacity
+        self.written_pins = array('H', bytes(2 * capacity))
+        self.written_values = array('B', bytes(capacity))
+        self.timestamps = array('q', bytes(8 * capacity))
+        self.count = 0
+        self.calls = 0
+
+    def set_values(self, values):
+        """values: ((pin, 0/1), ...)，同一次调用里的引脚记同一个时间"""
+        now = time.monotonic_ns()
+        for pin, value in values:
+            self.values[pin] = value
+            i = self.count % self.capacity
+            self.written_pins[i] = pin
+            self.written_values[i] = value
+            self.timestamps[i] = now
+            self.count += 1
+        self.calls += 1
+
+    def history(self):
+        """按时间顺序返回保留的写入 [(timestamp_ns, pin, value), ...]"""
+        n = min(self.count, self.capacity)
+        return [(self.timestamps[k % self.capacity], self.written_pins[k % self.capacity],
+                 self.written_values[k % self.capacity]) for k in range(self.count - n, self.count)]
+
+    def close(self):
+        pass
+
+
+def open_gpio(pins, backend="chardev"):
+    """按名字 ("chardev" / "sysfs" / "memory") 创建 GPIO 后端；字符设备不可用时回退到 sysfs"""
+    if backend == "memory":
+        return MemoryGPIO(pins)
+    if backend == "chardev":
+        try:
+            return ChardevGPIO(pins)
+        except OSError as e:
+            print(f"GPIO chardev unavailable ({e}), falling back to sysfs")
+    return SysfsGPIO(pins)
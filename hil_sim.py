@@ -0,0 +1,456 @@
+import argparse
+import json
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import tty
+from collections import namedtuple
+
+import gpio
+import main
+import motor
+import pwm
+import servo
+import telemetry
+from histogram import Histogram
+from sbus_receiver import (SBUS_FLAG_FAILSAFE, SBUS_FLAG_FRAME_LOST, SBUS_FOOTER, SBUS_FRAME_LEN,
+                           SBUS_HEADER)
+
+# 硬件在环仿真：不接车，把 main.main() 原样跑在假硬件上
+#   - SBUS：合成 (或录制的) 字节流写进伪终端 (pty)，SBUSReceiver 照常用 pyserial 打开从端
+#   - PWM / GPIO：临时目录里搭一棵假 sysfs，duty_cycle / enable / value 都是普通文件
+#   - 只改模块级配置 (端口、sysfs 路径、摄像头关闭、遥测文件)，不改 main.py 的任何逻辑
+# 跑完后检查每一步结束时假 sysfs 里的输出、遥测里每个 tick 的输出是否与参考模型一致
+# 用法：python3 hil_sim.py [--speed 5] [--replay capture.bin] [--keep]
+
+SBUS_FRAME_INTERVAL = 0.014  # 真实接收机的帧间隔 (秒)，--speed 按比例缩短
+HIL_MIN_HOLD = 0.05          # 加速时每一步至少保持这么久 (实际时间)，让控制循环跟上
+HIL_START_TIMEOUT = 10.0     # 等 main() 初始化完成的最长时间
+
+HIL_BIN_NS = 10000    # 响应延迟直方图：10us 一格
+HIL_NUM_BINS = 10000  # 覆盖 100ms
+
+# 仿真场景：(名字, 持续时间 s, 通道值, flags, 期望输出)
+#   通道值按用途给出 (throttle / steering / camera -> main.CH_*)，没给的通道保持中位
+#   通道值为 None 表示这段时间不发任何帧 (模拟断线)
+#   期望输出 (throttle, steering, camera, link_ok)，即 map_sbus_to_pwm 之后的值
+Step = namedtuple("Step", ["name", "duration", "channels", "flags", "expected"])
+
+DEFAULT_SCENARIO = (
+    Step("neutral", 0.5, {}, 0, (0.0, 0.0, 0.0, True)),
+    Step("forward half", 0.5, {"throttle": 1392}, 0, (0.5, 0.0, 0.0, True)),
+    Step("full reverse, steering max", 0.5, {"throttle": 192, "steering": 1792}, 0, (-1.0, 1.0, 0.0, True)),
+    Step("inside deadband", 0.5, {"throttle": 1080, "steering": 910}, 0, (0.0, 0.0, 0.0, True)),
+    Step("steering half, camera pan", 0.5, {"steering": 592, "camera": 1592}, 0, (0.0, -0.5, 0.75, True)),
+    Step("frame lost flag", 0.3, {"throttle": 1192}, SBUS_FLAG_FRAME_LOST, (0.25, 0.0, 0.0, True)),
+    Step("receiver failsafe", 0.5, {"throttle": 1392}, SBUS_FLAG_FAILSAFE, (0.0, 0.0, 0.0, False)),
+    Step("recover", 0.5, {"throttle": 1392, "steering": 1192}, 0, (0.5, 0.25, 0.0, True)),
+    Step("signal loss", 0.5, None, 0, (0.0, 0.0, 0.0, False)),
+    Step("recover neutral", 0.5, {}, 0, (0.0, 0.0, 0.0, True)),
+)
+
+# 遥测记录解包后的字段 (telemetry.RECORD 顺序，channels 收成一个元组)
+Tick = namedtuple("Tick", [
+    "t_ns", "tick_ns", "period_ns", "sbus_seq", "channels", "flags", "mode", "dir_a", "dir_b",
+    "throttle", "steering", "camera", "duty_servo", "duty_cam_servo", "duty_motor_a", "duty_motor_b"])
+
+# 假 sysfs 里各执行器对应的 (pwmchip, 通道)
+ACTUATORS = (
+    ("servo", servo.SERVO_PWM_CHIP, servo.SERVO_PWM_ID),
+    ("cam_servo", servo.CAMERA_SERVO_CHIP, servo.CAMERA_SERVO_ID),
+    ("motor_a", motor.MOTOR_A_PWM_CHIP, motor.MOTOR_A_PWM_ID),
+    ("motor_b", motor.MOTOR_B_PWM_CHIP, motor.MOTOR_B_PWM_ID),
+)
+# 电机方向引脚 (IN1, IN2)，与 main.py 创建 Motor 时的顺序一致
+MOTOR_PINS = {
+    "motor_a": (main.PIN_IN2, main.PIN_IN1),
+    "motor_b": (main.PIN_IN3, main.PIN_IN4),
+}
+
+
+def encode_frame(channels, flags=0):
+    """16 个 11 位通道 + flags 打包成 25 字节 SBUS 帧 (与 SBUSReceiver._parse_frame 互逆)"""
+    bits = 0
+    for i, value in enumerate(channels):
+        bits |= (value & 0x07FF) << (11 * i)
+    return bytes((SBUS_HEADER,)) + bits.to_bytes(22, 'little') + bytes((flags, SBUS_FOOTER))
+
+
+def step_channels(step):
+    channels = [main.SBUS_MID] * 16
+    for role, value in step.channels.items():
+        channels[getattr(main, "CH_" + role.upper())] = value
+    return channels
+
+
+def scenario_stream(scenario):
+    """场景展开成 [(步序号, 帧字节或 None, 名义持续时间), ...]，--save 也用它写录制文件"""
+    for index, step in enumerate(scenario):
+        frame = None if step.channels is None else encode_frame(step_channels(step), step.flags)
+        yield index, frame, step.duration
+
+
+def build_fake_sysfs(root):
+    """临时目录里搭 pwmchipN/pwmM 和 gpioN：内核导出后才有的属性文件提前建好"""
+    pwm_root = os.path.join(root, "pwm")
+    gpio_root = os.path.join(root, "gpio")
+    for _, chip, channel in ACTUATORS:
+        chip_dir = os.path.join(pwm_root, f"pwmchip{chip}")
+        os.makedirs(os.path.join(chip_dir, f"pwm{channel}"), exist_ok=True)
+        for name in ("export", "unexport"):
+            open(os.path.join(chip_dir, name), 'w').close()
+        for attr, value in (("period", "0"), ("duty_cycle", "0"), ("enable", "0"), ("polarity", "normal")):
+            with open(os.path.join(chip_dir, f"pwm{channel}", attr), 'w') as f:
+                f.write(value)
+    for pins in MOTOR_PINS.values():
+        for pin in pins:
+            os.makedirs(os.path.join(gpio_root, f"gpio{pin}"), exist_ok=True)
+            for attr, value in (("direction", "in"), ("value", "0")):
+                with open(os.path.join(gpio_root, f"gpio{pin}", attr), 'w') as f:
+                    f.write(value)
+    open(os.path.join(gpio_root, "export"), 'w').close()
+    return pwm_root, gpio_root
+
+
+def _read_int(path):
+    # 和真实 sysfs 一样只看第一行：fd 后端 pwrite 带换行的值、不截断文件，短值后面会剩旧值的尾巴
+    try:
+        with open(path) as f:
+            return int(f.readline().strip() or 0)
+    except (OSError, ValueError):
+        return -1
+
+
+def sample_outputs(pwm_root, gpio_root):
+    """读出假 sysfs 里当前的输出：{执行器: (duty_ns, enable, 方向)}"""
+    outputs = {}
+    for name, chip, channel in ACTUATORS:
+        base = os.path.join(pwm_root, f"pwmchip{chip}", f"pwm{channel}")
+        direction = None
+        if name in MOTOR_PINS:
+            in1, in2 = MOTOR_PINS[name]
+            direction = _read_int(f"{gpio_root}/gpio{in1}/value") - _read_int(f"{gpio_root}/gpio{in2}/value")
+        outputs[name] = (_read_int(f"{base}/duty_cycle"), _read_int(f"{base}/enable"), direction)
+    return outputs
+
+
+class ReferenceModel:
+    """
+    期望输出的参考实现：按 servo.py / motor.py / pwm.py 的换算规则独立算出占空比，
+    与被测代码走同一份舵机校准文件。
+    """
+    def __init__(self, config_path):
+        with open(config_path) as f:
+            cfg = json.load(f)
+        self.steering = (cfg["steering_min"], cfg["steering_mid"], cfg["steering_max"])
+        self.camera = (servo.CAM_MIN_US, servo.CAM_MID_US, servo.CAM_MAX_US)
+
+    @staticmethod
+    def _servo_ns(limits, angle):
+        lo, mid, hi = limits
+        us = int(mid + (-max(-1.0, min(angle, 1.0))) * (hi - mid))
+        return max(lo, min(us, hi)) * 1000
+
+    @staticmethod
+    def _motor(speed):
+        duty = int(abs(speed) * 1000000)
+        res = motor.MOTOR_RESOLUTION_NS
+        return (duty + res // 2) // res * res, (speed > 0) - (speed < 0)
+
+    def outputs(self, throttle, steering, camera):
+        duty, direction = self._motor(throttle)
+        return {
+            "servo": self._servo_ns(self.steering, steering),
+            "cam_servo": self._servo_ns(self.camera, camera),
+            "motor_a": duty, "motor_b": duty, "dir": direction,
+        }
+
+    def from_channels(self, channels):
+        return self.outputs(main.map_sbus_to_pwm(channels[main.CH_THROTTLE]),
+                            main.map_sbus_to_pwm(channels[main.CH_STEERING]),
+                            main.map_sbus_to_pwm(channels[main.CH_CAMERA]))
+
+
+def _tick_outputs(tick):
+    return {
+        "servo": tick.duty_servo, "cam_servo": tick.duty_cam_servo,
+        "motor_a": tick.duty_motor_a, "motor_b": tick.duty_motor_b, "dir": tick.dir_a,
+    }
+
+
+def _matches(tick, expected, link_ok):
+    if bool(tick.mode & telemetry.MODE_LINK_OK) != link_ok or tick.dir_a != tick.dir_b:
+        return False
+    return _tick_outputs(tick) == expected
+
+
+def load_ticks(path):
+    ticks = []
+    for rec in telemetry.read_records(path):
+        ticks.append(Tick(*rec[:4], rec[4:20], *rec[20:]))
+    return ticks
+
+
+class Feeder(threading.Thread):
+    """
+    往 pty 主端按帧间隔写 SBUS 帧。每一步开始/结束记下时间 (perf_counter_ns，与遥测 t_ns 同一时钟)，
+    结束时采样一次假 sysfs；全部写完后给自己发 SIGINT，让 main() 按正常路径退出。
+    """
+    def __init__(self, master_fd, stream, speed, ready, pwm_root, gpio_root):
+        super().__init__(daemon=True)
+        self.master_fd = master_fd
+        self.stream = list(stream)
+        self.speed = speed
+        self.ready = ready
+        self.pwm_root = pwm_root
+        self.gpio_root = gpio_root
+        self.done = threading.Event()
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.steps = []  # [(步序号, 开始 ns, 结束 ns, 结束时的 sysfs 输出)]
+        self.error = None
+
+    def _write(self, frame):
+        os.write(self.master_fd, frame)
+        self.frames_sent += 1
+        self.bytes_sent += len(frame)
+
+    def _hold(self, frame, duration):
+        interval = SBUS_FRAME_INTERVAL / self.speed
+        deadline = time.perf_counter() + duration
+        next_frame = time.perf_counter()
+        while not self.done.is_set():
+            now = time.perf_counter()
+            if now >= deadline:
+                return
+            if frame is not None and now >= next_frame:
+                self._write(frame)
+                next_frame += interval
+            wake = deadline if frame is None else min(deadline, next_frame)
+            time.sleep(max(0.0, wake - time.perf_counter()))
+
+    def run(self):
+        try:
+            if not self.ready():
+                self.error = "main() did not finish initialization"
+                return
+            for index, frame, duration in self.stream:
+                if self.done.is_set():
+                    return
+                if index is None:
+                    # 回放：录制的数据原样写一遍，不重复、不分步
+                    self._write(frame)
+                    time.sleep(duration / self.speed)
+                    continue
+                hold = max(duration / self.speed, HIL_MIN_HOLD)
+                if frame is None:
+                    # 断线段按实际时间算，必须超过静默超时才会触发失控保护
+                    hold = max(hold, 2 * main.SBUS_SILENCE_TIMEOUT + HIL_MIN_HOLD)
+                start = time.perf_counter_ns()
+                self._hold(frame, hold)
+                self.steps.append((index, start, time.perf_counter_ns(),
+                                   sample_outputs(self.pwm_root, self.gpio_root)))
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            if not self.done.is_set():
+                os.kill(os.getpid(), signal.SIGINT)
+
+
+def replay_stream(path):
+    """录制的原始 SBUS 字节流 (例如 cat /dev/ttyS3 > capture.bin)，每 25 字节按一个帧间隔写一次"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    for offset in range(0, len(data), SBUS_FRAME_LEN):
+        yield None, data[offset:offset + SBUS_FRAME_LEN], SBUS_FRAME_INTERVAL
+
+
+def check_steps(feeder, scenario, ticks, model, check_sysfs=True):
+    """
+    每一步：结束时的 sysfs 输出是否等于期望，以及从这一步开始到第一次输出期望值的响应时间。
+    memory 后端不写文件，只检查遥测。
+    """
+    failures = 0
+    latency = Histogram(HIL_BIN_NS, HIL_NUM_BINS)
+    print("\nstep                           sysfs   telemetry  response")
+    for index, start, end, outputs in feeder.steps:
+        step = scenario[index]
+        throttle, steering, camera, link_ok = step.expected
+        expected = model.outputs(throttle, steering, camera)
+
+        observed = {name: outputs[name][0] for name, _, _ in ACTUATORS}
+        observed["dir"] = outputs["motor_a"][2]
+        sysfs_ok = not check_sysfs or (observed == dict(expected) and outputs["motor_b"][2] == expected["dir"])
+
+        window = [t for t in ticks if start <= t.t_ns < end]
+        last_ok = bool(window) and _matches(window[-1], expected, link_ok)
+        response = next((t.t_ns + t.tick_ns - start for t in window if _matches(t, expected, link_ok)), None)
+        if response is not None:
+            latency.record(response)
+
+        ok = sysfs_ok and last_ok and response is not None
+        failures += not ok
+        resp = f"{response / 1e6:.2f} ms" if response is not None else "-"
+        sysfs = ('ok' if sysfs_ok else 'FAIL') if check_sysfs else '-'
+        print(f"{step.name:<30} {sysfs:<7} {'ok' if last_ok else 'FAIL':<10} {resp}")
+        if not sysfs_ok:
+            print(f"    expected {expected}\n    sysfs    {observed} dir_b={outputs['motor_b'][2]}")
+        if not last_ok and window:
+            print(f"    expected {expected} link={link_ok}\n    last tick {_tick_outputs(window[-1])} mode={window[-1].mode}")
+    if latency.count:
+        print(latency.format("step response"))
+    return failures
+
+
+def check_ticks(ticks, model):
+    """每个 tick 的输出都必须能由它自己记录的通道值推出 (控制循环每轮只读一次 SBUS 快照)"""
+    mismatches = 0
+    for tick in ticks:
+        if tick.mode & telemetry.MODE_CALIBRATION:
+            continue
+        if tick.mode & telemetry.MODE_LINK_OK:
+            expected = model.from_channels(tick.channels)
+        else:
+            expected = model.outputs(0.0, 0.0, 0.0)
+        outputs = _tick_outputs(tick)
+        if outputs != expected or tick.dir_a != tick.dir_b:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"tick seq {tick.sbus_seq}: outputs {outputs} do not follow channels {tick.channels}")
+    return mismatches
+
+
+def report_ticks(ticks, feeder, wall):
+    if len(ticks) < 2:
+        return
+    period = Histogram(HIL_BIN_NS, HIL_NUM_BINS)
+    tick_time = Histogram(HIL_BIN_NS // 10, HIL_NUM_BINS)
+    for t in ticks[1:]:
+        period.record(t.period_ns)
+    for t in ticks:
+        tick_time.record(t.tick_ns)
+    seqs = len({t.sbus_seq for t in ticks if t.sbus_seq})
+    print(f"\n{len(ticks)} ticks in {wall:.2f} s ({len(ticks) / wall:.0f} ticks/s), "
+          f"{feeder.frames_sent} frames sent ({feeder.bytes_sent} bytes), {seqs} frames seen by the loop")
+    print(period.format("period"))
+    print(tick_time.format("tick"))
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="hil_sim_")
+    try:
+        pwm_root, gpio_root = build_fake_sysfs(os.path.join(workdir, "sys"))
+        config_path = os.path.join(workdir, servo.CONFIG_FILE)
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), servo.CONFIG_FILE), config_path)
+        telemetry_path = os.path.join(workdir, "telemetry.bin")
+
+        # pty 从端先设成 raw，pyserial 打开前写进去的字节也不会被行规程改写
+        master_fd, slave_fd = os.openpty()
+        tty.setraw(slave_fd)
+        port = os.ttyname(slave_fd)
+
+        # 只改模块级配置，main() 本身不动
+        pwm.PWM_SYSFS_ROOT = pwm_root
+        gpio.GPIO_SYSFS_ROOT = gpio_root
+        gpio.GPIO_DEV_DIR = os.path.join(workdir, "dev")  # 开发板上跑也不会碰到真实的 gpiochip
+        servo.CONFIG_FILE = config_path  # 绝对路径：校准保存也只写临时目录
+        main.GPIO_BACKEND = "sysfs"
+        main.HAL_BACKEND = args.hal
+        main.SBUS_PORT = port
+        main.CAMERA_MODE = "off"
+        main.TELEMETRY_ENABLED = True
+        main.TELEMETRY_FILE = telemetry_path
+
+        if args.replay:
+            scenario = None
+            stream = replay_stream(args.replay)
+        else:
+            scenario = DEFAULT_SCENARIO
+            stream = scenario_stream(scenario)
+
+        def ready():
+            deadline = time.monotonic() + HIL_START_TIMEOUT
+            while not os.path.exists(telemetry_path):
+                if time.monotonic() > deadline or feeder.done.is_set():
+                    return False
+                time.sleep(0.01)
+            time.sleep(0.05)
+            return True
+
+        feeder = Feeder(master_fd, stream, args.speed, ready, pwm_root, gpio_root)
+        print(f"HIL: SBUS on {port}, fake sysfs in {workdir}, speed x{args.speed}, HAL {args.hal}")
+        t0 = time.perf_counter()
+        feeder.start()
+        try:
+            main.main()
+        finally:
+            feeder.done.set()
+            feeder.join()
+            os.close(master_fd)
+            os.close(slave_fd)
+        wall = time.perf_counter() - t0
+
+        if feeder.error:
+            print(f"HIL feeder error: {feeder.error}")
+            return 1
+        if not os.path.exists(telemetry_path):
+            print("HIL: no telemetry written, main() did not start")
+            return 1
+
+        model = ReferenceModel(config_path)
+        ticks = load_ticks(telemetry_path)
+        failures = 0
+        if scenario is not None:
+            failures += check_steps(feeder, scenario, ticks, model, args.hal != "memory")
+        mismatches = check_ticks(ticks, model)
+        failures += mismatches > 0
+
+        # 退出后电机必须停、所有通道必须关闭
+        final = sample_outputs(pwm_root, gpio_root)
+        stopped = args.hal == "memory" or all(final[name][1] == 0 for name, _, _ in ACTUATORS) and \
+            final["motor_a"][0] == 0 and final["motor_b"][0] == 0
+        failures += not stopped
+
+        report_ticks(ticks, feeder, wall)
+        print(f"tick consistency: {len(ticks) - mismatches}/{len(ticks)} ok")
+        if args.hal == "memory":
+            print("shutdown: not checked (memory HAL)")
+        else:
+            print(f"shutdown: {'outputs disabled' if stopped else 'FAIL ' + str(final)}")
+        print("HIL PASS" if not failures else f"HIL FAIL ({failures})")
+        return 1 if failures else 0
+    finally:
+        if args.keep:
+            print(f"kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Replay SBUS through a pty into main.main() on a fake sysfs")
+    parser.add_argument("--speed", type=float, default=1.0, help="时钟倍速，1 为实时")
+    parser.add_argument("--replay", help="回放录制的原始 SBUS 字节流，只做逐 tick 一致性检查")
+    parser.add_argument("--save", help="把合成场景的字节流写到文件 (可作为 --replay 的输入) 后退出")
+    parser.add_argument("--hal", choices=sorted(pwm.PWM_BACKENDS), default=main.HAL_BACKEND,
+                        help="PWM/GPIO 后端；memory 不写假 sysfs，只检查遥测，用来对比控制逻辑与 I/O 的耗时")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录 (假 sysfs 与 telemetry.bin)")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    if args.save:
+        with open(args.save, 'wb') as f:
+            for _, frame, duration in scenario_stream(DEFAULT_SCENARIO):
+                if frame is not None:
+                    f.write(frame * max(1, int(duration / SBUS_FRAME_INTERVAL)))
+        print(f"Saved scenario stream to {args.save}")
+        return
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,61 @@
+from array import array
+
+class Histogram:
+    """
+    固定桶宽的纳秒直方图。桶数组在构造时一次性分配，record() 只做计数，
+    超出范围的值计入最后一个桶 (max 仍然记录真实值)。
+    """
+    def __init__(self, bin_ns, num_bins):
+        self.bin_ns = bin_ns
+        self.num_bins = num_bins
+        self.bins = array('Q', bytes(8 * num_bins))
+        self.reset()
+
+    def reset(self):
+        for i in range(self.num_bins):
+            self.bins[i] = 0
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = 0
+        self.max_ns = 0
+
+    def record(self, value_ns):
+        if value_ns < 0:
+            value_ns = 0
+        idx = value_ns // self.bin_ns
+        if idx >= self.num_bins:
+            idx = self.num_bins - 1
+        self.bins[idx] += 1
+        if self.count == 0 or value_ns < self.min_ns:
+            self.min_ns = value_ns
+        if value_ns > self.max_ns:
+            self.max_ns = value_ns
+        self.count += 1
+        self.total_ns += value_ns
+
+    def percentile(self, p):
+        """返回第 p 百分位所在桶的上边界 (ns)，精度为一个桶宽"""
+        if self.count == 0:
+            return 0
+        target = self.count * p / 100.0
+        seen = 0
+        for idx in range(self.num_bins):
+            seen += self.bins[idx]
+            if seen >= target:
+                return min((idx + 1) * self.bin_ns, self.max_ns)
+        return self.max_ns
+
+    def summary(self):
+        """count / mean / p50 / p99 / max，时间单位为微秒"""
+        return {
+            "count": self.count,
+            "mean_us": self.total_ns / self.count / 1e3 if self.count else 0.0,
+            "p50_us": self.percentile(50) / 1e3,
+            "p99_us": self.percentile(99) / 1e3,
+            "max_us": self.max_ns / 1e3,
+        }
+
+    def format(self, name):
+        s = self.summary()
+        return (f"{name}: n={s['count']} mean={s['mean_us']:.1f}us p50={s['p50_us']:.1f}us "
+                f"p99={s['p99_us']:.1f}us max={s['max_us']:.1f}us")
@@ -0,0 +1,38 @@
+import time
+from histogram import Histogram
+
+# 每个阶段 1us 一格、覆盖 10ms；更长的耗时计入最后一格 (max 仍是真实值)
+TRACE_BIN_NS = 1000
+TRACE_NUM_BINS = 10000
+
+class LatencyTracer:
+    """
+    常驻的分阶段耗时统计。每个阶段一个预分配直方图，
+    控制循环里用 lap() 打点，随时可以用 report() 取 p50/p99/max。
+    """
+    def __init__(self, stages, bin_ns=TRACE_BIN_NS, num_bins=TRACE_NUM_BINS):
+        self.stages = tuple(stages)
+        self.hists = [Histogram(bin_ns, num_bins) for _ in self.stages]
+
+    def lap(self, stage, start_ns):
+        """记录 stage 从 start_ns 到现在的耗时，返回当前时间作为下一阶段的起点"""
+        now = time.perf_counter_ns()
+        self.hists[stage].record(now - start_ns)
+        return now
+
+    def record(self, stage, delta_ns):
+        self.hists[stage].record(delta_ns)
+
+    def reset(self):
+        for hist in self.hists:
+            hist.reset()
+
+    def summary(self):
+        return {name: hist.summary() for name, hist in zip(self.stages, self.hists)}
+
+    def report(self):
+        lines = ["Latency trace (per stage):"]
+        for name, hist in zip(self.stages, self.hists):
+            if hist.count:
+                lines.append("  " + hist.format(name))
+        return "\n".join(lines)
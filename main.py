@@ -1,6 +1,10 @@
 import time
+import os
 import sys
 import signal
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # 检查依赖
 try:
@@ -10,15 +14,31 @@ except ImportError:
     sys.exit(1)
 
 from servo import Servo, CAMERA_SERVO_CHIP, CAMERA_SERVO_ID, CAM_MIN_US, CAM_MAX_US, CAM_MID_US
-from motor import Motor, MOTOR_A_PWM_CHIP, MOTOR_A_PWM_ID, MOTOR_B_PWM_CHIP, MOTOR_B_PWM_ID
-from sbus_receiver import SBUSReceiver
-from camera_stream import CameraStream # 引入摄像头模块
+from motor import Motor, DirectionLines, MOTOR_A_PWM_CHIP, MOTOR_A_PWM_ID, MOTOR_B_PWM_CHIP, MOTOR_B_PWM_ID
+from sbus_receiver import SBUSReceiver, SBUSFrame, SBUS_FLAG_FAILSAFE
+from gpio import open_gpio, ChardevGPIO
+from pwm import PWM_BACKENDS
+from scheduler import RateScheduler
+from latency import LatencyTracer
+from telemetry import TelemetryRecorder, MODE_LINK_OK, MODE_CALIBRATION, U32_MAX
+# 摄像头相关模块 (camera_process / camera_stream，以及 cv2 / TurboJPEG) 都在后台启动摄像头时才导入
 
 # GPIO 配置
 PIN_IN1 = 19
 PIN_IN2 = 21
+# 注意：IN3 (129) 在 gpiochip4、IN4 (98) 在 gpiochip3，不在同一个 chip 上，
+# chardev 后端也只能分两次 ioctl 写，Motor B 换向时两根线之间有一个很短的中间状态 (启动时会提示)
 PIN_IN3 = 129
 PIN_IN4 = 98
+# 方向引脚后端："chardev" (GPIO v2 字符设备，同一 chip 上的引脚原子更新) 或 "sysfs"
+# chardev 打不开时会自动回退到 sysfs
+GPIO_BACKEND = "chardev"
+
+# 硬件抽象层后端 (命令行 --hal 可覆盖)：
+#   "fd"     - PWM 属性文件常驻打开，每次一次 pwrite；方向引脚走 GPIO_BACKEND (默认)
+#   "sysfs"  - PWM 每次写入都 open/write/close，方向引脚走 sysfs (旧方式，用来对比内核 I/O 开销)
+#   "memory" - 不碰任何硬件，PWM 和方向引脚的写入只记进预分配数组 (MemoryPWMBackend / MemoryGPIO)
+HAL_BACKEND = "fd"
 
 # SBUS 配置
 # 请确保已在 /boot/uEnv/uEnv.txt 中开启了:
@@ -27,6 +47,42 @@ PIN_IN4 = 98
 # 注意：千万不要选 m1，因为 m1 对应的 Pin 36 已经被你的左后轮电机占了！
 SBUS_PORT = "/dev/ttyS3" 
 SBUS_BAUD = 100000
+# 默认按 CONTROL_RATE_HZ 固定频率轮询 SBUS (舵机刷新节奏稳定，周期/抖动由 RateScheduler 统计)
+# 设为 True 则改为事件驱动：SBUS 由独立线程接收，新帧一到控制循环立刻执行 (延迟更低，频率跟着接收机走)
+SBUS_EVENT_DRIVEN = False
+# 静默超时 (秒)：这么久收不到任何帧就进入失控保护
+# 接收机自己报告 failsafe 时不等超时，下一帧就停车
+SBUS_SILENCE_TIMEOUT = 0.1
+# 还没收到过任何帧时用的快照：通道全部居中
+NO_SBUS_FRAME = SBUSFrame((1024,) * 16, 0, 0, 0)
+
+# 摄像头运行方式：
+#   "process" - 独立进程 (采集/编码/HTTP 不占控制进程的 GIL，挂了自动重启)
+#   "thread"  - 在控制进程里用线程运行 (旧方式)
+#   "off"     - 不启动摄像头
+CAMERA_MODE = "process"
+CAMERA_PORT = 8080
+CAMERA_DEVICE = '/dev/video0'  # 'synthetic' 使用合成帧源，方便测试控制循环抖动
+# 全分辨率档；/video_feed?res=half / quarter 拿缩小的档位，ABR 拥塞时也会自动降档
+CAMERA_WIDTH = 320
+CAMERA_HEIGHT = 240
+
+# 摄像头在控制循环写出第一次输出之后才在后台启动；等第一帧最多这么久 (秒)，用于报告启动耗时
+CAMERA_FIRST_FRAME_TIMEOUT = 30.0
+# 退出时等待还没启动完的摄像头线程的最长时间
+CAMERA_START_JOIN_TIMEOUT = 5.0
+
+# 进入失控保护时保存摄像头黑匣子 (最近一段视频)，再多录 BLACKBOX_POST_SECONDS 秒
+BLACKBOX_ON_FAILSAFE = True
+BLACKBOX_POST_SECONDS = 2.0
+
+# 控制循环遥测：每个 tick 一条二进制记录，写入内存映射的环形文件 (相对本文件所在目录)
+# 分析：python3 telemetry.py telemetry.bin，或 telemetry.load() 读成 NumPy 结构化数组
+TELEMETRY_ENABLED = True
+TELEMETRY_FILE = "telemetry.bin"
+
+# 固定频率模式下的控制频率 (Hz)，如 50 / 100 / 250，按舵机能接受的刷新率设置
+CONTROL_RATE_HZ = 100
 
 # 通道映射 (参考旧 STM32 代码 MC7RB.c)
 # 你的旧代码逻辑：
@@ -50,6 +106,42 @@ SBUS_DEADBAND = 100
 SBUS_MIN = 200   # 估算值
 SBUS_MAX = 1800  # 估算值
 
+# 延迟追踪的阶段 (lap 的起点是上一个阶段的结束)
+TRACE_STAGES = (
+    "sbus_update",      # sbus.update()
+    "map",              # 油门/摄像头通道映射
+    "steering_logic",   # 校准分支或转向映射
+    "servo_write",
+    "cam_servo_write",
+    "motor_a_write",
+    "motor_b_write",    # 含两个电机方向引脚的 flush (一次 set_values)
+    "tick_total",       # 一轮控制从开始到最后一次写入
+    "input_to_output",  # SBUS 帧到达 -> 最后一次写入完成 (轮询模式下到达时间是推算的，见 report_trace)
+)
+(T_SBUS, T_MAP, T_STEER, T_SERVO, T_CAM, T_MOTOR_A, T_MOTOR_B,
+ T_TICK, T_E2E) = range(len(TRACE_STAGES))
+
+NAN = float('nan')
+_IMPORT_TIME = time.monotonic()
+
+def startup_times():
+    """
+    返回 (本进程启动到现在的秒数, 开机到现在的秒数)。
+    进程启动时间取自 /proc/self/stat，包含解释器启动和 import；读不到时从导入 main.py 算起。
+    """
+    try:
+        uptime = time.clock_gettime(time.CLOCK_BOOTTIME)
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK"), uptime
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic() - _IMPORT_TIME, None
+
+def format_startup(event):
+    age, uptime = startup_times()
+    boot = f", boot +{uptime:.2f} s" if uptime is not None else ""
+    return f"Startup: {event} {age:.3f} s after process start{boot}"
+
 def map_sbus_to_pwm(value):
     """
     将 SBUS 值映射到 -1.0 到 1.0 (用于 set_speed 或 set_angle)
@@ -71,20 +163,41 @@ def map_sbus_to_pwm(value):
 
 def main():
     print("Initializing Car Control System...")
+    gpio_backend = HAL_BACKEND if HAL_BACKEND in ("sysfs", "memory") else GPIO_BACKEND
+    print(f"HAL: PWM {HAL_BACKEND}, GPIO {gpio_backend}")
     
     # 初始化硬件
     # 你的车结构：前舵机 + 后双电机
+    t_hw = time.monotonic()
     try:
-        # 转向舵机 (启用 is_steering=True 以支持读写配置)
-        servo = Servo(is_steering=True) 
-        
-        # 摄像头舵机 (使用 Chip 1 - PWM1_CH1 Pin 19)
-        cam_servo = Servo(chip=CAMERA_SERVO_CHIP, channel=CAMERA_SERVO_ID,
-                          min_us=CAM_MIN_US, max_us=CAM_MAX_US, mid_us=CAM_MID_US)
-                          
-        # 注意：右轮电机(Motor A)需要 IN2>IN1 才能正转
-        motor_a = Motor(MOTOR_A_PWM_CHIP, MOTOR_A_PWM_ID, PIN_IN2, PIN_IN1)
-        motor_b = Motor(MOTOR_B_PWM_CHIP, MOTOR_B_PWM_ID, PIN_IN3, PIN_IN4)
+        # 两个电机的方向引脚一次性申请，每轮控制的四根线一次 set_values 写出
+        gpio = DirectionLines(open_gpio((PIN_IN1, PIN_IN2, PIN_IN3, PIN_IN4), gpio_backend))
+        if isinstance(gpio.gpio, ChardevGPIO):
+            for pins in ((PIN_IN1, PIN_IN2), (PIN_IN3, PIN_IN4)):
+                if not gpio.gpio.same_chip(pins):
+                    print(f"Warning: direction pins {pins[0]}/{pins[1]} are on different gpiochips, "
+                          f"they are not switched atomically")
+
+        # 四路 PWM 互不相关，并行初始化 (每路都要 export、等节点出现、设置周期和极性)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            # 转向舵机 (启用 is_steering=True 以支持读写配置)
+            servo_init = pool.submit(Servo, is_steering=True, backend=HAL_BACKEND)
+
+            # 摄像头舵机 (使用 Chip 1 - PWM1_CH1 Pin 19)
+            cam_servo_init = pool.submit(Servo, chip=CAMERA_SERVO_CHIP, channel=CAMERA_SERVO_ID,
+                                         min_us=CAM_MIN_US, max_us=CAM_MAX_US, mid_us=CAM_MID_US,
+                                         backend=HAL_BACKEND)
+
+            # 注意：右轮电机(Motor A)需要 IN2>IN1 才能正转
+            motor_a_init = pool.submit(Motor, MOTOR_A_PWM_CHIP, MOTOR_A_PWM_ID, PIN_IN2, PIN_IN1,
+                                       gpio=gpio, backend=HAL_BACKEND)
+            motor_b_init = pool.submit(Motor, MOTOR_B_PWM_CHIP, MOTOR_B_PWM_ID, PIN_IN3, PIN_IN4,
+                                       gpio=gpio, backend=HAL_BACKEND)
+        servo = servo_init.result()
+        cam_servo = cam_servo_init.result()
+        motor_a = motor_a_init.result()
+        motor_b = motor_b_init.result()
+        print(f"Hardware ready in {(time.monotonic() - t_hw) * 1000:.0f} ms")
     except Exception as e:
         print(f"Hardware initialization failed: {e}")
         # 如果电机初始化失败，可能是PWM overlay没开，但这里先不做硬性退出
@@ -93,31 +206,107 @@ def main():
     # 初始化 SBUS
     print(f"Connecting to SBUS on {SBUS_PORT}...")
     try:
-        sbus = SBUSReceiver(SBUS_PORT, SBUS_BAUD)
+        sbus = SBUSReceiver(SBUS_PORT, SBUS_BAUD, silence_timeout=SBUS_SILENCE_TIMEOUT)
+        if SBUS_EVENT_DRIVEN:
+            sbus.start()
     except:
         print(f"Error: Could not open {SBUS_PORT}. Did you enable the overlay in /boot/uEnv/uEnv.txt?")
         return
 
-    # 初始化摄像头流
-    camera = CameraStream(port=8080)
-    try:
-        camera.start()
-    except Exception as e:
-        print(f"Camera warning: {e}")
+    # 摄像头流：控制循环写出第一次输出后才由 start_camera 在后台线程启动
+    camera = None
+    camera_thread = None
+
+    def start_camera():
+        nonlocal camera
+        try:
+            if CAMERA_MODE == "process":
+                from camera_process import CameraProcess
+                cam = CameraProcess(port=CAMERA_PORT, device=CAMERA_DEVICE,
+                                    width=CAMERA_WIDTH, height=CAMERA_HEIGHT)
+            elif CAMERA_MODE == "thread":
+                from camera_stream import CameraStream # 引入摄像头模块 (cv2 / TurboJPEG 在这里才加载)
+                cam = CameraStream(port=CAMERA_PORT, device=CAMERA_DEVICE,
+                                   width=CAMERA_WIDTH, height=CAMERA_HEIGHT)
+            else:
+                return
+            cam.start()
+            camera = cam
+        except Exception as e:
+            print(f"Camera warning: {e}")
+            return
+        # 等第一帧到达，报告启动耗时 (进程模式下看共享内存帧环的序号)
+        deadline = time.monotonic() + CAMERA_FIRST_FRAME_TIMEOUT
+        while running and time.monotonic() < deadline:
+            if cam.latest_frame_id() > 0:
+                print(format_startup("first camera frame"))
+                return
+            if not cam.running:
+                return  # 设备打不开或子进程放弃重启，原因已经打印过
+            time.sleep(0.01)
+        if running:
+            print(f"Camera warning: no frame within {CAMERA_FIRST_FRAME_TIMEOUT:.0f} s")
+
+    # 遥测记录器 (打不开不影响控制)
+    telemetry = None
+    if TELEMETRY_ENABLED:
+        try:
+            telemetry = TelemetryRecorder(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                       TELEMETRY_FILE))
+        except Exception as e:
+            print(f"Telemetry disabled: {e}")
 
     # 控制主循环的标志
     running = True
 
+    def report_trace():
+        print(tracer.report())
+        if not SBUS_EVENT_DRIVEN:
+            # 轮询模式下帧在 UART 缓冲里排队到下一次轮询，到达时间按帧后的字节数往前推算，
+            # 帧间空闲的那段算不出来，所以 input_to_output 偏小
+            print("input_to_output: polling mode, arrival back-dated by trailing UART bytes only (lower bound)")
+
     def stop_all():
         print("Stopping hardware...")
+        try:
+            for name, dev in (("servo", servo), ("cam_servo", cam_servo),
+                              ("motor_a", motor_a), ("motor_b", motor_b)):
+                stats = dev.get_write_stats()
+                print(f"{name}: {stats['writes']} writes, {stats['suppressed']} suppressed")
+        except:
+            pass
+        try:
+            link = sbus.get_link_stats()
+            # 帧间隔只有线程模式统计 (轮询模式不知道每帧的到达时间)
+            gap = (f"gap {link['gap_min_ms']:.1f}/{link['gap_mean_ms']:.1f}/{link['gap_max_ms']:.1f} ms (min/mean/max)"
+                   if link['gap_mean_ms'] is not None else "gap n/a (polling mode)")
+            print(f"SBUS link: {link['frames']} frames, lost rate {link['frame_lost_rate']:.2%}, "
+                  f"{link['failsafe_frames']} failsafe, {gap}")
+        except:
+            pass
+        if not SBUS_EVENT_DRIVEN:
+            print(scheduler.report())
+        report_trace()
         try:
             servo.stop()
             cam_servo.stop()
             motor_a.stop()
             motor_b.stop()
-            camera.stop() # 停止摄像头
+            gpio.close()
+            sbus.stop()
         except:
             pass
+        # 摄像头可能还在后台启动：等它启动完再停，避免留下孤儿进程
+        if camera_thread:
+            camera_thread.join(timeout=CAMERA_START_JOIN_TIMEOUT)
+        try:
+            if camera:
+                camera.stop() # 停止摄像头
+        except:
+            pass
+        if telemetry:
+            print(f"Telemetry: {telemetry.count} records -> {telemetry.path}")
+            telemetry.close()
         print("Car Stopped.")
 
     # 捕获 Ctrl+C
@@ -129,36 +318,61 @@ def main():
     
     signal.signal(signal.SIGINT, signal_handler)
 
+    # kill -USR1 <pid> 随时打印各阶段延迟分布
+    def report_handler(sig, frame):
+        report_trace()
+
+    signal.signal(signal.SIGUSR1, report_handler)
+
     print("\n--- Remote Control Ready ---")
     print("Waiting for RC signal...")
 
     # 校准模式状态标记
     in_calibration_mode = False
+    # 事件驱动模式下最后处理过的 SBUS 帧序号
+    last_seq = 0
+    # 固定频率模式：按绝对截止时间调度，循环体耗时不会拖慢实际频率
+    scheduler = RateScheduler(CONTROL_RATE_HZ)
+    # 分阶段延迟统计 (直方图预分配，循环内只计数)
+    tracer = LatencyTracer(TRACE_STAGES)
+    traced_seq = 0
+    # 上一轮链路是否正常，用于检测进入失控保护的那一刻
+    link_ok = False
+    prev_tick = 0
 
     try:
         while running:
+            t_tick = t = time.perf_counter_ns()
+            throttle_val = steering_val = camera_val = NAN
+
             # 读取遥控器数据
             sbus.update()
+            # 本轮只取一次快照：失控判断、通道、遥测都来自同一帧，读线程中途发布新帧也不会混用
+            frame = sbus.latest or NO_SBUS_FRAME
+            channels = frame.channels
+            t = tracer.lap(T_SBUS, t)
 
-            if sbus.connected:
+            if sbus.connected and frame.seq and not frame.flags & SBUS_FLAG_FAILSAFE:
+                link_ok = True
                 # 获取公共数据 (无论什么模式，油门和摄像头都应该能动)
-                throttle_raw = sbus.get_channel(CH_THROTTLE)
-                camera_raw   = sbus.get_channel(CH_CAMERA)
+                throttle_raw = channels[CH_THROTTLE]
+                camera_raw   = channels[CH_CAMERA]
                 
                 throttle_val = map_sbus_to_pwm(throttle_raw)
                 camera_val   = map_sbus_to_pwm(camera_raw)
+                t = tracer.lap(T_MAP, t)
 
                 # -----------------------
                 # 1. 检查校准模式 (新增功能)
                 # -----------------------
-                calib_switch_val = sbus.get_channel(CH_CALIB_SWITCH)
+                calib_switch_val = channels[CH_CALIB_SWITCH]
                 
                 # 阈值判断：大于 1500 视为开启校准
                 if calib_switch_val > 1500:
                     in_calibration_mode = True
                     
                     # 获取 CH8 旋钮值 (假设范围 200~1800)
-                    knob_raw = sbus.get_channel(CH_CALIB_KNOB)
+                    knob_raw = channels[CH_CALIB_KNOB]
                     
                     # 映射中位 (精细调节模式)
                     # 将旋钮全程映射到 1350us ~ 1650us (±150us)
@@ -170,6 +384,7 @@ def main():
                     target_mid = max(1350, min(target_mid, 1650))
                     
                     # 实时驱动转向舵机回中 (此时不响应方向摇杆)
+                    t = tracer.lap(T_STEER, t)
                     servo.set_us(target_mid)
                     
                     # print(f"CALIBRATING... Knob: {knob_raw} -> US: {target_mid}", end='\r')
@@ -179,7 +394,7 @@ def main():
                     if in_calibration_mode:
                         print(f"\nExiting calibration. Saving new MID...")
                         # 读取最后一次的 CH8 值计算中位 (同样应用反转逻辑)
-                        knob_raw = sbus.get_channel(CH_CALIB_KNOB)
+                        knob_raw = channels[CH_CALIB_KNOB]
                         final_mid = int(1350 + (1800 - knob_raw) / 1600.0 * 300)
                         final_mid = max(1350, min(final_mid, 1650))
                         
@@ -190,26 +405,75 @@ def main():
                     # -----------------------
                     # 2. 正常转向控制模式
                     # -----------------------
-                    steering_raw = sbus.get_channel(CH_STEERING)
+                    steering_raw = channels[CH_STEERING]
                     steering_val = map_sbus_to_pwm(steering_raw)
+                    t = tracer.lap(T_STEER, t)
                     servo.set_angle(steering_val)
+                t = tracer.lap(T_SERVO, t)
 
 
                 # -----------------------
                 # 3. 执行油门、摄像头控制 (全局生效)
                 # -----------------------
                 cam_servo.set_angle(camera_val)
+                t = tracer.lap(T_CAM, t)
                 motor_a.set_speed(throttle_val)
+                t = tracer.lap(T_MOTOR_A, t)
                 motor_b.set_speed(throttle_val)
+                gpio.flush()
+                tracer.lap(T_MOTOR_B, t)
+                tracer.lap(T_TICK, t_tick)
+
+                # 每个新帧只统计一次：帧到达 (monotonic) 到本轮写入完成
+                if frame.seq != traced_seq:
+                    traced_seq = frame.seq
+                    tracer.record(T_E2E, time.monotonic_ns() - frame.timestamp_ns)
                 
             else:
-                # 信号丢失保护
+                # 信号丢失 / 接收机失控保护
                 motor_a.set_speed(0)
                 motor_b.set_speed(0)
+                gpio.flush()
                 servo.set_angle(0)
                 cam_servo.set_angle(0)
+                if link_ok:
+                    link_ok = False
+                    # 刚进入失控保护：让摄像头把出事前后这段视频存下来 (后台执行，不阻塞控制)
+                    if camera and BLACKBOX_ON_FAILSAFE:
+                        camera.dump_blackbox(BLACKBOX_POST_SECONDS)
 
-            time.sleep(0.01) # 100Hz loop
+            if telemetry:
+                try:
+                    # 耗时/间隔是 u32 ns：卡顿超过 4.29 s (比如调试时暂停) 截到 U32_MAX，不让 pack 失败
+                    telemetry.append(
+                        t_tick, min(time.perf_counter_ns() - t_tick, U32_MAX),
+                        min(t_tick - prev_tick, U32_MAX) if prev_tick else 0,
+                        frame.seq, *channels,
+                        frame.flags, (MODE_LINK_OK if link_ok else 0) | (MODE_CALIBRATION if in_calibration_mode else 0),
+                        motor_a.direction or 0, motor_b.direction or 0,
+                        throttle_val, steering_val, camera_val,
+                        servo.pwm.duty_ns or 0, cam_servo.pwm.duty_ns or 0,
+                        motor_a.pwm.duty_ns or 0, motor_b.pwm.duty_ns or 0)
+                except Exception as e:
+                    # 记录失败只关掉遥测，控制循环照常运行
+                    print(f"\nTelemetry disabled: {e}")
+                    try:
+                        telemetry.close()
+                    except Exception:
+                        pass
+                    telemetry = None
+            if not prev_tick:
+                # 第一轮输出已经写到硬件：报告启动耗时，然后才在后台启动摄像头
+                print(format_startup("first actuation"))
+                camera_thread = threading.Thread(target=start_camera, daemon=True)
+                camera_thread.start()
+            prev_tick = t_tick
+
+            if SBUS_EVENT_DRIVEN:
+                # 新帧到达立刻进入下一轮；信号断开时最多等 20ms，保证失控保护照常执行
+                last_seq = sbus.wait_for_frame(last_seq, timeout=0.02)
+            else:
+                scheduler.wait()
 
     except Exception as e:
         print(f"\nRuntime Error: {e}")
@@ -217,4 +481,8 @@ def main():
         stop_all()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RC car control loop")
+    parser.add_argument("--hal", choices=sorted(PWM_BACKENDS), default=HAL_BACKEND,
+                        help="硬件抽象层后端，memory 不碰硬件只测控制逻辑")
+    HAL_BACKEND = parser.parse_args().hal
     main()
@@ -1,49 +1,97 @@
-import os
-from pwm import PWM
+import time
+from pwm import PWM, PWM_REFRESH_INTERVAL
+from gpio import SysfsGPIO, MemoryGPIO
 
 MOTOR_A_PWM_CHIP = 2
 MOTOR_A_PWM_ID = 0
 MOTOR_B_PWM_CHIP = 0
 MOTOR_B_PWM_ID = 0
 
+# 电机 PWM 量化步长：1ms 周期下 0.1%，已经比 SBUS 油门的分辨率更细
+MOTOR_RESOLUTION_NS = 1000
+
+class DirectionLines:
+    """
+    多个电机共用的方向引脚：Motor 的 set_values 只登记要写的电平，
+    flush() 把这一轮所有电机的方向一次 set_values 写出去 (chardev 后端同一 chip 上的引脚同一个 ioctl)。
+    """
+    def __init__(self, gpio):
+        self.gpio = gpio
+        self._pending = []
+
+    def set_values(self, values):
+        self._pending.extend(values)
+
+    def flush(self):
+        if self._pending:
+            self.gpio.set_values(self._pending)
+            self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self.gpio.close()
+
 class Motor:
-    def __init__(self, pwm_chip, pwm_id, pin_in1, pin_in2):
-        self.pwm = PWM(pwm_chip, pwm_id, period_ns=1000000) # 1kHz for motor
+    def __init__(self, pwm_chip, pwm_id, pin_in1, pin_in2,
+                 refresh_interval=PWM_REFRESH_INTERVAL, gpio=None, backend=None):
+        self.pwm = PWM(pwm_chip, pwm_id, period_ns=1000000, # 1kHz for motor
+                       resolution_ns=MOTOR_RESOLUTION_NS, refresh_interval=refresh_interval,
+                       backend=backend)
         self.pin_in1 = pin_in1
         self.pin_in2 = pin_in2
-        self._setup_gpio(pin_in1)
-        self._setup_gpio(pin_in2)
-
-    def _setup_gpio(self, pin):
-        base = "/sys/class/gpio"
-        path = f"{base}/gpio{pin}"
-        if not os.path.exists(path):
-            with open(f"{base}/export", 'w') as f:
-                f.write(str(pin))
-        with open(f"{path}/direction", 'w') as f:
-            f.write("out")
-
-    def _write_gpio(self, pin, value):
-        with open(f"/sys/class/gpio/gpio{pin}/value", 'w') as f:
-            f.write(str(value))
+        self.refresh_interval = refresh_interval
+        # 方向引脚后端：默认单独走 sysfs (memory 后端时同样不碰硬件)；
+        # main.py 传入所有电机共用的 DirectionLines，每轮控制结束时统一 flush
+        if gpio is None:
+            gpio = MemoryGPIO((pin_in1, pin_in2)) if backend == "memory" else SysfsGPIO((pin_in1, pin_in2))
+        self.gpio = gpio
+        # 每个方向对应的 IN1/IN2 电平，一次 set_values 同时写两个引脚
+        self._dir_values = {
+            1:  ((pin_in1, 1), (pin_in2, 0)),
+            -1: ((pin_in1, 0), (pin_in2, 1)),
+            0:  ((pin_in1, 0), (pin_in2, 0)),
+        }
+
+        # 方向状态：1 正转 / -1 反转 / 0 停止，None 表示还没写过
+        self.direction = None
+        self._last_dir_time = 0.0
+        self.gpio_writes = 0
+        self.gpio_suppressed = 0
+
+    def _set_direction(self, direction):
+        # 方向没变就不碰 IN1/IN2，只在超过刷新间隔时强制重写一次
+        now = time.monotonic()
+        if direction == self.direction and now - self._last_dir_time < self.refresh_interval:
+            self.gpio_suppressed += 2
+            return
+
+        self.gpio.set_values(self._dir_values[direction])
+        self.gpio_writes += 2
+        self.direction = direction
+        self._last_dir_time = now
 
     def set_speed(self, speed):
         # speed: -1.0 to 1.0
         speed = max(-1.0, min(speed, 1.0))
         
         duty = int(abs(speed) * 1000000) # Map to 0-100% of 1ms period
-        self.pwm.set_duty_cycle(duty)
+        self.pwm.update_duty_cycle(duty)
 
         if speed > 0:
-            self._write_gpio(self.pin_in1, 1)
-            self._write_gpio(self.pin_in2, 0)
+            self._set_direction(1)
         elif speed < 0:
-            self._write_gpio(self.pin_in1, 0)
-            self._write_gpio(self.pin_in2, 1)
+            self._set_direction(-1)
         else:
-            self._write_gpio(self.pin_in1, 0)
-            self._write_gpio(self.pin_in2, 0)
+            self._set_direction(0)
+
+    def get_write_stats(self):
+        """返回 PWM 与方向引脚的实际写入次数和被抑制的次数"""
+        return {
+            "writes": self.pwm.writes + self.gpio_writes,
+            "suppressed": self.pwm.suppressed + self.gpio_suppressed,
+        }
 
     def stop(self):
         self.set_speed(0)
         self.pwm.disable()
+        self.pwm.close()
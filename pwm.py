@@ -1,25 +1,214 @@
+import errno
 import os
 import time
+from array import array
 
-class PWM:
-    def __init__(self, chip, pwm_id, period_ns=20000000):
-        self.chip = chip
+PWM_SYSFS_ROOT = "/sys/class/pwm"
+
+# 硬件抽象层后端 (PWM_BACKENDS 里的名字)：
+#   "fd"     - duty_cycle / enable 常驻打开，每次只做一次 pwrite (默认)
+#   "sysfs"  - 每次写入都 open/write/close (最早的写法，用来对比 I/O 开销)
+#   "memory" - 不做任何 I/O，写入记进预分配数组，用来把控制逻辑本身的耗时和内核 I/O 分开测
+PWM_BACKEND = "fd"
+# export 之后等待 pwmN 节点出现的最长时间与轮询间隔 (秒)
+PWM_EXPORT_TIMEOUT = 1.0
+PWM_EXPORT_POLL_INTERVAL = 0.002
+# memory 后端保留的最近写入次数
+PWM_MEMORY_RECORDS = 65536
+
+# 占空比量化步长 (ns)：小于这个差值的变化硬件上也体现不出来，不值得写
+PWM_RESOLUTION_NS = 1000
+# 即使数值没变，也每隔这么久强制重写一次 (秒)，防止寄存器被意外改动后一直不恢复
+PWM_REFRESH_INTERVAL = 1.0
+
+# 常驻 fd 写入失败时需要重新打开的错误码：fd 已失效 / 通道被 unexport
+_REOPEN_ERRNOS = (errno.EBADF, errno.ENODEV)
+# fd 后端常驻打开的属性 (控制循环里会写的)；period / polarity 只在初始化时写一次
+_PERSISTENT_ATTRS = ("duty_cycle", "enable")
+
+# memory 后端记录里的属性编号
+ATTR_IDS = {"period": 0, "duty_cycle": 1, "enable": 2, "polarity": 3}
+_ATTR_NAMES = tuple(ATTR_IDS)
+
+
+class SysfsPWMBackend:
+    """/sys/class/pwm 属性文件，每次写入都 open/write/close"""
+    def __init__(self, chip, pwm_id, sysfs_root=None):
         self.pwm_id = pwm_id
-        self.base_path = f"/sys/class/pwm/pwmchip{chip}"
+        self.base_path = f"{sysfs_root or PWM_SYSFS_ROOT}/pwmchip{chip}"
         self.pwm_path = f"{self.base_path}/pwm{pwm_id}"
-        self.period_ns = period_ns
-        
         if not os.path.exists(self.base_path):
             raise RuntimeError(f"PWM chip {chip} not found")
-            
-        self.export()
-        
-        # 检查当前 period，如果是 0 (重启后默认状态)，必须先设置 period 才能进行其他操作
+
+    def export(self):
+        if not os.path.exists(self.pwm_path):
+            try:
+                with open(f"{self.base_path}/export", 'w') as f:
+                    f.write(str(self.pwm_id))
+            except IOError:
+                return # 可能已经导出
+            # 内核建好 pwmN 目录后 udev 还要调整属性文件权限：轮询到 period 可写为止，不再固定睡 100ms
+            deadline = time.monotonic() + PWM_EXPORT_TIMEOUT
+            while not os.access(f"{self.pwm_path}/period", os.W_OK) and time.monotonic() < deadline:
+                time.sleep(PWM_EXPORT_POLL_INTERVAL)
+
+    def unexport(self):
+        self.close()
+        try:
+            with open(f"{self.base_path}/unexport", 'w') as f:
+                f.write(str(self.pwm_id))
+        except IOError:
+            pass
+
+    def read_period(self):
         try:
             with open(f"{self.pwm_path}/period", 'r') as f:
-                current_period = int(f.read().strip())
+                return int(f.read().strip())
         except (IOError, ValueError):
-            current_period = 0
+            return 0
+
+    def write(self, attr, value):
+        """value: 整数，polarity 为字符串"""
+        with open(f"{self.pwm_path}/{attr}", 'w') as f:
+            f.write(str(value))
+
+    def close(self):
+        pass
+
+
+class FdPWMBackend(SysfsPWMBackend):
+    """
+    duty_cycle / enable 在对象生命周期内保持打开，每次只做一次 pwrite。
+    值带换行写入 (和 echo 一样)，sysfs 按一次 write 解析，读的时候只看第一行。
+    on_reopen: 通道被 unexport 后重新导出时调用，重做初始化 (新导出的通道 period 为 0 且未使能)
+    """
+    def __init__(self, chip, pwm_id, sysfs_root=None):
+        super().__init__(chip, pwm_id, sysfs_root)
+        self._fds = {}
+        self.on_reopen = None
+        self._reopening = False
+
+    def _open_attr(self, attr):
+        fd = os.open(f"{self.pwm_path}/{attr}", os.O_WRONLY | os.O_CLOEXEC)
+        self._fds[attr] = fd
+        return fd
+
+    def write(self, attr, value):
+        if attr not in _PERSISTENT_ATTRS:
+            super().write(attr, value)
+            return
+        data = b"%d\n" % value
+        fd = self._fds.get(attr)
+        if fd is None:
+            fd = self._open_attr(attr)
+        try:
+            os.pwrite(fd, data, 0)
+        except OSError as e:
+            # 重做初始化的过程中又失败就不再重试，交给调用方
+            if e.errno not in _REOPEN_ERRNOS or self._reopening:
+                raise
+            # fd 失效或通道被 unexport：所有常驻 fd 都已失效，关掉后重新导出，
+            # 先重做初始化 (period / 极性 / 使能)，再重新打开写这一次
+            self.close()
+            self.export()
+            if self.on_reopen:
+                self._reopening = True
+                try:
+                    self.on_reopen()
+                finally:
+                    self._reopening = False
+            fd = self._fds.get(attr)
+            if fd is None:
+                fd = self._open_attr(attr)
+            os.pwrite(fd, data, 0)
+
+    def close(self):
+        """关闭常驻的属性文件，之后再写入会自动重新打开"""
+        for fd in self._fds.values():
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._fds.clear()
+
+
+class MemoryPWMBackend:
+    """
+    不碰硬件：当前值放在 values 里，每次写入按顺序记进预分配的数组 (环形，保留最近 capacity 次)。
+    """
+    def __init__(self, chip, pwm_id, sysfs_root=None, capacity=PWM_MEMORY_RECORDS):
+        self.values = {"period": 0, "duty_cycle": 0, "enable": 0, "polarity": "normal"}
+        self.capacity = capacity
+        self.attrs = array('B', bytes(capacity))
+        self.data = array('q', bytes(8 * capacity))
+        self.timestamps = array('q', bytes(8 * capacity))
+        self.count = 0
+
+    def export(self):
+        pass
+
+    def unexport(self):
+        pass
+
+    def read_period(self):
+        return self.values["period"]
+
+    def write(self, attr, value):
+        self.values[attr] = value
+        i = self.count % self.capacity
+        self.attrs[i] = ATTR_IDS[attr]
+        self.data[i] = value if attr != "polarity" else value == "inversed"
+        self.timestamps[i] = time.monotonic_ns()
+        self.count += 1
+
+    def history(self):
+        """按时间顺序返回保留的写入 [(timestamp_ns, 属性名, 值), ...]"""
+        n = min(self.count, self.capacity)
+        start = self.count - n
+        return [(self.timestamps[k % self.capacity], _ATTR_NAMES[self.attrs[k % self.capacity]],
+                 self.data[k % self.capacity]) for k in range(start, self.count)]
+
+    def close(self):
+        pass
+
+
+PWM_BACKENDS = {
+    "sysfs": SysfsPWMBackend,
+    "fd": FdPWMBackend,
+    "memory": MemoryPWMBackend,
+}
+
+
+class PWM:
+    def __init__(self, chip, pwm_id, period_ns=20000000, sysfs_root=None,
+                 resolution_ns=PWM_RESOLUTION_NS, refresh_interval=PWM_REFRESH_INTERVAL,
+                 backend=None):
+        self.chip = chip
+        self.pwm_id = pwm_id
+        self.period_ns = period_ns
+        self.resolution_ns = resolution_ns
+        self.refresh_interval = refresh_interval
+
+        # 变化抑制状态：最后一次写入的占空比和时间，以及写入/跳过计数
+        self.duty_ns = None
+        self._last_write_time = 0.0
+        self.writes = 0
+        self.suppressed = 0
+
+        # backend: PWM_BACKENDS 里的名字，默认 PWM_BACKEND
+        self.backend = PWM_BACKENDS[backend or PWM_BACKEND](chip, pwm_id, sysfs_root)
+        self._write = self.backend.write
+        # fd 后端在通道被 unexport 后会重新导出，需要重做下面的初始化
+        self.backend.on_reopen = self._init_channel
+
+        self.export()
+        self._init_channel()
+
+    def _init_channel(self):
+        """设置周期、清零占空比、极性 normal 并使能 (导出后的初始化顺序)"""
+        period_ns = self.period_ns
+        # 检查当前 period，如果是 0 (重启后默认状态)，必须先设置 period 才能进行其他操作
+        current_period = self.backend.read_period()
 
         if current_period == 0:
             # 初始状态：先设置周期，再清零占空比
@@ -29,52 +218,63 @@ class PWM:
             # 非初始状态：先清零占空比，避免 duty > new_period 错误
             self.set_duty_cycle(0)
             self.set_period(period_ns)
-        
+
         # 现在状态合法了，可以安全地 disable 并设置极性
         self.disable()
-        self.set_polarity("normal") 
+        self.set_polarity("normal")
         self.enable()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """释放后端资源 (fd 后端关闭常驻的属性文件，之后再写入会自动重新打开)"""
+        self.backend.close()
+
     def export(self):
-        if not os.path.exists(self.pwm_path):
-            try:
-                with open(f"{self.base_path}/export", 'w') as f:
-                    f.write(str(self.pwm_id))
-                time.sleep(0.1)
-            except IOError:
-                pass # 可能已经导出
+        self.backend.export()
 
     def unexport(self):
-        try:
-            with open(f"{self.base_path}/unexport", 'w') as f:
-                f.write(str(self.pwm_id))
-        except IOError:
-            pass
+        self.backend.unexport()
 
     def set_period(self, ns):
-        with open(f"{self.pwm_path}/period", 'w') as f:
-            f.write(str(ns))
+        self._write("period", ns)
 
     def set_duty_cycle(self, ns):
         # 确保占空比不超过周期
         ns = min(ns, self.period_ns)
-        with open(f"{self.pwm_path}/duty_cycle", 'w') as f:
-            f.write(str(ns))
+        self._write("duty_cycle", ns)
+        self.duty_ns = ns
+        self._last_write_time = time.monotonic()
+        self.writes += 1
+
+    def update_duty_cycle(self, ns):
+        """
+        控制循环用：按分辨率量化后，只有数值变化 (或到了强制刷新时间) 才真正写入。
+        返回是否发生了写入。
+        """
+        res = self.resolution_ns
+        ns = min((ns + res // 2) // res * res, self.period_ns)
+        if ns == self.duty_ns and time.monotonic() - self._last_write_time < self.refresh_interval:
+            self.suppressed += 1
+            return False
+        self.set_duty_cycle(ns)
+        return True
 
     def set_polarity(self, polarity):
         # 只有在 disable 状态下才能修改极性
         self.disable()
         try:
-            with open(f"{self.pwm_path}/polarity", 'w') as f:
-                f.write(polarity)
+            self._write("polarity", polarity)
         except IOError:
             pass
         self.enable()
 
     def enable(self):
-        with open(f"{self.pwm_path}/enable", 'w') as f:
-            f.write("1")
+        self._write("enable", 1)
 
     def disable(self):
-        with open(f"{self.pwm_path}/enable", 'w') as f:
-            f.write("0")
+        self._write("enable", 0)
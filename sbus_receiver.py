@@ -1,9 +1,32 @@
 import serial
+import threading
 import time
 import struct
+from collections import namedtuple
+
+SBUS_FRAME_LEN = 25
+SBUS_HEADER = 0x0F
+SBUS_FOOTER = 0x00
+
+# 第 24 字节 (flags) 各位含义
+SBUS_FLAG_CH17 = 0x01        # 数字通道 17
+SBUS_FLAG_CH18 = 0x02        # 数字通道 18
+SBUS_FLAG_FRAME_LOST = 0x04  # 接收机丢了一帧 (本帧数据是旧的)
+SBUS_FLAG_FAILSAFE = 0x08    # 接收机已进入失控保护
+
+# 每字节在线上占 12 位 (1 起始 + 8 数据 + 偶校验 + 2 停止)
+SBUS_BITS_PER_BYTE = 12
+
+# 默认静默超时：这么久没收到任何帧就认为断开
+SBUS_SILENCE_TIMEOUT = 0.5
+
+# 最新帧快照：不可变对象，发布时整体替换引用，读者不需要加锁
+# timestamp_ns 是按 time.monotonic_ns() 推算的到达时间 (见 _arrival_estimate)，seq 每帧加一
+SBUSFrame = namedtuple("SBUSFrame", ["channels", "flags", "timestamp_ns", "seq"])
 
 class SBUSReceiver:
-    def __init__(self, serial_port='/dev/ttyS3', baudrate=100000):
+    def __init__(self, serial_port='/dev/ttyS3', baudrate=100000, on_frame=None,
+                 silence_timeout=SBUS_SILENCE_TIMEOUT):
         try:
             self.ser = serial.Serial(
                 port=serial_port,
@@ -18,61 +41,237 @@ class SBUSReceiver:
             print(f"Error opening serial port {serial_port}: {e}")
             self.ser = None
 
-        self.channels = [1024] * 16 # Center
-        self.last_frame_time = 0
+        self._raw = [1024] * 16      # 解析目标，原地更新，不再每帧新建列表
+        self.channels = self._raw    # 轮询模式下直接读 _raw；线程模式下指向最新快照
+        self._buf = bytearray()      # 接收缓冲区，复用同一个 bytearray
+        self._synced = False         # 缓冲区开头是否是已确认的帧边界 (紧接在上一个有效帧之后)
+        self._flags = 0
+        # 一个字节在线上的时间：最新帧之后还到了多少字节，就往前推算这一帧的到达时间
+        self.byte_ns = SBUS_BITS_PER_BYTE * 1_000_000_000 // baudrate
+        self._trailing_bytes = 0     # 最近一次 _feed 里最新帧之后的字节数
+        # 计时统一用 monotonic，不受 NTP 校时跳变影响
+        self.silence_timeout_ns = int(silence_timeout * 1e9)
+        self.last_frame_ns = 0
         self.connected = False
 
+        # flags 字节解码结果
+        self.flags = 0
+        self.ch17 = False
+        self.ch18 = False
+        self.frame_lost = False
+        self.failsafe = False
+
+        # 链路质量统计：帧数与 flags 在 _feed 里逐帧计 (轮询间被跳过的旧帧也算)；
+        # 帧间隔只在线程模式下统计，轮询模式只知道轮询时刻，不知道每帧的到达时间
+        self.frames_total = 0
+        self.frames_lost = 0
+        self.failsafe_frames = 0
+        self.gap_min_ns = 0
+        self.gap_max_ns = 0
+        self._gap_sum_ns = 0
+        self._gap_count = 0
+        self._new_frames = 0         # 最近一次 _feed 确认的帧数
+        self._arrival_ns = 0         # 线程模式下上一帧的到达时间
+
+        # 最新帧快照与帧序号
+        self.latest = None
+        self.frame_seq = 0
+        # 可选回调：每解出一帧调用一次 on_frame(frame)，线程模式下在读线程里执行
+        self.on_frame = on_frame
+        self._frame_event = threading.Event()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """启动独立读线程：阻塞等串口数据，帧一完整立刻解析并发布"""
+        if not self.ser or self._thread:
+            return
+        self.channels = tuple(self._raw)
+        self._running = True
+        self._thread = threading.Thread(target=self._reader_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=0.5)
+            self._thread = None
+        self._frame_event.set()
+
+    def _reader_loop(self):
+        ser = self.ser
+        buf = self._buf
+        while self._running:
+            # 缓冲区里已有半帧时只读剩下的字节，这样 read 恰好在帧完整时返回
+            # 串口 timeout (20ms) 保证能定期检查 _running
+            need = max(SBUS_FRAME_LEN - len(buf), ser.in_waiting, 1)
+            try:
+                data = ser.read(need)
+            except Exception as e:
+                print(f"SBUS read error: {e}")
+                time.sleep(0.1)
+                continue
+            if data and self._feed(data):
+                self._publish(self._arrival_estimate())
+
     def update(self):
         if not self.ser:
             return
 
-        # 尝试读取尽可能多的数据，直到找到有效帧
-        # SBUS 帧长 25 字节
-        # 0x0F <22 bytes data> <flags> 0x00
-        
-        while self.ser.in_waiting >= 25:
-            # 读取可能的帧头
-            header = self.ser.read(1)
-            if header == b'\x0f':
-                # 读取剩余24字节
-                packet = self.ser.read(24)
-                if len(packet) == 24 and packet[23] == 0x00:
-                    self._parse_frame(packet)
-                    self.last_frame_time = time.time()
-                    self.connected = True
-            else:
-                # 不是帧头，跳过继续找
-                pass
+        # 线程模式下由读线程负责接收，这里只做超时检测
+        if self._thread is None:
+            # 一次性读走串口缓冲区里的全部数据，只解析其中最新的一帧
+            waiting = self.ser.in_waiting
+            if waiting and self._feed(self.ser.read(waiting)):
+                self._publish(self._arrival_estimate())
                 
         # 超时检测 (SBUS通常每14ms-7ms发一次)
-        if time.time() - self.last_frame_time > 0.5:
+        if time.monotonic_ns() - self.last_frame_ns > self.silence_timeout_ns:
             self.connected = False
 
+    def _arrival_estimate(self):
+        """
+        最新帧的到达时间：读到数据的时刻减去它后面那些字节的传输时间。
+        轮询模式下帧在 UART 缓冲里排队到下一次轮询，后面可能已经跟了下一帧的一部分；
+        帧与帧之间的空闲时间算不出来，所以这是到达时间的上界 (延迟只会少算不会多算)
+        """
+        return time.monotonic_ns() - self._trailing_bytes * self.byte_ns
+
+    def _publish(self, timestamp_ns):
+        flags = self._flags
+        frame = SBUSFrame(tuple(self._raw), flags, timestamp_ns, self.frame_seq + 1)
+        self.latest = frame
+        if self._thread is not None:
+            self.channels = frame.channels
+
+        self.flags = flags
+        self.ch17 = bool(flags & SBUS_FLAG_CH17)
+        self.ch18 = bool(flags & SBUS_FLAG_CH18)
+        self.frame_lost = bool(flags & SBUS_FLAG_FRAME_LOST)
+        self.failsafe = bool(flags & SBUS_FLAG_FAILSAFE)
+
+        # 帧间隔：线程模式下 read 在帧完整时返回，timestamp_ns 就是这一帧的到达时间；
+        # 一次读到多帧时中间几帧的到达时间不知道，这一段不计间隔
+        if self._thread is not None:
+            if self._arrival_ns and self._new_frames == 1:
+                gap = timestamp_ns - self._arrival_ns
+                if not self._gap_count or gap < self.gap_min_ns:
+                    self.gap_min_ns = gap
+                if gap > self.gap_max_ns:
+                    self.gap_max_ns = gap
+                self._gap_sum_ns += gap
+                self._gap_count += 1
+            self._arrival_ns = timestamp_ns
+
+        # 序号最后更新：读者看到新序号时，快照一定已经发布
+        self.frame_seq = frame.seq
+        self.last_frame_ns = timestamp_ns
+        self.connected = True
+        self._frame_event.set()
+        if self.on_frame:
+            self.on_frame(frame)
+
+    def wait_for_frame(self, last_seq, timeout):
+        """
+        等待比 last_seq 更新的帧 (线程模式下使用)，最多等 timeout 秒。
+        返回当前最新的帧序号，超时则与 last_seq 相同。
+        """
+        # 先 clear 再检查序号：检查之后发布的帧一定会重新 set
+        self._frame_event.clear()
+        if self.frame_seq != last_seq:
+            return self.frame_seq
+        self._frame_event.wait(timeout)
+        return self.frame_seq
+
+    def _feed(self, data):
+        """
+        追加新数据，从缓冲区开头往后按帧对齐找出最新的有效帧。
+        SBUS 帧长 25 字节：0x0F <22 bytes data> <flags> 0x00
+        找到返回 True；之前的旧帧和垃圾字节全部丢弃，只保留可能是下一帧开头的残余字节。
+        """
+        buf = self._buf
+        buf += data
+        size = len(buf)
+
+        if size < SBUS_FRAME_LEN:
+            return False
+
+        # 从前往后找：确认一帧后直接跳到它的帧尾，数据里恰好是 0x0F 的字节不会被当成帧头。
+        # 帧尾正确，且在已知的帧边界上或后面紧跟下一帧帧头，才认为是真的帧；
+        # 失步后 (垃圾字节之后) 只靠帧尾一个字节太容易错位，必须等到下一帧帧头确认
+        limit = size - SBUS_FRAME_LEN + 1
+        boundary = 0 if self._synced else -1
+        latest = -1
+        frames = 0
+        # 失败时从这里开始保留：最后 24 字节里的帧头还有可能凑成完整帧
+        keep = limit
+        pos = buf.find(SBUS_HEADER, 0, limit)
+        while pos >= 0:
+            nxt = pos + SBUS_FRAME_LEN
+            if buf[nxt - 1] == SBUS_FOOTER:
+                if pos == boundary or (nxt < size and buf[nxt] == SBUS_HEADER):
+                    latest = pos
+                    boundary = nxt
+                    # 只解析最新一帧，但每个确认的帧都计入链路统计
+                    frames += 1
+                    flags = buf[nxt - 2]
+                    if flags & SBUS_FLAG_FRAME_LOST:
+                        self.frames_lost += 1
+                    if flags & SBUS_FLAG_FAILSAFE:
+                        self.failsafe_frames += 1
+                elif nxt == size:
+                    keep = pos  # 正好在缓冲区末尾，留着等下一帧帧头确认
+                else:
+                    keep = max(keep, nxt)
+                # 没确认的也整帧跳过，不在它的数据里找帧头 (宁可丢一帧也不解出错位的通道)
+                pos = buf.find(SBUS_HEADER, nxt, limit)
+            else:
+                pos = buf.find(SBUS_HEADER, pos + 1, limit)
+
+        self.frames_total += frames
+        if latest >= 0:
+            self._new_frames = frames
+            nxt = latest + SBUS_FRAME_LEN
+            self._trailing_bytes = size - nxt
+            with memoryview(buf) as view:
+                self._parse_frame(view[latest + 1:nxt])
+            # bytearray 删除头部只移动起始偏移，缓冲区本身不会重新分配
+            del buf[:nxt]
+            self._synced = True
+            return True
+
+        # 没有确认的帧：跳过的帧不留残余
+        del buf[:keep]
+        self._synced = False
+        return False
+
+    def clear_buffer(self):
+        """丢弃接收缓冲区里的残余字节，下一帧重新同步"""
+        self._buf.clear()
+        self._synced = False
+
     def _parse_frame(self, data):
-        # Bit manipulation for 11-bit channels
-        # data[0-21] contains 16 channels
-        
-        channels = [0] * 16
-        
-        # Python handles bytes as ints automatically when indexing
-        channels[0]  = ((data[0]    | data[1]<<8)                          & 0x07FF)
-        channels[1]  = ((data[1]>>3 | data[2]<<5)                          & 0x07FF)
-        channels[2]  = ((data[2]>>6 | data[3]<<2 | data[4]<<10)           & 0x07FF)
-        channels[3]  = ((data[4]>>1 | data[5]<<7)                          & 0x07FF)
-        channels[4]  = ((data[5]>>4 | data[6]<<4)                          & 0x07FF)
-        channels[5]  = ((data[6]>>7 | data[7]<<1 | data[8]<<9)            & 0x07FF)
-        channels[6]  = ((data[8]>>2 | data[9]<<6)                          & 0x07FF)
-        channels[7]  = ((data[9]>>5 | data[10]<<3)                         & 0x07FF)
-        channels[8]  = ((data[11]   | data[12]<<8)                         & 0x07FF)
-        channels[9]  = ((data[12]>>3| data[13]<<5)                         & 0x07FF)
-        channels[10] = ((data[13]>>6| data[14]<<2 | data[15]<<10)         & 0x07FF)
-        channels[11] = ((data[15]>>1| data[16]<<7)                        & 0x07FF)
-        channels[12] = ((data[16]>>4| data[17]<<4)                        & 0x07FF)
-        channels[13] = ((data[17]>>7| data[18]<<1 | data[19]<<9)          & 0x07FF)
-        channels[14] = ((data[19]>>2| data[20]<<6)                        & 0x07FF)
-        channels[15] = ((data[20]>>5| data[21]<<3)                        & 0x07FF)
-
-        self.channels = channels
+        # data[0-21] 是 16 个 11 位通道 (小端位序)，一次转成大整数再逐个移位取出
+        bits = int.from_bytes(data[:22], 'little')
+        channels = self._raw
+        for i in range(16):
+            channels[i] = bits & 0x07FF
+            bits >>= 11
+        self._flags = data[22]
+
+    def get_link_stats(self):
+        """链路质量：丢帧率、失控帧数、帧间隔 (ms，只有线程模式有，轮询模式下为 None)"""
+        total = self.frames_total
+        gaps = self._gap_count
+        return {
+            "frames": total,
+            "frame_lost": self.frames_lost,
+            "frame_lost_rate": self.frames_lost / total if total else 0.0,
+            "failsafe_frames": self.failsafe_frames,
+            "gap_min_ms": self.gap_min_ns / 1e6 if gaps else None,
+            "gap_max_ms": self.gap_max_ns / 1e6 if gaps else None,
+            "gap_mean_ms": self._gap_sum_ns / gaps / 1e6 if gaps else None,
+        }
 
     def get_channel(self, index):
         if 0 <= index < 16:
@@ -0,0 +1,94 @@
+import ctypes
+import ctypes.util
+import time
+from histogram import Histogram
+
+CLOCK_MONOTONIC = 1
+TIMER_ABSTIME = 1
+_EINTR = 4
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+# clock_nanosleep(TIMER_ABSTIME) 直接睡到绝对时刻，没有 "算剩余时间 -> 睡眠" 之间的误差
+# 拿不到 libc 时退回 time.sleep(剩余时间)
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    _clock_nanosleep = _libc.clock_nanosleep
+    _clock_nanosleep.argtypes = [ctypes.c_int, ctypes.c_int,
+                                 ctypes.POINTER(_Timespec), ctypes.POINTER(_Timespec)]
+    _clock_nanosleep.restype = ctypes.c_int
+except (OSError, AttributeError):
+    _clock_nanosleep = None
+
+
+class RateScheduler:
+    """
+    固定频率调度器：按绝对 monotonic 截止时间运行循环，每次只睡剩余的时间，
+    循环体耗时不会累积成频率漂移。
+    超过截止时间记为一次 overrun，并跳过已错过的周期 (不补跑)。
+    """
+    def __init__(self, rate_hz, use_abstime=True):
+        self.rate_hz = rate_hz
+        self.period_ns = int(1e9 / rate_hz)
+        self.use_abstime = use_abstime and _clock_nanosleep is not None
+        self._ts = _Timespec()
+
+        self.next_deadline_ns = 0
+        self._last_wake_ns = 0
+        self.ticks = 0
+        self.overruns = 0
+        self.missed_periods = 0
+
+        # 实际周期分布 (50us 一格，覆盖 4 个周期) 与唤醒抖动分布 (10us 一格，覆盖 1 个周期)
+        self.period_hist = Histogram(50000, max(4 * self.period_ns // 50000, 1))
+        self.jitter_hist = Histogram(10000, max(self.period_ns // 10000, 1))
+
+    def _sleep_until(self, deadline_ns):
+        if self.use_abstime:
+            ts = self._ts
+            ts.tv_sec, ts.tv_nsec = divmod(deadline_ns, 1000000000)
+            # 被信号打断 (EINTR) 时回到 Python 让信号处理函数执行，然后继续睡
+            while _clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, ts, None) == _EINTR:
+                pass
+        else:
+            remaining = deadline_ns - time.monotonic_ns()
+            if remaining > 0:
+                time.sleep(remaining / 1e9)
+
+    def wait(self):
+        """在每轮循环末尾调用：睡到下一个截止时间"""
+        now = time.monotonic_ns()
+        if self.ticks == 0:
+            # 第一轮：从现在开始对齐
+            self.next_deadline_ns = now + self.period_ns
+            self._last_wake_ns = now
+
+        deadline = self.next_deadline_ns
+        if now >= deadline:
+            # 循环体超时：不睡眠直接进入下一轮，截止时间对齐到 now 之后的下一个格点
+            self.overruns += 1
+            late = (now - deadline) // self.period_ns
+            self.missed_periods += late
+            self.next_deadline_ns = deadline + (late + 1) * self.period_ns
+            self._record(now, deadline)
+            return
+
+        self._sleep_until(deadline)
+        self._record(time.monotonic_ns(), deadline)
+        self.next_deadline_ns = deadline + self.period_ns
+
+    def _record(self, wake_ns, deadline_ns):
+        self.period_hist.record(wake_ns - self._last_wake_ns)
+        self.jitter_hist.record(wake_ns - deadline_ns)
+        self._last_wake_ns = wake_ns
+        self.ticks += 1
+
+    def report(self):
+        lines = [
+            f"Control loop: target {self.rate_hz}Hz, {self.ticks} ticks, "
+            f"{self.overruns} overruns, {self.missed_periods} missed periods",
+            "  " + self.period_hist.format("period"),
+            "  " + self.jitter_hist.format("wake jitter"),
+        ]
+        return "\n".join(lines)
@@ -1,6 +1,6 @@
 import json
 import os
-from pwm import PWM
+from pwm import PWM, PWM_REFRESH_INTERVAL
 
 # PWM 配置
 SERVO_PWM_CHIP = 4  # 转向舵机 (原 Chip 3 -> 现 Chip 4)
@@ -24,8 +24,11 @@ CONFIG_FILE = "servo_config.json"
 
 class Servo:
     def __init__(self, chip=SERVO_PWM_CHIP, channel=SERVO_PWM_ID, 
-                 min_us=None, max_us=None, mid_us=None, is_steering=False):
-        self.pwm = PWM(chip, channel)
+                 min_us=None, max_us=None, mid_us=None, is_steering=False,
+                 refresh_interval=PWM_REFRESH_INTERVAL, backend=None):
+        # 舵机脉宽以 1us 为单位，量化步长取 1000ns；backend 见 pwm.PWM_BACKENDS
+        self.pwm = PWM(chip, channel, resolution_ns=1000, refresh_interval=refresh_interval,
+                       backend=backend)
         self.is_steering = is_steering
         
         # 如果是转向舵机，尝试从文件加载配置
@@ -80,7 +83,12 @@ class Servo:
 
     def set_us(self, us):
         us = max(self.min_us, min(us, self.max_us))
-        self.pwm.set_duty_cycle(us * 1000)
+        # 摇杆不动时脉宽不变，直接跳过 sysfs 写入
+        self.pwm.update_duty_cycle(us * 1000)
+
+    def get_write_stats(self):
+        """返回实际写入次数和被抑制的次数"""
+        return {"writes": self.pwm.writes, "suppressed": self.pwm.suppressed}
 
     def set_angle(self, angle):
         """
@@ -106,4 +114,5 @@ class Servo:
 
     def stop(self):
         self.pwm.disable()
+        self.pwm.close()
 
@@ -0,0 +1,363 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from abr import ClientRateController, socket_unsent_bytes
+
+# 简单的全屏 HTML 模板
+# 将视频流作为背景全屏显示，padding:0, margin:0
+PAGE = """
+<html>
+<head>
+<title>LubanCat FPV</title>
+<style>
+body {
+    margin: 0;
+    padding: 0;
+    background-color: #000;
+    display: flex;
+    justify-content: center;
+    align-items: center;
+    height: 100vh;
+    overflow: hidden;
+}
+img {
+    height: 100%;
+    width: auto;
+    object-fit: contain;
+}
+</style>
+</head>
+<body>
+<img src="/video_feed">
+</body>
+</html>
+"""
+
+# 每个客户端的发送缓冲上限：transport 里有数据没写进内核就先等 drain，
+# 等待期间到达的帧直接跳过，恢复后发最新的一帧，而不是排队
+WRITE_HIGH_WATER = 0
+SEND_BUFFER_SIZE = 16 * 1024   # 内核发送缓冲区 16KB（更小以避免堆积）
+MAX_HEADER_BYTES = 8192
+
+_PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+
+_REASONS = {200: "OK", 304: "Not Modified", 404: "Not Found", 405: "Method Not Allowed",
+            503: "Service Unavailable"}
+
+
+class StreamServer:
+    """
+    单线程 asyncio HTTP 服务器，所有客户端在同一个事件循环里处理，
+    不再一个观看者一个线程，避免和 100Hz 控制循环抢 GIL。
+
+    source 需要提供：
+      - latest_frame_id()
+      - peek_encoded_frame(quality, level) -> (frame_id, jpeg) 或 None (需要编码)
+      - get_encoded_frame(quality, level) -> (frame_id, jpeg)，可能阻塞编码，在线程池中调用
+      - peek_snapshot() -> (frame_id, jpeg) 或 None：当前帧已有的任意 JPEG，不触发编码
+      - save_blackbox() -> (path, frames)：把视频黑匣子写到磁盘，可能阻塞，在线程池中调用
+      - set_viewers(count)：视频流观看者数量变化时通知，用于按需采集
+    """
+    def __init__(self, source, port=8080, host='0.0.0.0',
+                 min_quality=5, max_quality=30, initial_quality=20, min_fps=5, max_fps=30,
+                 levels=("full",)):
+        self.source = source
+        self.host = host
+        self.port = port
+        # 每个连接各自的 ABR 控制器的上下限
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.initial_quality = initial_quality
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        # 分辨率档位名称，下标即 level (0 为全分辨率)
+        self.levels = list(levels)
+        # 当前视频流连接 -> ClientRateController，用于观察每个客户端的收敛情况
+        self.stream_clients = {}
+
+        # 路由表：method -> {path -> async handler(reader, writer, query, headers, keep_alive)}
+        # handler 返回 True 表示连接可以继续复用；有副作用的 (写磁盘) 只走 POST
+        self.routes = {
+            'GET': {
+                '/': self._handle_page,
+                '/video_feed': self._handle_video_feed,
+                '/snapshot.jpg': self._handle_snapshot,
+            },
+            'POST': {
+                '/blackbox/dump': self._handle_blackbox_dump,
+            },
+        }
+        # ETag = 启动时间 + frame_id，进程重启后 frame_id 从头计数也不会撞上旧的 ETag
+        self._etag_prefix = format(time.time_ns() // 1000000, 'x')
+
+        self.loop = None
+        self._thread = None
+        self._server = None
+        self._stop_event = None
+        self._clients = set()
+        self._frame_waiter = None
+        self._started = threading.Event()
+        self.start_error = None
+        # 编码放到单独线程：cv2 / TurboJPEG 编码时会释放 GIL，不阻塞事件循环
+        self._encoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jpeg-encode")
+
+    # ---------------- 生命周期 ----------------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._started.wait(timeout=5)
+        if self.start_error:
+            raise self.start_error
+
+    def _run(self):
+        try:
+            asyncio.run(self._main())
+        except Exception as e:
+            self.start_error = e
+            self._started.set()
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._frame_waiter = self.loop.create_future()
+        self._server = await asyncio.start_server(
+            self._handle_client, self.host, self.port, reuse_address=True)
+        self._started.set()
+
+        await self._stop_event.wait()
+
+        self._server.close()
+        await self._server.wait_closed()
+        for task in list(self._clients):
+            task.cancel()
+        if self._clients:
+            await asyncio.gather(*self._clients, return_exceptions=True)
+
+    def stop(self, timeout=2.0):
+        """干净地关闭：停止监听、取消所有客户端、等待事件循环线程退出"""
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                pass  # 事件循环已经结束
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        self._encoder.shutdown(wait=False)
+
+    # ---------------- 新帧通知 ----------------
+    def notify_frame(self):
+        """采集线程每发布一帧调用一次 (线程安全)"""
+        loop = self.loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._wake_clients)
+            except RuntimeError:
+                pass
+
+    def _wake_clients(self):
+        # 广播：所有等待者共用一个 future，置位后换一个新的
+        waiter = self._frame_waiter
+        self._frame_waiter = self.loop.create_future()
+        if not waiter.done():
+            waiter.set_result(None)
+
+    async def _wait_new_frame(self, last_id, timeout=0.5):
+        """等到比 last_id 更新的帧，超时返回 None"""
+        frame_id = self.source.latest_frame_id()
+        if frame_id > last_id:
+            return frame_id
+        # asyncio.wait 超时不会取消共享的 future
+        await asyncio.wait((self._frame_waiter,), timeout=timeout)
+        frame_id = self.source.latest_frame_id()
+        return frame_id if frame_id > last_id else None
+
+    def get_client_stats(self):
+        """每个视频流客户端当前的画质、帧率、实测吞吐与积压"""
+        return [{
+            "peer": peer,
+            "quality": abr.quality,
+            "res": self.levels[abr.level],
+            "fps": round(abr.fps, 1),
+            "throughput_kbps": round(abr.throughput * 8 / 1000, 1),
+            "backlog_frames": round(abr.backlog_frames, 2),
+        } for peer, abr in list(self.stream_clients.items())]
+
+    async def _get_jpeg(self, quality, level):
+        cached = self.source.peek_encoded_frame(quality, level)
+        if cached is not None:
+            return cached
+        return await self.loop.run_in_executor(self._encoder, self.source.get_encoded_frame,
+                                               quality, level)
+
+    # ---------------- HTTP ----------------
+    async def _handle_client(self, reader, writer):
+        task = asyncio.current_task()
+        self._clients.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                size = len(request_line)
+                while True:
+                    line = await reader.readline()
+                    size += len(line)
+                    if not line or line in (b'\r\n', b'\n') or size > MAX_HEADER_BYTES:
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    break
+                method, target, version = parts
+                path, _, query = target.partition('?')
+                conn = headers.get('connection', '').lower()
+                keep_alive = (conn == 'keep-alive') if version == 'HTTP/1.0' else (conn != 'close')
+
+                # 请求体用不到，读掉丢弃，连接才能继续复用
+                try:
+                    body_size = int(headers.get('content-length', 0))
+                except ValueError:
+                    break
+                if body_size > MAX_HEADER_BYTES:
+                    break
+                if body_size > 0:
+                    await reader.readexactly(body_size)
+
+                handler = self.routes.get(method, {}).get(path)
+                if handler is None and any(path in routes for routes in self.routes.values()):
+                    await self._send_simple(writer, 405, b'', keep_alive)
+                elif handler is None:
+                    await self._send_simple(writer, 404, b'Not Found', keep_alive)
+                elif not await handler(reader, writer, query, headers, keep_alive):
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._clients.discard(task)
+            writer.close()
+
+    @staticmethod
+    def _response_head(status, headers, keep_alive):
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}"]
+        lines.extend(f"{k}: {v}" for k, v in headers)
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+    async def _send_simple(self, writer, status, body, keep_alive, content_type='text/plain'):
+        head = self._response_head(status, [('Content-Type', content_type),
+                                            ('Content-Length', len(body))], keep_alive)
+        writer.write(head + body)
+        await writer.drain()
+
+    async def _handle_page(self, reader, writer, query, headers, keep_alive):
+        # 1. 根路径 /，返回 HTML 网页（大屏幕模式）
+        await self._send_simple(writer, 200, PAGE.encode('utf-8'), keep_alive, 'text/html')
+        return True
+
+    async def _handle_snapshot(self, reader, writer, query, headers, keep_alive):
+        # 单张图片：优先用已经编好的 JPEG，当前帧完全没编过才编码一次 (之后的请求都命中缓存)
+        cached = self.source.peek_snapshot()
+        if cached is None:
+            cached = await self._get_jpeg(self.initial_quality, 0)
+        frame_id, payload = cached
+        if payload is None:
+            await self._send_simple(writer, 503, b'No frame yet', keep_alive)
+            return True
+
+        etag = f'"{self._etag_prefix}-{frame_id}"'
+        if_none_match = headers.get('if-none-match', '')
+        if if_none_match == '*' or etag in (tag.strip() for tag in if_none_match.split(',')):
+            writer.write(self._response_head(304, [('ETag', etag), ('Cache-Control', 'no-cache')],
+                                             keep_alive))
+        else:
+            writer.writelines((self._response_head(200, [
+                ('Content-Type', 'image/jpeg'),
+                ('Content-Length', len(payload)),
+                ('ETag', etag),
+                ('Cache-Control', 'no-cache'),
+            ], keep_alive), payload))
+        await writer.drain()
+        return True
+
+    async def _handle_blackbox_dump(self, reader, writer, query, headers, keep_alive):
+        # 写 SD 卡放到默认线程池，不占编码线程也不阻塞事件循环
+        path, frames = await self.loop.run_in_executor(None, self.source.save_blackbox)
+        body = json.dumps({"path": path, "frames": frames}).encode('utf-8')
+        await self._send_simple(writer, 200 if path else 503, body, keep_alive, 'application/json')
+        return True
+
+    async def _handle_video_feed(self, reader, writer, query, headers, keep_alive):
+        # 2. /video_feed，返回 MJPEG 流
+        sock = writer.get_extra_info('socket')
+        try:
+            # 优化 Socket 发送缓冲区，防止网络卡顿时数据堆积产生延迟
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+            # 设置 TCP_NODELAY 减少延迟
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
+        writer.transport.set_write_buffer_limits(high=WRITE_HIGH_WATER)
+
+        writer.write(self._response_head(200, [
+            ('Content-Type', 'multipart/x-mixed-replace; boundary=frame'),
+            ('Cache-Control', 'no-cache'),
+        ], False))
+
+        # 初始化为当前帧的前一帧，确保连接建立后立刻开始传输
+        last_sent_frame_id = self.source.latest_frame_id() - 1
+        # ?res=half：客户端要求的最高分辨率档位，ABR 只会在它和最小档之间调整
+        res = parse_qs(query).get('res', [self.levels[0]])[0]
+        finest = self.levels.index(res) if res in self.levels else 0
+        # 每个连接独立的码率控制：慢客户端只降自己的画质/分辨率/帧率
+        abr = ClientRateController(self.min_quality, self.max_quality,
+                                   self.min_fps, self.max_fps, self.initial_quality,
+                                   finest_level=finest, coarsest_level=len(self.levels) - 1)
+        peer = writer.get_extra_info('peername')
+        self.stream_clients[peer] = abr
+        self.source.set_viewers(len(self.stream_clients))
+
+        try:
+            while True:
+                current_frame_id = await self._wait_new_frame(last_sent_frame_id)
+                if current_frame_id is None:
+                    continue
+
+                # 帧率限制 (由 ABR 决定)：睡到下一次允许发送，醒来后直接取最新帧
+                now = time.perf_counter()
+                delay = abr.send_delay(now)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+
+                # === ABR：内核发送队列积压 + 实测吞吐 → 画质/帧率 ===
+                unsent = socket_unsent_bytes(sock) + writer.transport.get_write_buffer_size()
+                abr.update(unsent, now)
+
+                # 3. 取当前帧的 JPEG（同一帧同一档位同一画质只编码一次，所有客户端共享）
+                current_frame_id, payload = await self._get_jpeg(abr.quality, abr.level)
+                if payload is None:
+                    # 这一帧编码失败就跳过，等下一帧，不要反复重试同一帧
+                    last_sent_frame_id = current_frame_id
+                    continue
+
+                writer.writelines((_PART_HEADER, payload, b'\r\n'))
+                abr.on_sent(len(_PART_HEADER) + len(payload) + 2, now)
+                # drain 期间到达的帧不会排队，发完后直接取最新帧
+                await writer.drain()
+                abr.on_drained(time.perf_counter())
+
+                last_sent_frame_id = current_frame_id
+        finally:
+            self.stream_clients.pop(peer, None)
+            self.source.set_viewers(len(self.stream_clients))
@@ -0,0 +1,141 @@
+import mmap
+import os
+import struct
+import sys
+import time
+
+# 控制循环黑匣子：每个 tick 一条定长记录，写进预分配的内存映射环形文件。
+# 循环里只有一次 pack_into (写到页缓存)，不 fsync，由内核按自己的节奏回写，
+# 进程崩溃也不会丢数据 (已经在页缓存里)，掉电最多丢最近几十秒。
+#
+# 文件布局：[头部 64B][记录 0][记录 1]...[记录 capacity-1]
+# 头部：magic, version, 记录大小, 容量, 已写记录总数, 创建时间 (unix ns)
+
+MAGIC = b"TLM1"
+VERSION = 1
+TELEMETRY_RECORDS = 65536  # 100Hz 约 11 分钟，约 5.5MB
+
+_HEADER = struct.Struct("<4sIIIQQ")
+_HEADER_SIZE = 64
+_COUNT_OFFSET = 16
+_COUNT = struct.Struct("<Q")
+
+# 一条记录 (小端、无填充)：
+#   t_ns        u64  tick 开始时间 (CLOCK_MONOTONIC)
+#   tick_ns     u32  本轮从开始到写完的耗时 (超过 U32_MAX 约 4.29 s 的记为 U32_MAX)
+#   period_ns   u32  与上一轮开始的间隔 (同上)
+#   sbus_seq    u32  本轮使用的 SBUS 帧序号
+#   channels    16 x u16  原始通道值
+#   flags       u8   SBUS flags 字节
+#   mode        u8   bit0 链路正常, bit1 校准模式
+#   dir_a/dir_b i8   电机方向 (1 / -1 / 0)
+#   throttle, steering, camera  f32  map_sbus_to_pwm 的结果 (没算的为 NaN)
+#   servo/cam_servo/motor_a/motor_b duty  u32  实际写入的占空比 (ns)
+RECORD = struct.Struct("<QIII16HBBbb3f4I")
+RECORD_FIELDS = (
+    ("t_ns", "<u8"), ("tick_ns", "<u4"), ("period_ns", "<u4"), ("sbus_seq", "<u4"),
+    ("channels", "<u2", (16,)), ("flags", "u1"), ("mode", "u1"), ("dir_a", "i1"), ("dir_b", "i1"),
+    ("throttle", "<f4"), ("steering", "<f4"), ("camera", "<f4"),
+    ("duty_servo", "<u4"), ("duty_cam_servo", "<u4"), ("duty_motor_a", "<u4"), ("duty_motor_b", "<u4"),
+)
+
+# u32 字段能存的最大值，tick_ns / period_ns 写入前截到这里
+U32_MAX = 0xFFFFFFFF
+
+MODE_LINK_OK = 1
+MODE_CALIBRATION = 2
+
+
+class TelemetryRecorder:
+    """
+    append-only 环形记录器。每次运行新建文件，上一次的日志改名为 <name>.prev 保留。
+    """
+    def __init__(self, path, capacity=TELEMETRY_RECORDS):
+        self.path = path
+        self.capacity = capacity
+        self.count = 0
+        if os.path.exists(path):
+            os.replace(path, path + ".prev")
+        size = _HEADER_SIZE + capacity * RECORD.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            # 一次性分配磁盘空间，运行中不会因为扩展文件去写元数据
+            os.posix_fallocate(self._fd, 0, size)
+        except (AttributeError, OSError):
+            os.ftruncate(self._fd, size)
+        self.mm = mmap.mmap(self._fd, size)
+        _HEADER.pack_into(self.mm, 0, MAGIC, VERSION, RECORD.size, capacity, 0, time.time_ns())
+        self._pack = RECORD.pack_into
+
+    def append(self, *values):
+        """按 RECORD 的字段顺序传入一条记录 (channels 展开为 16 个值)"""
+        offset = _HEADER_SIZE + (self.count % self.capacity) * RECORD.size
+        self._pack(self.mm, offset, *values)
+        self.count += 1
+        _COUNT.pack_into(self.mm, _COUNT_OFFSET, self.count)
+
+    def close(self):
+        if self.mm is None:
+            return
+        self.mm.flush()
+        self.mm.close()
+        os.close(self._fd)
+        self.mm = None
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, record_size, capacity, count, created_ns = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a telemetry log")
+    return data, record_size, capacity, count
+
+
+def read_records(path):
+    """不依赖 NumPy 的读取：按时间顺序返回 RECORD 解包出来的元组列表 (channels 展开为 16 个值)"""
+    data, record_size, capacity, count = _read(path)
+    if record_size != RECORD.size:
+        raise ValueError(f"record size mismatch: file {record_size}, reader {RECORD.size}")
+    records = list(RECORD.iter_unpack(data[_HEADER_SIZE:_HEADER_SIZE + capacity * RECORD.size]))
+    if count <= capacity:
+        return records[:count]
+    start = count % capacity
+    return records[start:] + records[:start]
+
+
+def load(path):
+    """读取日志为 NumPy 结构化数组，按时间顺序排列 (环形覆盖过的只剩最近 capacity 条)"""
+    import numpy as np
+    data, record_size, capacity, count = _read(path)
+    dtype = np.dtype(list(RECORD_FIELDS))
+    if dtype.itemsize != record_size:
+        raise ValueError(f"record size mismatch: file {record_size}, reader {dtype.itemsize}")
+    records = np.frombuffer(data, dtype=dtype, count=capacity, offset=_HEADER_SIZE)
+    if count <= capacity:
+        return records[:count].copy()
+    # 环已经转过：最旧的一条在 count % capacity
+    return np.roll(records, -(count % capacity))
+
+
+def main():
+    import numpy as np
+    if len(sys.argv) < 2:
+        print("Usage: python3 telemetry.py <telemetry.bin>")
+        return
+    rec = load(sys.argv[1])
+    if not len(rec):
+        print("empty log")
+        return
+    duration = (int(rec["t_ns"][-1]) - int(rec["t_ns"][0])) / 1e9
+    period = rec["period_ns"][1:] / 1e3
+    tick = rec["tick_ns"] / 1e3
+    link_ok = (rec["mode"] & MODE_LINK_OK) != 0
+    print(f"{len(rec)} ticks over {duration:.1f} s, link ok {link_ok.mean():.1%}")
+    if len(period):
+        print(f"period us: mean {period.mean():.0f} p99 {np.percentile(period, 99):.0f} max {period.max():.0f}")
+    print(f"tick us:   mean {tick.mean():.0f} p99 {np.percentile(tick, 99):.0f} max {tick.max():.0f}")
+
+
+if __name__ == "__main__":
+    main()
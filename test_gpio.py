@@ -0,0 +1,134 @@
+"""
+ChardevGPIO 的 ioctl 参数布局：fcntl.ioctl 换成假的，检查手工打包的 gpio_v2_line_request
+(592 字节) 和 GPIO_V2_LINE_SET_VALUES 的 bits/mask。偏移按 include/uapi/linux/gpio.h 独立写出，
+不引用 gpio.py 里的常量。
+
+    python3 -m unittest test_gpio
+"""
+import struct
+import unittest
+from unittest import mock
+
+import gpio
+from motor import Motor, DirectionLines
+
+# _IOWR(0xB4, 0x07, struct gpio_v2_line_request) / _IOWR(0xB4, 0x0F, struct gpio_v2_line_values)
+GET_LINE_IOCTL = 0xC250B407
+SET_VALUES_IOCTL = 0xC010B40F
+
+FIRST_LINE_FD = 100
+
+# main.py 的 PIN_IN1..PIN_IN4
+PIN_IN1, PIN_IN2, PIN_IN3, PIN_IN4 = 19, 21, 129, 98
+
+
+class FakeIoctl:
+    """记下每次 ioctl 的参数副本；GET_LINE 时按内核的做法把新的 line fd 填回 request"""
+    def __init__(self):
+        self.requests = []   # (chip fd, request bytes)
+        self.writes = []     # (line fd, bits, mask)
+        self._next_fd = FIRST_LINE_FD
+
+    def __call__(self, fd, request, arg):
+        if request == GET_LINE_IOCTL:
+            self.requests.append((fd, bytes(arg)))
+            struct.pack_into("<i", arg, 588, self._next_fd)
+            self._next_fd += 1
+        elif request == SET_VALUES_IOCTL:
+            bits, mask = struct.unpack("<QQ", arg)
+            self.writes.append((fd, bits, mask))
+        else:
+            raise AssertionError(f"unexpected ioctl {request:#x}")
+        return 0
+
+
+class ChardevGPIOTest(unittest.TestCase):
+    PINS = (PIN_IN1, PIN_IN2, PIN_IN3, PIN_IN4)
+
+    def setUp(self):
+        self.ioctl = FakeIoctl()
+        self.chip_paths = []
+
+        def fake_open(path, flags):
+            self.chip_paths.append(path)
+            return len(self.chip_paths)
+
+        patches = [
+            mock.patch.object(gpio.fcntl, "ioctl", self.ioctl),
+            mock.patch.object(gpio.os, "open", fake_open),
+            mock.patch.object(gpio.os, "close", lambda fd: None),
+            # 没有 gpiochip*/base 可查：按每 bank 32 线推算
+            mock.patch.object(gpio, "GPIO_SYSFS_ROOT", "/nonexistent"),
+            mock.patch.object(gpio, "GPIO_DEV_DIR", "/dev"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.gpio = gpio.ChardevGPIO(self.PINS)
+
+    def test_ioctl_numbers(self):
+        self.assertEqual(gpio.GPIO_V2_GET_LINE_IOCTL, GET_LINE_IOCTL)
+        self.assertEqual(gpio.GPIO_V2_LINE_SET_VALUES_IOCTL, SET_VALUES_IOCTL)
+
+    def test_line_request_layout(self):
+        # 19/21 在 gpiochip0，129 在 gpiochip4，98 在 gpiochip3：每个 chip 一次请求
+        self.assertEqual(self.chip_paths, ["/dev/gpiochip0", "/dev/gpiochip4", "/dev/gpiochip3"])
+        expected_offsets = ([19, 21], [1], [2])
+        for (chip_fd, req), offsets in zip(self.ioctl.requests, expected_offsets):
+            self.assertEqual(len(req), 592)
+            n = len(offsets)
+            self.assertEqual(list(struct.unpack_from(f"<{n}I", req, 0)), offsets)
+            self.assertEqual(req[4 * n:256], bytes(256 - 4 * n))
+            self.assertEqual(req[256:288].rstrip(b"\0"), b"faster_car")
+            # gpio_v2_line_config: flags = OUTPUT，1 个属性
+            flags, num_attrs = struct.unpack_from("<QI", req, 288)
+            self.assertEqual(flags, 1 << 3)
+            self.assertEqual(num_attrs, 1)
+            self.assertEqual(req[300:320], bytes(20))
+            # attrs[0]: OUTPUT_VALUES，所有线初始为 0
+            attr_id, padding, values, mask = struct.unpack_from("<IIQQ", req, 320)
+            self.assertEqual((attr_id, padding, values, mask), (2, 0, 0, (1 << n) - 1))
+            self.assertEqual(req[344:560], bytes(216))
+            # num_lines / event_buffer_size / padding；fd 由内核填
+            self.assertEqual(struct.unpack_from("<II", req, 560), (n, 0))
+            self.assertEqual(req[568:592], bytes(24))
+
+    def test_set_values_bits_and_mask(self):
+        self.gpio.set_values(((PIN_IN1, 1), (PIN_IN2, 0), (PIN_IN3, 0), (PIN_IN4, 1)))
+        self.assertEqual(self.ioctl.writes, [
+            (FIRST_LINE_FD, 0b01, 0b11),      # gpiochip0: 19 -> bit0, 21 -> bit1
+            (FIRST_LINE_FD + 1, 0, 1),        # gpiochip4: 129
+            (FIRST_LINE_FD + 2, 1, 1),        # gpiochip3: 98
+        ])
+
+    def test_set_values_only_touches_requested_chips(self):
+        self.gpio.set_values(((PIN_IN2, 1),))
+        self.gpio.set_values(((PIN_IN1, 0),))
+        # 上一次的 bits/mask 不会带到下一次
+        self.assertEqual(self.ioctl.writes, [(FIRST_LINE_FD, 0b10, 0b10), (FIRST_LINE_FD, 0, 0b01)])
+
+    def test_same_chip(self):
+        self.assertTrue(self.gpio.same_chip((PIN_IN1, PIN_IN2)))
+        self.assertFalse(self.gpio.same_chip((PIN_IN3, PIN_IN4)))
+
+
+class DirectionLinesTest(unittest.TestCase):
+    def test_one_set_values_per_tick(self):
+        lines = DirectionLines(gpio.MemoryGPIO((PIN_IN1, PIN_IN2, PIN_IN3, PIN_IN4)))
+        motor_a = Motor(2, 0, PIN_IN2, PIN_IN1, gpio=lines, backend="memory")
+        motor_b = Motor(0, 0, PIN_IN3, PIN_IN4, gpio=lines, backend="memory")
+        motor_a.set_speed(0.5)
+        motor_b.set_speed(0.5)
+        self.assertEqual(lines.gpio.calls, 0)
+        lines.flush()
+        self.assertEqual(lines.gpio.calls, 1)
+        self.assertEqual(lines.gpio.values, {PIN_IN2: 1, PIN_IN1: 0, PIN_IN3: 1, PIN_IN4: 0})
+        # 方向没变：这一轮什么都不写
+        motor_a.set_speed(0.6)
+        motor_b.set_speed(0.6)
+        lines.flush()
+        self.assertEqual(lines.gpio.calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
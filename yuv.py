@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+
+# 摄像头原生 YUV 格式 -> TurboJPEG encode_from_yuv 需要的平面 YUV (Y 平面 + U 平面 + V 平面)
+# 只做字节搬运 (numpy 切片)，不做任何颜色空间转换
+#
+# 平面布局 (行数 x width 的连续数组)：
+#   "420": Y h 行 + U h/4 行 + V h/4 行 = h*3/2 行 (即 I420)
+#   "422": Y h 行 + U h/2 行 + V h/2 行 = h*2 行
+# encode_from_yuv 按 4 字节对齐行宽，宽度 (含缩小档位) 最好是 8 的倍数
+
+SUBSAMPLES = ("420", "422")
+
+# V4L2 fourcc -> 每像素字节数 (用来校验 OpenCV 给的原始缓冲大小)
+RAW_BYTES_PER_PIXEL = {"YUYV": 2.0, "NV12": 1.5}
+
+
+def planar_shape(width, height, subsample):
+    if subsample == "422":
+        return (height * 2, width)
+    return (height * 3 // 2, width)
+
+
+def raw_size(fourcc, width, height):
+    return int(width * height * RAW_BYTES_PER_PIXEL[fourcc])
+
+
+def _chroma_planes(out, width, height, subsample):
+    chroma = out[height:].reshape(-1)
+    if subsample == "422":
+        shape = (height, width // 2)
+    else:
+        shape = (height // 2, width // 2)
+    n = shape[0] * shape[1]
+    return chroma[:n].reshape(shape), chroma[n:2 * n].reshape(shape)
+
+
+def yuyv_to_planar(raw, out, width, height, subsample="420"):
+    """YUYV (Y0 U Y1 V 交错, 4:2:2) 拆成平面；420 时色度隔行取"""
+    packed = raw.reshape(height, width * 2)
+    out[:height] = packed[:, 0::2]
+    u, v = _chroma_planes(out, width, height, subsample)
+    if subsample == "422":
+        u[...] = packed[:, 1::4]
+        v[...] = packed[:, 3::4]
+    else:
+        u[...] = packed[0::2, 1::4]
+        v[...] = packed[0::2, 3::4]
+    return out
+
+
+def nv12_to_planar(raw, out, width, height, subsample="420"):
+    """NV12 (Y 平面 + UV 交错, 4:2:0) 拆成 I420；NV12 本身只有 420"""
+    flat = raw.reshape(-1)
+    ysize = width * height
+    out[:height] = flat[:ysize].reshape(height, width)
+    uv = flat[ysize:ysize + ysize // 2].reshape(height // 2, width // 2, 2)
+    u, v = _chroma_planes(out, width, height, "420")
+    u[...] = uv[..., 0]
+    v[...] = uv[..., 1]
+    return out
+
+
+def downscale_planar(src, width, height, subsample, factor, out=None):
+    """平面 YUV 缩小 factor 倍：Y、U、V 三个平面分别 INTER_AREA 缩放"""
+    w, h = width // factor, height // factor
+    if out is None or out.shape != planar_shape(w, h, subsample):
+        out = np.empty(planar_shape(w, h, subsample), dtype=np.uint8)
+    out[:h] = cv2.resize(src[:height], (w, h), interpolation=cv2.INTER_AREA)
+    for s, d in zip(_chroma_planes(src, width, height, subsample),
+                    _chroma_planes(out, w, h, subsample)):
+        d[...] = cv2.resize(s, d.shape[::-1], interpolation=cv2.INTER_AREA)
+    return out
+
+
+TO_PLANAR = {"YUYV": yuyv_to_planar, "NV12": nv12_to_planar}